@@ -0,0 +1,167 @@
+import gzip
+import io
+import queue
+import threading
+import zipfile
+from fnmatch import fnmatch
+from functools import lru_cache
+from pathlib import Path
+from typing import BinaryIO, Dict, FrozenSet, List, Optional, TextIO, Tuple, Union
+
+READ_AHEAD_BYTES = 1 << 20  # decompressed bytes per chunk handed from the decompression thread to the parser
+READ_AHEAD_CHUNKS = 8  # chunks decompressed ahead of the parser, bounding the memory held per open file
+
+@lru_cache(maxsize=64)
+def _zip_names(archive: str, mtime_ns: int) -> FrozenSet[str]:
+  """Return the member names of a zip archive, read once per archive version."""
+  with zipfile.ZipFile(archive) as zip_file:
+    return frozenset(zip_file.namelist())
+
+def _zip_member(file_path: Path) -> Optional[Tuple[Path, str]]:
+  """Split a path inside a zip archive, such as data/voltage_data/2024.zip/January-Grid-Voltage.csv, into the archive and member name."""
+  for parent in file_path.parents:
+    if parent.suffix.lower() == ".zip" and parent.is_file():
+      return parent, file_path.relative_to(parent).as_posix()
+  return None
+
+def folder_archives(folder: Path) -> List[Path]:
+  """Return the zip archives that may hold a data folder's files: {folder}.zip first, then the other archives beside the folder."""
+  folder = Path(folder)
+  own = folder.with_name(f"{folder.name}.zip")
+  return ([own] if own.is_file() else []) + [archive for archive in sorted(folder.parent.glob("*.zip")) if archive != own]
+
+def _archive_members(folder: Path) -> Dict[str, Path]:
+  """Map the file names of a folder held in zip archives to their paths inside the archives. Earlier archives win."""
+  members: Dict[str, Path] = {}
+  for archive in folder_archives(folder):
+    for name in sorted(_zip_names(str(archive), archive.stat().st_mtime_ns)):
+      if archive.stem == folder.name and "/" not in name:
+        members.setdefault(name, archive / name)
+      elif name.startswith(f"{folder.name}/") and name.count("/") == 1:
+        members.setdefault(name.split("/", 1)[1], archive / name)
+  return members
+
+def locate(file_path: Path) -> Optional[Path]:
+  """Return where an input file is stored, or None if it is missing.
+
+  The file is used as is if it exists, then compressed beside it as {name}.gz, then as a member of a zip
+  archive of its folder: {folder}.zip holding {name} or {folder}/{name}, or another archive beside the
+  folder holding {folder}/{name}, e.g. data/voltage_data/history.zip with 2021/January-Grid-Voltage.csv.
+  """
+  file_path = Path(file_path)
+  if file_path.exists():
+    return file_path
+  compressed = file_path.with_name(f"{file_path.name}.gz")
+  if compressed.exists():
+    return compressed
+  return _archive_members(file_path.parent).get(file_path.name)
+
+def locate_all(folder: Path, pattern: str) -> List[Path]:
+  """Locate the files of a folder whose names match a glob pattern, whether plain, gzip-compressed or archived."""
+  folder = Path(folder)
+  names = set(_archive_members(folder))
+  if folder.is_dir():
+    names.update(path.name[:-3] if path.suffix == ".gz" else path.name for path in folder.iterdir() if path.is_file())
+  return [locate(folder / name) for name in sorted(names) if fnmatch(name, pattern)]
+
+def folder_exists(folder: Path) -> bool:
+  """Return True if a data folder exists on disk or in a zip archive."""
+  folder = Path(folder)
+  return folder.is_dir() or bool(_archive_members(folder))
+
+class ReadAheadStream(io.RawIOBase):
+  """Read a decompressing stream on a background thread, up to READ_AHEAD_CHUNKS chunks ahead of the reader.
+
+  zlib releases the GIL while it inflates, so the next chunks decompress while the current one is parsed.
+  """
+
+  def __init__(self, source: BinaryIO, chunk_bytes: int = READ_AHEAD_BYTES, chunks: int = READ_AHEAD_CHUNKS):
+    super().__init__()
+    self._source = source
+    self._chunk_bytes = chunk_bytes
+    self._chunks: queue.Queue = queue.Queue(maxsize=chunks)
+    self._pending = memoryview(b"")
+    self._eof = False
+    self._stop = threading.Event()
+    self._thread = threading.Thread(target=self._decompress, name="decompress", daemon=True)
+    self._thread.start()
+
+  def _put(self, item: Union[bytes, BaseException]) -> None:
+    """Queue a chunk, giving up if the stream is closed while the queue is full."""
+    while not self._stop.is_set():
+      try:
+        self._chunks.put(item, timeout=0.1)
+        return
+      except queue.Full:
+        continue
+
+  def _decompress(self) -> None:
+    """Decompress the source chunk by chunk until it ends. An empty chunk marks the end and an exception is passed on to the reader."""
+    try:
+      while not self._stop.is_set():
+        chunk = self._source.read(self._chunk_bytes)
+        self._put(chunk)
+        if not chunk:
+          return
+    except Exception as e:
+      self._put(e)
+
+  def readable(self) -> bool:
+    return True
+
+  def readinto(self, buffer: memoryview) -> int:
+    while not self._pending:
+      if self._eof:
+        return 0
+      item = self._chunks.get()
+      if isinstance(item, BaseException):
+        self._eof = True
+        raise item
+      if not item:
+        self._eof = True
+        return 0
+      self._pending = memoryview(item)
+    size = min(len(buffer), len(self._pending))
+    buffer[:size] = self._pending[:size]
+    self._pending = self._pending[size:]
+    return size
+
+  def close(self) -> None:
+    if not self.closed:
+      self._stop.set()
+      self._thread.join()
+      self._source.close()
+    super().close()
+
+def open_binary(file_path: Path) -> BinaryIO:
+  """Open a file returned by locate() for reading bytes. Gzip files and zip members are decompressed on a background thread."""
+  file_path = Path(file_path)
+  member = _zip_member(file_path)
+  if member:
+    with zipfile.ZipFile(member[0]) as zip_file:
+      source = zip_file.open(member[1])  # keeps the archive open until the member is closed
+  elif file_path.suffix.lower() == ".gz":
+    source = gzip.open(file_path, mode='rb')
+  else:
+    return open(file_path, mode='rb')
+  return io.BufferedReader(ReadAheadStream(source), buffer_size=READ_AHEAD_BYTES)
+
+def open_text(file_path: Path, encoding: str) -> TextIO:
+  """Open a file returned by locate() for reading CSV text in the given encoding."""
+  return io.TextIOWrapper(open_binary(file_path), encoding=encoding, newline='')
+
+def uncompressed_size(file_path: Path) -> int:
+  """Return the size in bytes of the contents of a file returned by locate(), without decompressing it.
+
+  The size of a gzip file is read from its trailer, which holds it modulo 2**32 and only for the last member.
+  """
+  file_path = Path(file_path)
+  member = _zip_member(file_path)
+  if member:
+    with zipfile.ZipFile(member[0]) as zip_file:
+      return zip_file.getinfo(member[1]).file_size
+  if file_path.suffix.lower() == ".gz":
+    with open(file_path, mode='rb') as infile:
+      infile.seek(-4, io.SEEK_END)
+      return int.from_bytes(infile.read(4), "little")
+  return file_path.stat().st_size
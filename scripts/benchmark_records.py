@@ -0,0 +1,71 @@
+import csv
+import io
+import sys
+import tracemalloc
+from typing import Callable
+import numpy as np
+from records import GENSET_FIELDS, GensetEvents, HarmonicSamples
+
+HARMONIC_FIELDS = ["Timestamp", "Month", "THD_I", "THD_V", "Apparent Power (kVA)"]
+
+def genset_csv(rows: int) -> str:
+  """Return a synthetic genset events CSV."""
+  lines = [",".join(GENSET_FIELDS)]
+  for idx in range(rows):
+    lines.append(f"2024-01-{idx % 28 + 1:02d},{idx % 24:02d}:{idx % 60:02d}:{idx % 60:02d},{idx % 90 + 0.5},{idx % 400 + 0.25}")
+  return "\n".join(lines) + "\n"
+
+def harmonic_csv(rows: int) -> str:
+  """Return a synthetic harmonic samples CSV."""
+  lines = [",".join(HARMONIC_FIELDS)]
+  for idx in range(rows):
+    lines.append(f"2024-01-01 {idx // 12 % 24:02d}:{idx % 12 * 5:02d}:00,January,{idx % 900 / 100},{idx % 700 / 100},{idx % 500 + 0.1}")
+  return "\n".join(lines) + "\n"
+
+def genset_dicts(text: str) -> list:
+  """Load genset events as csv.DictReader dicts."""
+  return list(csv.DictReader(io.StringIO(text)))
+
+def genset_events(text: str) -> GensetEvents:
+  """Load genset events into a GensetEvents container."""
+  reader = csv.reader(io.StringIO(text))
+  next(reader)
+  rows = list(reader)
+  return GensetEvents.parse(*([row[idx] for row in rows] for idx in range(len(GENSET_FIELDS))))[0]
+
+def harmonic_dicts(text: str) -> list:
+  """Load harmonic samples as csv.DictReader dicts."""
+  return list(csv.DictReader(io.StringIO(text)))
+
+def harmonic_samples(text: str) -> HarmonicSamples:
+  """Load harmonic samples into a HarmonicSamples container."""
+  reader = csv.reader(io.StringIO(text))
+  next(reader)
+  rows = list(reader)
+  return HarmonicSamples(
+    np.array([row[0] for row in rows], dtype="datetime64[s]"),
+    np.array([row[2] for row in rows], dtype=np.float64),
+    np.array([row[3] for row in rows], dtype=np.float64),
+    np.array([row[4] for row in rows], dtype=np.float64)
+  )
+
+def retained_bytes(load: Callable, text: str) -> int:
+  """Return the memory still held by the loaded records once parsing temporaries are freed."""
+  tracemalloc.start()
+  records = load(text)
+  retained, _ = tracemalloc.get_traced_memory()
+  tracemalloc.stop()
+  del records
+  return retained
+
+def main(rows: int) -> None:
+  for name, text, baseline, compact in (
+    ("Genset events", genset_csv(rows), genset_dicts, genset_events),
+    ("Harmonic samples", harmonic_csv(rows), harmonic_dicts, harmonic_samples)
+  ):
+    baseline_bytes = retained_bytes(baseline, text)
+    compact_bytes = retained_bytes(compact, text)
+    print(f"{name}: {baseline_bytes / rows:.0f} B/row as dicts, {compact_bytes / rows:.0f} B/row compact ({baseline_bytes / compact_bytes:.1f}x smaller)")
+
+if __name__ == "__main__":
+  main(int(sys.argv[1]) if len(sys.argv) > 1 else 100000)
@@ -0,0 +1,201 @@
+import json
+import logging
+import math
+import sys
+import time
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+import numpy as np
+import xlsxwriter
+from archives import locate
+from formatting import ColumnWidths, SheetFormatter
+from ingest import RejectReport, column_values, parse_numbers, parse_timestamp_column, read_table, reject_path
+from profiling import profiled
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+HOURS_PER_YEAR = 8760
+CANDIDATE_HEADERS = ["Bank (kVAR)", "Steps", "Step (kVAR)", "Capital Cost", "Annual Savings", "Payback (years)", "Lifetime Net Savings", "Mean PF After", "Intervals Below Target After"]
+CANDIDATE_FORMATS = ["decimal", "count", "decimal", "currency", "currency", "decimal", "currency", "ratio", "count"]
+
+class CapacitorBankSizing:
+  """Size an automatically switched capacitor bank against the load's kW/kVA profile.
+
+  Every interval the controller switches in as many steps as fit under the reactive demand, so the bank
+  never over-compensates. A candidate (bank kVAR, number of equal steps) is evaluated over all intervals
+  at once. Candidates are searched in order of capital cost per bank size and pruned with the savings of
+  continuous compensation of the same size, which bound the savings of any stepped configuration.
+  """
+
+  def __init__(self, config_file: str):
+    self.config_file = config_file
+    self.config = self.load_config()
+    self.months_list = [
+      "January", "February", "March", "April", "May", "June",
+      "July", "August", "September", "October", "November", "December"
+    ]
+    self.power_factor_config = self.config["power_factor"]
+    self.sizing_config = self.config.get("capacitor_sizing", {})
+    self.timestamp_format = self.power_factor_config.get("timestamp_format", "%d/%m/%Y %H:%M")
+    self.evaluated = 0
+    self.rejects = RejectReport()
+
+  def load_config(self) -> Dict:
+    """Load configuration from a JSON file."""
+    config_path = Path(self.config_file)
+    if not config_path.exists():
+      logging.error(f"{self.config_file} does not exist. Exiting.")
+      sys.exit()
+    logging.info(f"{self.config_file} exists. Loading...")
+    with open(config_path) as f:
+      config = json.load(f)
+      logging.info(f"Loaded {self.config_file}.")
+    return config
+
+  def _read_series(self, file_path: Path) -> Tuple[np.ndarray, np.ndarray]:
+    """Read a two-column (timestamp, value) export, whatever its delimiter and encoding, rejecting invalid rows."""
+    header, rows = read_table(file_path)
+    timestamp_values, number_values = column_values(rows, 0), column_values(rows, 1)
+    timestamps, valid_timestamps = parse_timestamp_column(timestamp_values, self.timestamp_format)
+    values, valid_values = parse_numbers(number_values)
+    self.rejects.record(file_path, header[0], timestamp_values, valid_timestamps, rows, "invalid timestamp")
+    self.rejects.record(file_path, header[1], number_values, valid_values, rows)
+    valid = valid_timestamps & valid_values
+    return timestamps[valid], values[valid]
+
+  def load_load_profile(self) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Load the kW and kVA series of every month present and return the matched timestamps, kW and kVA."""
+    year = self.config["year"]
+    parts = []
+    for month in self.months_list:
+      active_file = locate(Path(f"data/power_factor_savings_data/{year}/{month}-Load-Active-Power-kW.csv"))
+      apparent_file = locate(Path(f"data/power_factor_savings_data/{year}/{month}-Load-Apparent-Power-kVA.csv"))
+      if active_file is None or apparent_file is None:
+        continue
+      active_timestamps, active_power = self._read_series(active_file)
+      apparent_timestamps, apparent_power = self._read_series(apparent_file)
+      timestamps, active_idx, apparent_idx = np.intersect1d(active_timestamps, apparent_timestamps, return_indices=True)
+      if len(timestamps) < max(len(active_timestamps), len(apparent_timestamps)):
+        logging.warning(f"Dropped {max(len(active_timestamps), len(apparent_timestamps)) - len(timestamps)} unmatched samples in {month}.")
+      parts.append((timestamps, active_power[active_idx], apparent_power[apparent_idx]))
+      logging.info(f"Loaded {len(timestamps)} kW/kVA samples for {month}.")
+    if not parts:
+      logging.error(f"No kW/kVA data found in data/power_factor_savings_data/{year}. Exiting.")
+      sys.exit()
+    return tuple(np.concatenate(columns) for columns in zip(*parts))
+
+  def _interval_hours(self, timestamps: np.ndarray) -> float:
+    """Return the median spacing of the timestamps in hours."""
+    deltas = np.diff(timestamps).astype("timedelta64[s]").astype(np.float64)
+    deltas = deltas[deltas > 0]
+    return float(np.median(deltas)) / 3600 if len(deltas) else 5 / 60
+
+  def _interval_costs(self, active_power: np.ndarray, reactive_power: np.ndarray, interval_hours: float) -> np.ndarray:
+    """Return the reactive energy charge plus the penalty on reactive energy in excess of the penalty threshold, per interval."""
+    excess_limit = active_power * math.tan(math.acos(self.power_factor_config["penalty_threshold"]))
+    excess_reactive_power = np.maximum(reactive_power - excess_limit, 0.0)
+    return (reactive_power * self.power_factor_config["cost_per_kVARh"] + excess_reactive_power * self.power_factor_config["penalty_rate"]) * interval_hours
+
+  def _compensated(self, reactive_power: np.ndarray, bank_kvar: float, steps: Optional[int]) -> np.ndarray:
+    """Return the reactive demand left after the bank, switching whole steps, or continuously when steps is None."""
+    if steps is None:
+      return np.maximum(reactive_power - bank_kvar, 0.0)
+    step_kvar = bank_kvar / steps
+    switched_steps = np.minimum(np.floor(reactive_power / step_kvar), steps)
+    return reactive_power - switched_steps * step_kvar
+
+  def _annual_savings(self, active_power: np.ndarray, reactive_power: np.ndarray, base_cost: float, annualization: float, interval_hours: float, bank_kvar: float, steps: Optional[int]) -> Tuple[float, np.ndarray]:
+    """Return the annualized savings of a candidate and the reactive demand left after it."""
+    self.evaluated += 1
+    remaining = self._compensated(reactive_power, bank_kvar, steps)
+    return (base_cost - float(self._interval_costs(active_power, remaining, interval_hours).sum())) * annualization, remaining
+
+  def _capital_cost(self, bank_kvar: float, steps: int) -> float:
+    """Return the installed cost of a bank."""
+    return self.sizing_config.get("fixed_cost", 500.0) + bank_kvar * self.sizing_config.get("cost_per_kVAR", 25.0) + steps * self.sizing_config.get("cost_per_step", 150.0)
+
+  def search(self, active_power: np.ndarray, apparent_power: np.ndarray, interval_hours: float) -> List[Dict[str, float]]:
+    """Evaluate the candidate banks with branch-and-bound pruning on payback and return them sorted by payback."""
+    reactive_power = np.sqrt(np.maximum(apparent_power ** 2 - active_power ** 2, 0.0))
+    annualization = HOURS_PER_YEAR / (len(active_power) * interval_hours)
+    base_cost = float(self._interval_costs(active_power, reactive_power, interval_hours).sum())
+    increment = self.sizing_config.get("kVAR_increment", 5.0)
+    max_kvar = self.sizing_config.get("max_kVAR") or math.ceil(float(reactive_power.max()) / increment) * increment
+    step_options = sorted(self.sizing_config.get("step_options", [1, 2, 3, 4, 6, 8, 12]))
+    lifetime_years = self.sizing_config.get("lifetime_years", 15)
+    target = self.power_factor_config["target_power_factor"]
+
+    best_payback = math.inf
+    candidates = []
+    for bank_kvar in np.arange(increment, max_kvar + increment / 2, increment):
+      bound_savings, _ = self._annual_savings(active_power, reactive_power, base_cost, annualization, interval_hours, bank_kvar, None)
+      if bound_savings <= 0 or self._capital_cost(bank_kvar, step_options[0]) / bound_savings >= best_payback:
+        continue
+      for steps in step_options:
+        capital_cost = self._capital_cost(bank_kvar, steps)
+        if capital_cost / bound_savings >= best_payback:
+          break
+        savings, remaining = self._annual_savings(active_power, reactive_power, base_cost, annualization, interval_hours, bank_kvar, steps)
+        if savings <= 0:
+          continue
+        power_factor_after = active_power / np.maximum(np.hypot(active_power, remaining), 1e-9)
+        candidates.append({
+          "bank_kvar": float(bank_kvar),
+          "steps": steps,
+          "step_kvar": float(bank_kvar) / steps,
+          "capital_cost": capital_cost,
+          "annual_savings": savings,
+          "payback_years": capital_cost / savings,
+          "lifetime_net_savings": savings * lifetime_years - capital_cost,
+          "mean_power_factor_after": float(power_factor_after.mean()),
+          "intervals_below_target_after": int((power_factor_after < target).sum())
+        })
+        best_payback = min(best_payback, capital_cost / savings)
+    return sorted(candidates, key=lambda candidate: (candidate["payback_years"], -candidate["annual_savings"]))
+
+  def size_capacitor_bank(self) -> None:
+    """Search the capacitor bank sizes and write the payback-optimal sizing to an XLSX file."""
+    timestamps, active_power, apparent_power = self.load_load_profile()
+    self.rejects.write(reject_path(self.config["year"], self.config["site"], "Capacitor_Sizing"))
+    interval_hours = self._interval_hours(timestamps)
+    started = time.perf_counter()
+    candidates = self.search(active_power, apparent_power, interval_hours)
+    logging.info(f"Evaluated {self.evaluated} bank configurations over {len(active_power)} intervals in {time.perf_counter() - started:.2f} s.")
+    if not candidates:
+      logging.warning("No capacitor bank pays back at the configured costs.")
+
+    year = self.config["year"]
+    site = self.config["site"]
+    results_dir = Path('results')
+    results_dir.mkdir(exist_ok=True)
+    file_name = results_dir / f"{year}_{site}_Capacitor_Sizing.xlsx"
+    workbook = xlsxwriter.Workbook(file_name)
+    self.formatter = SheetFormatter(workbook)
+    logging.info(f"Created XLSX file: {file_name}")
+    self._write_recommendation(workbook.add_worksheet(f"{site}_{year}_Sizing_Summary"), candidates, len(active_power) * interval_hours)
+    self._write_candidates(workbook.add_worksheet(f"{site}_{year}_Candidates"), candidates)
+    workbook.close()
+    logging.info(f"Completed capacitor bank sizing and writing: {file_name}")
+
+  def _write_recommendation(self, worksheet: xlsxwriter.Workbook.worksheet_class, candidates: List[Dict[str, float]], hours_covered: float) -> None:
+    """Write the payback-optimal bank."""
+    worksheet.write(0, 0, f"Load profile: {hours_covered:.0f} hours, annualized to {HOURS_PER_YEAR} hours.")
+    worksheet.write_row(2, 0, CANDIDATE_HEADERS)
+    if candidates:
+      best = candidates[0]
+      worksheet.write_row(3, 0, list(best.values()))
+      logging.info(f"Payback-optimal bank: {best['bank_kvar']:g} kVAR in {best['steps']} steps of {best['step_kvar']:g} kVAR, payback {best['payback_years']:.2f} years.")
+    self.formatter.apply(worksheet, ColumnWidths(CANDIDATE_HEADERS, padding=2), CANDIDATE_FORMATS)
+
+  def _write_candidates(self, worksheet: xlsxwriter.Workbook.worksheet_class, candidates: List[Dict[str, float]]) -> None:
+    """Write every evaluated candidate that pays back, sorted by payback. Pruned candidates are not listed."""
+    worksheet.write_row(0, 0, CANDIDATE_HEADERS)
+    for row_idx, candidate in enumerate(candidates, start=1):
+      worksheet.write_row(row_idx, 0, list(candidate.values()))
+    self.formatter.apply(worksheet, ColumnWidths(CANDIDATE_HEADERS, padding=2), CANDIDATE_FORMATS)
+
+if __name__ == "__main__":
+  with profiled("capacitor_sizing"):
+    config_file = "config/savings_config.json"
+    calculator = CapacitorBankSizing(config_file)
+    calculator.size_capacitor_bank()
@@ -0,0 +1,205 @@
+import argparse
+import logging
+import re
+from pathlib import Path
+from typing import Dict, List, NamedTuple, Optional, Sequence, Tuple
+import numpy as np
+import xlsxwriter
+from formatting import ColumnWidths, SheetFormatter
+from profiling import profiled
+from rollups import SAVINGS_MEASURES
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+ROLLUPS_DIR = Path("results/rollups")
+FLEET_STORE = Path("results/fleet/month_results.npz")
+ROLLUP_FILE = re.compile(r"^(\d{4})_(.+)_(Genset_Fuel|Frequency|Power_Factor|Voltage_Stability|Harmonic|Yield)\.npz$")
+MONTHS = "months"  # KPI denominator: the number of site-months with data
+
+class Kpi(NamedTuple):
+  label: str
+  numerator_label: str
+  numerator: Tuple[str, ...]  # store columns summed into the numerator
+  denominator: str  # store column, or MONTHS
+  scale: float
+  number_format: str
+
+KPIS = {
+  "savings_per_kWh": Kpi("Savings per kWh of Grid Energy", "Savings", tuple(f"{calculator}/{measure}" for calculator, measure in SAVINGS_MEASURES.items()), "Yield/grid_yield", 1.0, "ratio"),
+  "outages_per_month": Kpi("Outages per Month", "Outages", ("Genset_Fuel/num_outages",), MONTHS, 1.0, "decimal"),
+  "pf_penalty_per_MWh": Kpi("PF Penalty per MWh of Grid Energy", "PF Penalty", ("Power_Factor/total_cost_savings",), "Yield/grid_yield", 1000.0, "currency")
+}
+
+class FleetStore:
+  """Month results of every site and year as one columnar table.
+
+  Each row is one site-month. Columns are named "{calculator}/{measure}" and are NaN for site-months
+  the calculator has no rollup for. The table is built from the per-site rollups and saved to
+  results/fleet/month_results.npz, so fleet queries read one file instead of one per site and year.
+  """
+
+  def __init__(self, sites: np.ndarray, site: np.ndarray, period: np.ndarray, columns: Dict[str, np.ndarray], sources: Dict[str, int]):
+    self.sites = sites
+    self.site = site
+    self.period = period
+    self.columns = columns
+    self.sources = sources
+    self.year = period.astype("datetime64[Y]").astype(np.int64) + 1970
+    self.month = period.astype(np.int64) % 12 + 1
+
+  def __len__(self) -> int:
+    return len(self.site)
+
+  @classmethod
+  def build(cls, rollups_dir: Path = ROLLUPS_DIR) -> "FleetStore":
+    """Read the month level of every rollup in the folder into one table."""
+    parts = []
+    sources = {}
+    for path in sorted(Path(rollups_dir).glob("*.npz")):
+      match = ROLLUP_FILE.match(path.name)
+      if not match:
+        continue
+      with np.load(path) as data:
+        calculator = str(data["calculator"])
+        month_columns = {key.split("/", 1)[1]: data[key] for key in data.files if key.startswith("month/")}
+      parts.append((match.group(2), calculator, month_columns))
+      sources[path.name] = path.stat().st_mtime_ns
+    if not parts:
+      return cls(np.array([], dtype=str), np.array([], dtype=np.int32), np.array([], dtype="datetime64[M]"), {}, sources)
+
+    site_names = np.concatenate([np.full(len(columns["period"]), site) for site, _, columns in parts])
+    periods = np.concatenate([columns["period"].astype("datetime64[M]") for _, _, columns in parts])
+    sites, site_codes = np.unique(site_names, return_inverse=True)
+    keys = site_codes.astype(np.int64) * (1 << 32) + periods.astype(np.int64)
+    row_keys, rows = np.unique(keys, return_inverse=True)
+    store_columns: Dict[str, np.ndarray] = {}
+    offset = 0
+    for _, calculator, columns in parts:
+      part_rows = rows[offset:offset + len(columns["period"])]
+      offset += len(columns["period"])
+      for measure, values in columns.items():
+        if measure != "period":
+          store_columns.setdefault(f"{calculator}/{measure}", np.full(len(row_keys), np.nan))[part_rows] = values
+    row_periods = (row_keys % (1 << 32)).astype("datetime64[M]")
+    logging.info(f"Built the fleet store from {len(parts)} rollups: {len(sites)} sites, {len(row_keys)} site-months.")
+    return cls(sites, (row_keys >> 32).astype(np.int32), row_periods, store_columns, sources)
+
+  def save(self, path: Path = FLEET_STORE) -> None:
+    """Save the table to a compressed .npz file."""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    np.savez_compressed(path, sites=self.sites, site=self.site, period=self.period, source_names=np.array(list(self.sources), dtype=str), source_mtimes=np.array(list(self.sources.values()), dtype=np.int64), **{f"column/{name}": values for name, values in self.columns.items()})
+    logging.info(f"Saved the fleet store to {path}.")
+
+  @classmethod
+  def load(cls, path: Path = FLEET_STORE) -> "FleetStore":
+    """Load a table saved with save()."""
+    with np.load(path) as data:
+      columns = {key.split("/", 1)[1]: data[key] for key in data.files if key.startswith("column/")}
+      sources = dict(zip(data["source_names"].tolist(), data["source_mtimes"].tolist()))
+      return cls(data["sites"], data["site"], data["period"], columns, sources)
+
+  @classmethod
+  def open(cls, rollups_dir: Path = ROLLUPS_DIR, path: Path = FLEET_STORE) -> "FleetStore":
+    """Load the saved table, rebuilding it first if any rollup was added, removed or rewritten since it was built."""
+    sources = {rollup.name: rollup.stat().st_mtime_ns for rollup in Path(rollups_dir).glob("*.npz") if ROLLUP_FILE.match(rollup.name)}
+    if path.exists():
+      store = cls.load(path)
+      if store.sources == sources:
+        return store
+    store = cls.build(rollups_dir)
+    store.save(path)
+    return store
+
+  def _column(self, name: str) -> np.ndarray:
+    """Return a store column, all NaN if no site has it."""
+    return self.columns.get(name, np.full(len(self), np.nan))
+
+  def kpi(self, name: str, by_year: bool = False, year: Optional[int] = None) -> Dict[str, np.ndarray]:
+    """Compute a KPI per site, or per site and year, as the ratio of summed numerator and denominator.
+
+    Only site-months with a numerator value and a positive denominator count, and each group is reduced
+    with one np.bincount per column over integer group keys.
+    """
+    kpi = KPIS[name]
+    numerators = [self._column(column) for column in kpi.numerator]
+    present = np.any([~np.isnan(values) for values in numerators], axis=0)
+    numerator = np.sum([np.nan_to_num(values) for values in numerators], axis=0)
+    denominator = present.astype(np.float64) if kpi.denominator == MONTHS else np.nan_to_num(self._column(kpi.denominator))
+    valid = present & (denominator > 0)
+    if year is not None:
+      valid &= self.year == year
+    years = np.unique(self.year) if by_year else np.array([0])
+    keys = self.site.astype(np.int64) * len(years) + (np.searchsorted(years, self.year) if by_year else 0)
+    groups = len(self.sites) * len(years)
+    numerator_sums = np.bincount(keys[valid], weights=numerator[valid], minlength=groups)
+    denominator_sums = np.bincount(keys[valid], weights=denominator[valid], minlength=groups)
+    months = np.bincount(keys[valid], minlength=groups)
+    values = np.divide(numerator_sums, denominator_sums, out=np.full(groups, np.nan), where=denominator_sums > 0) * kpi.scale
+    result = {
+      "site": np.repeat(self.sites, len(years)),
+      "value": values,
+      "numerator": numerator_sums,
+      "denominator": denominator_sums,
+      "months": months
+    }
+    if by_year:
+      result["year"] = np.tile(years, len(self.sites))
+    return result
+
+  def rank(self, name: str, top: int = 20, by_year: bool = False, year: Optional[int] = None, ascending: bool = False) -> Dict[str, np.ndarray]:
+    """Return the top groups of a KPI, highest first unless ascending. Groups without data are left out."""
+    result = self.kpi(name, by_year, year)
+    has_value = np.flatnonzero(~np.isnan(result["value"]))
+    order = has_value[np.argsort(result["value"][has_value] if ascending else -result["value"][has_value], kind="stable")][:top or None]
+    return {column: values[order] for column, values in result.items()}
+
+def _ranking_columns(kpi: Kpi, ranking: Dict[str, np.ndarray]) -> Tuple[List[str], List[Optional[str]], List[np.ndarray]]:
+  """Return the headers, number formats and values of a ranking table."""
+  denominator_label = "Site-Months" if kpi.denominator == MONTHS else f"{kpi.denominator.split('/')[-1].replace('_', ' ').title()} (kWh)"
+  headers = ["Rank", "Site"] + (["Year"] if "year" in ranking else []) + [kpi.label, kpi.numerator_label, denominator_label, "Months"]
+  number_formats = ["count", None] + ([None] if "year" in ranking else []) + [kpi.number_format, "currency" if kpi.denominator != MONTHS else "count", "count" if kpi.denominator == MONTHS else "energy", "count"]
+  values = [np.arange(1, len(ranking["site"]) + 1), ranking["site"]] + ([ranking["year"]] if "year" in ranking else []) + [ranking["value"], ranking["numerator"], ranking["denominator"], ranking["months"]]
+  return headers, number_formats, values
+
+def write_fleet_report(store: FleetStore, kpi_names: Sequence[str], top: int, by_year: bool, year: Optional[int], ascending: bool, path: Path) -> Path:
+  """Write one ranked sheet per KPI to an XLSX file."""
+  path.parent.mkdir(parents=True, exist_ok=True)
+  workbook = xlsxwriter.Workbook(path)
+  formatter = SheetFormatter(workbook)
+  for name in kpi_names:
+    kpi = KPIS[name]
+    headers, number_formats, columns = _ranking_columns(kpi, store.rank(name, top, by_year, year, ascending))
+    worksheet = workbook.add_worksheet(name[:31])
+    worksheet.write_row(0, 0, headers)
+    column_widths = ColumnWidths(headers, padding=2)
+    for col_idx, values in enumerate(columns):
+      cells = values.tolist()
+      worksheet.write_column(1, col_idx, cells)
+      if col_idx in (1, 2) and cells:
+        column_widths.observe(col_idx, max((str(cell) for cell in cells), key=len))
+    formatter.apply(worksheet, column_widths, number_formats)
+  workbook.close()
+  logging.info(f"Wrote fleet rankings of {', '.join(kpi_names)} to {path}.")
+  return path
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser(description="Rank sites on normalized savings KPIs across the whole fleet.")
+  parser.add_argument("kpis", nargs="*", help=f"KPIs to rank: {', '.join(KPIS)} (default: all)")
+  parser.add_argument("--rollups", type=Path, default=ROLLUPS_DIR, help="folder of per-site rollups")
+  parser.add_argument("--top", type=int, default=20, help="sites per ranking, 0 for all")
+  parser.add_argument("--year", type=int, help="only rank this year")
+  parser.add_argument("--by-year", action="store_true", help="rank each site and year separately")
+  parser.add_argument("--ascending", action="store_true", help="lowest values first")
+  args = parser.parse_args()
+  unknown = [name for name in args.kpis if name not in KPIS]
+  if unknown:
+    parser.error(f"unknown KPIs: {', '.join(unknown)}")
+  kpi_names = args.kpis or list(KPIS)
+  with profiled("fleet"):
+    store = FleetStore.open(args.rollups)
+    for name in kpi_names:
+      headers, _, columns = _ranking_columns(KPIS[name], store.rank(name, args.top, args.by_year, args.year, args.ascending))
+      print(",".join(headers))
+      for row in zip(*(values.tolist() for values in columns)):
+        print(",".join(f"{value:.4f}" if isinstance(value, float) else str(value) for value in row))
+    write_fleet_report(store, kpi_names, args.top, args.by_year, args.year, args.ascending, Path("results/Fleet_Report.xlsx"))
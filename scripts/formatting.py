@@ -0,0 +1,55 @@
+import logging
+from itertools import zip_longest
+from typing import Optional, Sequence
+import xlsxwriter
+
+WIDTH_SAMPLE_ROWS = 4096  # rows scanned per block for column widths; larger blocks are sampled with a fixed stride
+NUMBER_FORMATS = {
+  "currency": "#,##0.00",
+  "energy": "#,##0.00",
+  "count": "#,##0",
+  "decimal": "0.00",
+  "ratio": "0.000"
+}
+
+class ColumnWidths:
+  """Running maximum text width of each worksheet column, updated while the data is ingested.
+
+  Blocks of up to sample_rows rows are measured exactly. Larger blocks are measured on an evenly
+  strided sample, so estimating the widths of a huge sheet costs O(columns * sample_rows).
+  """
+
+  def __init__(self, headers: Sequence[str], padding: int = 0, sample_rows: int = WIDTH_SAMPLE_ROWS):
+    self.widths = [len(header) for header in headers]
+    self.padding = padding
+    self.sample_rows = sample_rows
+
+  def update(self, rows: Sequence[Sequence[str]]) -> None:
+    """Update the running maxima with a block of text rows."""
+    if len(rows) > self.sample_rows:
+      rows = rows[::-(-len(rows) // self.sample_rows)]
+    for col_idx, column in enumerate(zip_longest(*rows, fillvalue="")):
+      self.observe(col_idx, max(column, key=len))
+
+  def observe(self, col_idx: int, text: str) -> None:
+    """Update the running maximum of one column with a single cell of text."""
+    if col_idx >= len(self.widths):
+      self.widths.extend([0] * (col_idx + 1 - len(self.widths)))
+    self.widths[col_idx] = max(self.widths[col_idx], len(text))
+
+class SheetFormatter:
+  """Shared formatting layer: owns the number formats of a workbook and sets each sheet's columns once."""
+
+  def __init__(self, workbook: xlsxwriter.Workbook):
+    self.formats = {name: workbook.add_format({"num_format": num_format}) for name, num_format in NUMBER_FORMATS.items()}
+
+  def format(self, name: Optional[str]) -> Optional[xlsxwriter.format.Format]:
+    """Return the workbook format of a named number format, or None for the default."""
+    return self.formats[name] if name else None
+
+  def apply(self, worksheet: xlsxwriter.Workbook.worksheet_class, column_widths: ColumnWidths, number_formats: Sequence[Optional[str]] = ()) -> None:
+    """Set the width and number format of every column with one call per column."""
+    for col_idx, width in enumerate(column_widths.widths):
+      number_format = number_formats[col_idx] if col_idx < len(number_formats) else None
+      worksheet.set_column(col_idx, col_idx, width + column_widths.padding, self.format(number_format))
+    logging.info(f"Formatted {len(column_widths.widths)} columns of worksheet {worksheet.name}.")
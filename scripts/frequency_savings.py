@@ -3,12 +3,26 @@ import logging
 import sys
 from pathlib import Path
 from typing import Dict, List, Tuple, Optional
-import csv
+import numpy as np
 import xlsxwriter
+from archives import folder_exists, locate
+from chunked import BlockReader, chunk_rows
+from formatting import ColumnWidths, SheetFormatter
+from ingest import RejectReport, column_values, parse_numbers, reject_path
+from memo import ResultCache
+from profiling import profiled
+from qc import QualityScanner, qc_path
+from render import render, render_outputs, render_state_path, save_render_state, summary_formats
+from result_store import record_run
+from rollups import Rollup, rollup_path
+
+SUMMARY_HEADERS = ["Month", "Total Deviation Cost", "Maintenance Cost", "Downtime Cost", "Penalty Cost", "Total Month Savings"]
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
 class CalculateFrequencySavings:
+  RENDER_STATE = ("months_list", "rollup", "month_rollups", "month_sheets")  # attributes write_workbook() reads, saved for the render pool
+
   def __init__(self, config_file: str):
     self.config_file = config_file
     self.config = self.load_config()
@@ -16,6 +30,10 @@ class CalculateFrequencySavings:
       "January", "February", "March", "April", "May", "June",
       "July", "August", "September", "October", "November", "December"
     ]
+    self.month_rollups: Dict[str, Rollup] = {}
+    self.month_sheets: Dict[str, Tuple[int, ColumnWidths]] = {}
+    self.rejects = RejectReport()
+    self.quality = QualityScanner(self.config)
 
   def load_config(self) -> Dict:
     """Load configuration from a JSON file."""
@@ -32,56 +50,114 @@ class CalculateFrequencySavings:
   def confirm_year_folder(self) -> None:
     """Confirm the existence of the year folder."""
     year_folder = Path(f"data/frequency_savings_data/{self.config['year']}")
-    if not year_folder.exists():
+    if not folder_exists(year_folder):
       logging.error(f"data/frequency_savings_data/{self.config['year']} folder does not exist. Exiting.")
       sys.exit()
     logging.info(f"data/frequency_savings_data/{self.config['year']} folder exists.")
 
+  def _result_cache(self) -> ResultCache:
+    """Return the result cache entry of this run, keyed on the input files and the config sections this calculator reads."""
+    year = self.config["year"]
+    site = self.config["site"]
+    outputs = [Path(f"results/{year}_{site}_Frequency_Savings.xlsx"), rollup_path(year, site, "Frequency"), reject_path(year, site, "Frequency"), qc_path(year, site, "Frequency")] + render_outputs(year, site, "Frequency")
+    return ResultCache(self.config, "Frequency", ["frequency_deviation", "qc"], [Path(f"data/frequency_savings_data/{year}")], outputs, type(self).__module__)
+
+  def restore_cached_results(self) -> bool:
+    """Restore the outputs of an identical earlier run from the result cache. Returns False on a miss."""
+    self.cache = self._result_cache()
+    if not self.cache.restore():
+      return False
+    self.rollup = Rollup.load(rollup_path(self.config["year"], self.config["site"], "Frequency"))
+    record_run(self.config, "Frequency", self.rollup, self.cache, restored=True)
+    return True
+
   def calculate_frequency_savings(self) -> None:
     """Calculate frequency savings and write to an XLSX file."""
+    if self.restore_cached_results():
+      return
+    self.compute_month_rollups()
+    self.build_rollup()
+    render(render_state_path(self.config["year"], self.config["site"], "Frequency"), summary_formats(self.config), self)
+    self.cache.store()
+
+  def compute_month_rollups(self) -> None:
+    """Read the frequency deviations of each month and build the month rollups."""
+    for month in self.months_list:
+      self._process_month_data(month)
+
+  def build_rollup(self) -> Rollup:
+    """Combine the month rollups, then save the rollup, the reject report, the data quality report and the render state."""
+    year = self.config["year"]
+    site = self.config["site"]
+    self.rollup = Rollup.combine("Frequency", self.month_rollups.values())
+    self.rollup.save(rollup_path(year, site, "Frequency"))
+    self.rejects.write(reject_path(year, site, "Frequency"))
+    self.quality.write(qc_path(year, site, "Frequency"))
+    save_render_state(self, "Frequency")
+    record_run(self.config, "Frequency", self.rollup, self.cache)
+    return self.rollup
+
+  def write_workbook(self) -> Path:
+    """Write the month sheets and the yearly summary to an XLSX file."""
     year = self.config["year"]
     site = self.config["site"]
     results_dir = Path('results')
     results_dir.mkdir(exist_ok=True)
     file_name = results_dir / f"{year}_{site}_Frequency_Savings.xlsx"
     workbook = xlsxwriter.Workbook(file_name)
+    self.formatter = SheetFormatter(workbook)
     logging.info(f"Created XLSX file: {file_name}")
 
     summary_worksheet = workbook.add_worksheet(f"{site}_{year}_Savings_Summary")
     logging.info(f"Created summary worksheet: {site}_{year}_Savings_Summary.")
 
     for month in self.months_list:
-      self._process_month_data(workbook, month)
+      worksheet = workbook.add_worksheet(f"{site}_{month}_Savings")
+      if month in self.month_sheets:
+        self._write_calculations_to_worksheet(worksheet, month)
 
     self._calculate_year_frequency_savings(workbook)
     workbook.close()
     logging.info(f"Completed calculating frequency savings and writing: {file_name}")
+    return file_name
 
-  def _process_month_data(self, workbook: xlsxwriter.Workbook, month: str) -> None:
-    """Process data for a specific month and write to the workbook."""
+  def _process_month_data(self, month: str) -> None:
+    """Build the rollup of a specific month and keep its row count and column widths for the month sheet."""
     year = self.config["year"]
-    site = self.config["site"]
-    worksheet = workbook.add_worksheet(f"{site}_{month}_Savings")
-    file_path = Path(f"data/frequency_savings_data/{year}/{month}-Frequency-Savings.csv")
-    if not file_path.exists():
-      logging.warning(f"{file_path} does not exist. Skipping {month}.")
+    file_path = locate(Path(f"data/frequency_savings_data/{year}/{month}-Frequency-Savings.csv"))
+    if file_path is None:
+      logging.warning(f"data/frequency_savings_data/{year}/{month}-Frequency-Savings.csv does not exist. Skipping {month}.")
       return
 
-    with open(file_path, mode='r', newline='') as infile:
-      reader = list(csv.reader(infile))
-      self._write_calculations_to_worksheet(worksheet, reader, month)
+    timestamp_format = self.config["frequency_deviation"].get("timestamp_format", "%d/%m/%Y %H:%M")
+    masked_rows = self.quality.scan(file_path, timestamp_format, ["Frequency Deviation (Hz)"], stuck_columns=[])
+    with BlockReader(file_path, chunk_rows(self.config), timestamp_format, rejects=self.rejects, skip_rows=masked_rows) as blocks:
+      frequency_deviation_col_idx = self._get_column_index(blocks.header, "Frequency Deviation (Hz)")
+      if frequency_deviation_col_idx is None:
+        logging.error(f"Frequency Deviation column not found in {month}. Skipping.")
+        return
 
-  def _write_calculations_to_worksheet(self, worksheet: xlsxwriter.Workbook.worksheet_class, reader: List[List[str]], month: str) -> None:
-    """Write calculations to the worksheet."""
-    frequency_deviation_col_idx = self._get_column_index(reader[0], "Frequency Deviation (Hz)")
-    if frequency_deviation_col_idx is None:
-      logging.error(f"Frequency Deviation column not found in {month}. Skipping.")
-      return
+      column_widths = ColumnWidths(blocks.header)
+      partial_rollups = []
+      for timestamps, rows in blocks:
+        partial_rollups.append(self._build_block_rollup(blocks.file_path, timestamps, rows, frequency_deviation_col_idx))
+        column_widths.update(rows)
+    self.month_rollups[month] = Rollup.combine("Frequency", partial_rollups)
+    self.month_sheets[month] = (blocks.rows_read + 1, column_widths)
 
-    total_deviation_cost, maintenance_cost, downtime_cost, penalty_cost = self._calculate_costs(reader, frequency_deviation_col_idx)
-    total_month_savings = total_deviation_cost + maintenance_cost + downtime_cost + penalty_cost
-    self._write_savings_to_worksheet(worksheet, reader, total_deviation_cost, maintenance_cost, downtime_cost, penalty_cost, total_month_savings, month)
-    self._adjust_column_widths(worksheet, reader)
+  def _write_calculations_to_worksheet(self, worksheet: xlsxwriter.Workbook.worksheet_class, month: str) -> None:
+    """Write calculations to the worksheet."""
+    reader_length, column_widths = self.month_sheets[month]
+    month_totals = self.month_rollups[month].total()
+    total_deviation_cost = month_totals.get("total_deviation_cost", 0.0)
+    maintenance_cost = month_totals.get("maintenance_cost", 0.0)
+    downtime_cost = month_totals.get("downtime_cost", 0.0)
+    penalty_cost = month_totals.get("penalty_cost", 0.0)
+    total_month_savings = month_totals.get("total_savings", 0.0)
+    self._write_savings_to_worksheet(worksheet, reader_length, total_deviation_cost, maintenance_cost, downtime_cost, penalty_cost, total_month_savings, month)
+    for label in ("Total Deviation Cost", "Maintenance Cost", "Downtime Cost", "Penalty Cost", "Total Month Savings"):
+      column_widths.observe(0, label)
+    self.formatter.apply(worksheet, column_widths, [None, "currency"])
 
   def _get_column_index(self, header: List[str], column_name: str) -> Optional[int]:
     """Get the index of a column in the header."""
@@ -90,47 +166,46 @@ class CalculateFrequencySavings:
         return col_idx
     return None
 
-  def _calculate_costs(self, reader: List[List[str]], frequency_deviation_col_idx: int) -> Tuple[float, float, float, float]:
-    """Calculate costs associated with frequency deviations."""
-    total_deviation_cost = 0
-    maintenance_cost = 0
-    downtime_cost = 0
-    penalty_cost = 0
-
-    for row in reader[1:]:
-      try:
-        deviation = float(row[frequency_deviation_col_idx])
-        if abs(deviation) > self.config["frequency_deviation"]["tolerable_deviation"]:
-          total_deviation_cost += abs(deviation) * self.config["frequency_deviation"]["cost_per_Hz_deviation"]
-          maintenance_cost += abs(deviation) * self.config["frequency_deviation"]["maintenance_cost_increase_per_Hz"]
-          downtime_cost += abs(deviation) * self.config["frequency_deviation"]["downtime_cost_per_Hz"]
-          penalty_cost += abs(deviation) * self.config["frequency_deviation"]["penalty_rate"]
-      except ValueError:
-        continue
-
-    return total_deviation_cost, maintenance_cost, downtime_cost, penalty_cost
-
-  def _write_savings_to_worksheet(self, worksheet: xlsxwriter.Workbook.worksheet_class, reader: List[List[str]], total_deviation_cost: float, maintenance_cost: float, downtime_cost: float, penalty_cost: float, total_month_savings: float, month: str) -> None:
+  def _build_block_rollup(self, file_path: Path, timestamps: np.ndarray, rows: List[List[str]], frequency_deviation_col_idx: int) -> Rollup:
+    """Build a partial rollup from one block of timestamped frequency deviations, rejecting invalid readings."""
+    values = column_values(rows, frequency_deviation_col_idx)
+    deviations, valid = parse_numbers(values)
+    self.rejects.record(file_path, "Frequency Deviation (Hz)", values, valid, rows)
+    costs = self._calculate_costs(deviations[valid])
+    return Rollup.from_intervals("Frequency", timestamps[valid], costs)
+
+  def _calculate_costs(self, deviations: np.ndarray) -> Dict[str, np.ndarray]:
+    """Calculate per-interval costs associated with frequency deviations, and their total savings.
+
+    The costs are priced per Hz of deviation, not per kWh, so the time-of-use tariff does not apply.
+    """
+    frequency_config = self.config["frequency_deviation"]
+    abs_deviation = np.abs(deviations)
+    abs_deviation = np.where(abs_deviation > frequency_config["tolerable_deviation"], abs_deviation, 0.0)
+    costs = {
+      "total_deviation_cost": abs_deviation * frequency_config["cost_per_Hz_deviation"],
+      "maintenance_cost": abs_deviation * frequency_config["maintenance_cost_increase_per_Hz"],
+      "downtime_cost": abs_deviation * frequency_config["downtime_cost_per_Hz"],
+      "penalty_cost": abs_deviation * frequency_config["penalty_rate"],
+      "out_of_tolerance_intervals": (abs_deviation > 0).astype(np.float64)
+    }
+    costs["total_savings"] = costs["total_deviation_cost"] + costs["maintenance_cost"] + costs["downtime_cost"] + costs["penalty_cost"]
+    return costs
+
+  def _write_savings_to_worksheet(self, worksheet: xlsxwriter.Workbook.worksheet_class, reader_length: int, total_deviation_cost: float, maintenance_cost: float, downtime_cost: float, penalty_cost: float, total_month_savings: float, month: str) -> None:
     """Write savings data to the worksheet."""
-    worksheet.write(len(reader) + 1, 0, "Total Deviation Cost")
-    worksheet.write(len(reader) + 1, 1, total_deviation_cost)
-    worksheet.write(len(reader) + 3, 0, "Maintenance Cost")
-    worksheet.write(len(reader) + 3, 1, maintenance_cost)
-    worksheet.write(len(reader) + 5, 0, "Downtime Cost")
-    worksheet.write(len(reader) + 5, 1, downtime_cost)
-    worksheet.write(len(reader) + 7, 0, "Penalty Cost")
-    worksheet.write(len(reader) + 7, 1, penalty_cost)
-    worksheet.write(len(reader) + 9, 0, "Total Month Savings")
-    worksheet.write(len(reader) + 9, 1, total_month_savings)
+    worksheet.write(reader_length + 1, 0, "Total Deviation Cost")
+    worksheet.write(reader_length + 1, 1, total_deviation_cost)
+    worksheet.write(reader_length + 3, 0, "Maintenance Cost")
+    worksheet.write(reader_length + 3, 1, maintenance_cost)
+    worksheet.write(reader_length + 5, 0, "Downtime Cost")
+    worksheet.write(reader_length + 5, 1, downtime_cost)
+    worksheet.write(reader_length + 7, 0, "Penalty Cost")
+    worksheet.write(reader_length + 7, 1, penalty_cost)
+    worksheet.write(reader_length + 9, 0, "Total Month Savings")
+    worksheet.write(reader_length + 9, 1, total_month_savings)
     logging.info(f"Calculated frequency savings for {month}.")
 
-  def _adjust_column_widths(self, worksheet: xlsxwriter.Workbook.worksheet_class, reader: List[List[str]]) -> None:
-    """Adjust the column widths based on the content."""
-    for col_idx, col_name in enumerate(reader[0]):
-      max_width = max(len(str(cell)) for cell in [col_name] + [row[col_idx] for row in reader[1:]])
-      worksheet.set_column(col_idx, col_idx, max_width)
-    logging.info(f"Adjusted column widths for worksheet {worksheet.name}.")
-
   def _calculate_year_frequency_savings(self, workbook: xlsxwriter.Workbook) -> None:
     """Calculate yearly savings and update the summary worksheet."""
     site = self.config["site"]
@@ -140,11 +215,13 @@ class CalculateFrequencySavings:
 
     self._write_summary_headers(summary_worksheet)
     self._aggregate_yearly_savings(summary_worksheet)
+    column_widths = ColumnWidths(SUMMARY_HEADERS)
+    column_widths.observe(0, "Yearly Totals")
+    self.formatter.apply(summary_worksheet, column_widths, [None] + ["currency"] * (len(SUMMARY_HEADERS) - 1))
 
   def _write_summary_headers(self, summary_worksheet: xlsxwriter.Workbook.worksheet_class) -> None:
     """Write headers to the summary worksheet."""
-    headers = ["Month", "Total Deviation Cost", "Maintenance Cost", "Downtime Cost", "Penalty Cost", "Total Month Savings"]
-    for col_idx, header in enumerate(headers):
+    for col_idx, header in enumerate(SUMMARY_HEADERS):
       summary_worksheet.write(0, col_idx, header)
     logging.info("Written headers to summary worksheet.")
 
@@ -165,34 +242,19 @@ class CalculateFrequencySavings:
 
   def _process_month_summary(self, summary_worksheet: xlsxwriter.Workbook.worksheet_class, row_idx: int, month: str, totals: Dict[str, float]) -> None:
     """Process and write the summary for a specific month."""
-    year = self.config["year"]
-    site = self.config["site"]
-    worksheet_path = f"results/{year}_{site}_Frequency_Savings.xlsx"
-    worksheet_name = f"{site}_{month}_Savings"
-
-    try:
-      workbook = xlsxwriter.Workbook(worksheet_path)
-      worksheet = workbook.get_worksheet_by_name(worksheet_name)
-      if worksheet is None:
-        raise KeyError(f"Worksheet {worksheet_name} not found.")
-      month_data = self._read_month_data(worksheet)
-      self._write_month_summary(summary_worksheet, row_idx, month, month_data)
-      self._update_yearly_totals(totals, month_data)
-    except FileNotFoundError:
-      logging.error(f"File {worksheet_path} not found.")
-    except KeyError as e:
-      logging.error(e)
-    except Exception as e:
-      logging.error(f"An error occurred while processing {month}: {e}")
+    month_data = self._read_month_data(row_idx)
+    self._write_month_summary(summary_worksheet, row_idx, month, month_data)
+    self._update_yearly_totals(totals, month_data)
 
-  def _read_month_data(self, worksheet: xlsxwriter.Workbook.worksheet_class) -> Dict[str, float]:
-    """Read month data from the worksheet."""
+  def _read_month_data(self, month_number: int) -> Dict[str, float]:
+    """Read month data from the month row of the rollup."""
+    month_row = self.rollup.month_row(month_number) or {}
     return {
-      "total_deviation_cost": worksheet.cell(row=len(reader) + 2, column=2).value,
-      "maintenance_cost": worksheet.cell(row=len(reader) + 4, column=2).value,
-      "downtime_cost": worksheet.cell(row=len(reader) + 6, column=2).value,
-      "penalty_cost": worksheet.cell(row=len(reader) + 8, column=2).value,
-      "total_savings": worksheet.cell(row=len(reader) + 10, column=2).value
+      "total_deviation_cost": month_row.get("total_deviation_cost", 0.0),
+      "maintenance_cost": month_row.get("maintenance_cost", 0.0),
+      "downtime_cost": month_row.get("downtime_cost", 0.0),
+      "penalty_cost": month_row.get("penalty_cost", 0.0),
+      "total_savings": month_row.get("total_savings", 0.0)
     }
 
   def _write_month_summary(self, summary_worksheet: xlsxwriter.Workbook.worksheet_class, row_idx: int, month: str, month_data: Dict[str, float]) -> None:
@@ -231,7 +293,8 @@ class CalculateFrequencySavings:
     logging.info("Written yearly totals to summary worksheet.")
 
 if __name__ == "__main__":
-  config_file = "config/savings_config.json"
-  calculator = CalculateFrequencySavings(config_file)
-  calculator.confirm_year_folder()
-  calculator.calculate_frequency_savings()
\ No newline at end of file
+  with profiled("frequency_savings"):
+    config_file = "config/savings_config.json"
+    calculator = CalculateFrequencySavings(config_file)
+    calculator.confirm_year_folder()
+    calculator.calculate_frequency_savings()
\ No newline at end of file
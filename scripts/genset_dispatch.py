@@ -0,0 +1,144 @@
+import json
+import logging
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Dict, List, Tuple
+import numpy as np
+from archives import locate_all
+from profiling import profiled
+from records import GensetEvents, read_genset_events
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+DEFAULT_DISPATCH = {
+  "rated_kW": 100.0,
+  "fuel_curve": [[0.0, 8.4], [0.25, 14.6], [0.5, 20.7], [0.75, 26.9], [1.0, 33.0]],  # (load fraction, litres per hour)
+  "fuel_price_per_litre": 1.40,
+  "maintenance_per_run_hour": 2.00,
+  "start_stop_cost": 3.00,
+  "minimum_run_minutes": 15,
+  "cooldown_minutes": 3,
+  "workers": 0
+}
+DISPATCH_MEASURES = ("sim_fuel_litres", "sim_run_hours", "sim_starts", "sim_genset_savings")
+
+class GensetDispatchSimulator:
+  """Event-driven replay of the outages the genset would have covered.
+
+  Each outage event starts the genset unless it is still running from an earlier outage. A run lasts at
+  least minimum_run_minutes and is followed by a cooldown at no load. Loaded fuel follows the part-load fuel
+  curve at the event's average load, idle time burns the no-load fuel rate, and every start adds the
+  start/stop cost. Where events overlap, their loads add and the fuel curve is applied to the combined load,
+  so the genset's run hours and no-load fuel are counted once. All costs are attributed back to the events,
+  so they roll up like the flat-rate savings.
+  """
+
+  def __init__(self, config: Dict):
+    dispatch_config = {**DEFAULT_DISPATCH, **config.get("genset_dispatch", {})}
+    self.rated_kw = dispatch_config["rated_kW"]
+    fuel_curve = np.array(dispatch_config["fuel_curve"], dtype=np.float64)
+    self.load_fractions, self.fuel_rates = fuel_curve[:, 0], fuel_curve[:, 1]
+    self.fuel_price = dispatch_config["fuel_price_per_litre"]
+    self.maintenance_per_run_hour = dispatch_config["maintenance_per_run_hour"]
+    self.start_stop_cost = dispatch_config["start_stop_cost"]
+    self.minimum_run_seconds = dispatch_config["minimum_run_minutes"] * 60
+    self.cooldown_seconds = dispatch_config["cooldown_minutes"] * 60
+
+  def fuel_rate(self, load_kw: np.ndarray) -> np.ndarray:
+    """Return the fuel rate (L/h) at each load, interpolated on the part-load curve and capped at rated load."""
+    return np.interp(np.clip(load_kw / self.rated_kw, 0.0, 1.0), self.load_fractions, self.fuel_rates)
+
+  def loaded_running(self, start_seconds: np.ndarray, end_seconds: np.ndarray, load_kw: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Return the loaded fuel (L) and loaded run hours of each event, with the loads of overlapping events added.
+
+    The loaded time is cut at every event start and end. Each piece burns the fuel rate of the summed load
+    of the events running in it, and its fuel and hours are shared among them by load; pieces where only
+    events without load run are shared equally.
+    """
+    bounds, edges = np.unique(np.concatenate([start_seconds, end_seconds]), return_inverse=True)
+    first, last = edges[:len(start_seconds)], edges[len(start_seconds):]
+    loaded = load_kw > 0
+    running_sum = lambda values: np.cumsum(np.bincount(first, values, len(bounds)) - np.bincount(last, values, len(bounds)))[:-1]
+    piece_load, running, running_loaded = running_sum(load_kw), running_sum(np.ones(len(load_kw))), running_sum(loaded.astype(np.float64))
+    piece_hours = np.diff(bounds) / 3600
+    piece_fuel = np.where(running > 0, self.fuel_rate(piece_load) * piece_hours, 0.0)
+    by_load = running_loaded > 0
+    by_count = (running > 0) & ~by_load
+    shared = []
+    for piece_values in (piece_fuel, piece_hours):
+      per_kw = np.concatenate([[0.0], np.cumsum(np.divide(piece_values, piece_load, out=np.zeros(len(piece_load)), where=by_load))])
+      per_event = np.concatenate([[0.0], np.cumsum(np.divide(piece_values, running, out=np.zeros(len(running)), where=by_count))])
+      shared.append(np.where(loaded, load_kw * (per_kw[last] - per_kw[first]), per_event[last] - per_event[first]))
+    return shared[0], shared[1]
+
+  def simulate(self, start_seconds: np.ndarray, duration_hours: np.ndarray, energy_kwh: np.ndarray) -> Dict[str, np.ndarray]:
+    """Replay the outage events and return the fuel, run hours, starts and cost attributed to each event."""
+    count = len(start_seconds)
+    event_hours = np.where(duration_hours > 0, duration_hours, 0.0)
+    load_kw = np.divide(energy_kwh, event_hours, out=np.zeros(count), where=event_hours > 0)
+    end_seconds = start_seconds + event_hours * 3600
+    loaded_fuel, loaded_hours = self.loaded_running(start_seconds, end_seconds, load_kw)
+
+    starts = np.zeros(count)
+    idle_seconds = np.zeros(count)
+    event_starts = start_seconds.tolist()
+    event_ends = end_seconds.tolist()
+    previous = None
+    run_start = loaded_end = 0.0
+    for event_idx in np.argsort(start_seconds, kind="stable").tolist():
+      start, end = event_starts[event_idx], event_ends[event_idx]
+      run_until = max(run_start + self.minimum_run_seconds, loaded_end) + self.cooldown_seconds
+      if previous is not None and start <= run_until:
+        idle_seconds[event_idx] += max(start - loaded_end, 0.0)
+        loaded_end = max(loaded_end, end)
+      else:
+        if previous is not None:
+          idle_seconds[previous] += run_until - loaded_end
+        starts[event_idx] = 1
+        run_start, loaded_end = start, end
+      previous = event_idx
+    if previous is not None:
+      idle_seconds[previous] += max(run_start + self.minimum_run_seconds, loaded_end) + self.cooldown_seconds - loaded_end
+
+    idle_hours = idle_seconds / 3600
+    fuel_litres = loaded_fuel + idle_hours * self.fuel_rates[0]
+    run_hours = loaded_hours + idle_hours
+    return {
+      "sim_fuel_litres": fuel_litres,
+      "sim_run_hours": run_hours,
+      "sim_starts": starts,
+      "sim_genset_savings": fuel_litres * self.fuel_price + run_hours * self.maintenance_per_run_hour + starts * self.start_stop_cost
+    }
+
+  def simulate_events(self, events: GensetEvents) -> Dict[str, np.ndarray]:
+    """Replay the kept genset events that have an energy saving."""
+    events = events.with_saving()
+    return self.simulate(events.timestamps.astype(np.float64), events.time_elapsed / 60, events.energy_saving)
+
+def _simulate_site(config: Dict, site_folder: Path) -> Dict[str, float]:
+  """Replay a year of outage events from one site's genset savings folder and return the totals."""
+  parts = [read_genset_events(file_path) for file_path in locate_all(Path(site_folder), "*-Genset-Savings.csv")]
+  events = GensetEvents.concatenate([part for part in parts if part is not None])
+  totals = {measure: float(values.sum()) for measure, values in GensetDispatchSimulator(config).simulate_events(events).items()}
+  totals["events"] = len(events)
+  return totals
+
+def simulate_fleet(config: Dict, site_folders: List[Path]) -> Dict[str, Dict[str, float]]:
+  """Replay the outage events of several sites in parallel, one site per worker process."""
+  workers = min(config.get("genset_dispatch", {}).get("workers") or os.cpu_count() or 1, len(site_folders)) or 1
+  if workers > 1:
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+      results = list(executor.map(_simulate_site, [config] * len(site_folders), site_folders))
+  else:
+    results = [_simulate_site(config, site_folder) for site_folder in site_folders]
+  return {str(site_folder): result for site_folder, result in zip(site_folders, results)}
+
+if __name__ == "__main__":
+  with profiled("genset_dispatch"):
+    with open("config/savings_config.json") as f:
+      config = json.load(f)
+    site_folders = [Path(folder) for folder in sys.argv[1:]] or [Path(f"data/genset_savings_data/{config['year']}")]
+    for site_folder, totals in simulate_fleet(config, site_folders).items():
+      logging.info(f"{site_folder}: {totals['events']} events, {totals['sim_starts']:.0f} starts, {totals['sim_run_hours']:.1f} run hours, {totals['sim_fuel_litres']:.1f} L, savings {totals['sim_genset_savings']:.2f}.")
@@ -4,16 +4,32 @@ from pathlib import Path
 import sys
 from typing import Dict, List, Tuple, Optional
 import xlsxwriter
-import openpyxl
 import logging
-from datetime import datetime
+import numpy as np
+from archives import folder_exists, locate
+from formatting import ColumnWidths, SheetFormatter
+from genset_dispatch import GensetDispatchSimulator
+from ingest import RejectReport, column_values, parse_numbers, read_table, reject_path
+from memo import ResultCache
+from profiling import profiled
+from render import render, render_outputs, render_state_path, save_render_state, summary_formats
+from result_store import record_run
+from records import GENSET_FIELDS, GensetEvents, read_genset_events
+from rollups import Rollup, rollup_path
+from tariff import TOU_PREFIX, Tariff
+
+SUMMARY_HEADERS = ["Month", "Total kWh Saved", "Number of Outages", "Genset Fuel Savings", "Outage Savings", "Total Month Genset Savings", "Solar Yield", "Grid Yield", "Genset Yield", "Simulated Fuel (L)", "Simulated Genset Starts", "Simulated Run Hours", "Simulated Genset Savings"]
+SUMMARY_NUMBER_FORMATS = [None, "energy", "count", "currency", "currency", "currency", "energy", "energy", "energy", "decimal", "count", "decimal", "currency"]
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
 class CalculateGensetSavings:
+  RENDER_STATE = ("months_list", "rollup", "month_rollups", "month_events", "month_sheets", "solar_yield_data", "grid_yield_data", "genset_yield_data")  # attributes write_workbook() reads, saved for the render pool
+
   def __init__(self, config_file: str):
     self.config_file = config_file
     self.config = self.load_config()
+    self.rejects = RejectReport()
     self.months_list = [
       "January", "February", "March", "April", "May", "June",
       "July", "August", "September", "October", "November", "December"
@@ -21,6 +37,11 @@ class CalculateGensetSavings:
     self.solar_yield_data = self.load_yield_data("Solar-Energy-Yield-Month.csv", "Solar_Energy_Yield_Month")
     self.grid_yield_data = self.load_yield_data("Grid-Energy-Yield-Month.csv", "Grid_Energy_Yield_Month")
     self.genset_yield_data = self.load_yield_data("Genset-Energy-Yield-Month.csv", "Genset_Energy_Yield_Month")
+    self.month_rollups: Dict[str, Rollup] = {}
+    self.month_events: Dict[str, GensetEvents] = {}
+    self.month_sheets: Dict[str, ColumnWidths] = {}
+    self.dispatch = GensetDispatchSimulator(self.config)
+    self.tariff = Tariff.from_config(self.config, "genset_fuel")
 
   def load_config(self) -> Dict:
     """Load configuration from a JSON file."""
@@ -37,103 +58,150 @@ class CalculateGensetSavings:
   def confirm_year_folder(self) -> None:
     """Confirm the existence of the year folder."""
     year_folder = Path(f"data/genset_savings_data/{self.config['year']}")
-    if not year_folder.exists():
+    if not folder_exists(year_folder):
       logging.error(f"data/genset_savings_data/{self.config['year']} folder does not exist. Exiting.")
       sys.exit()
     logging.info(f"data/genset_savings_data/{self.config['year']} folder exists.")
 
   def clean_month_csv_files(self) -> None:
-    """Remove the 'Conditions Met' column, remove previously calculated savings, and remove empty rows from the CSV file."""
-    refined_data = {}
+    """Remove the 'Conditions Met' column, remove previously calculated savings, and remove empty rows from the CSV file.
+
+    A month stored compressed or in a zip archive is written out as a plain CSV file, which is read from then on.
+    """
     for month in self.months_list:
-      refined_month_data = []
       file_path = Path(f"data/genset_savings_data/{self.config['year']}/{month}-Genset-Savings.csv")
-      if not file_path.exists():
+      source = locate(file_path)
+      if source is None:
         logging.warning(f"data/genset_savings_data/{month}-Genset-Savings.csv does not exist.")
         continue
-      with open(file_path, mode='r', newline='') as infile:
-        reader = csv.DictReader(infile)
-        fieldnames = [field for field in reader.fieldnames if field != "Conditions Met"]
-        for row in reader:
-          if any(row.values()) and "Total savings" not in row.values():
-            refined_row = {field: row[field] for field in fieldnames}
-            refined_month_data.append(refined_row)
-      refined_data[month] = refined_month_data
-
-    for month, data in refined_data.items():
-      file_path = Path(f"data/genset_savings_data/{self.config['year']}/{month}-Genset-Savings.csv")
-      with open(file_path, mode='w', newline='') as outfile:
-        writer = csv.DictWriter(outfile, fieldnames=fieldnames)
-        writer.writeheader()
-        writer.writerows(data)
+      events = self._read_month_events(source)
+      if events is None:
+        continue
+      self._write_month_events(file_path, events)
       logging.info(f"Removed 'Conditions Met' column and empty rows from {file_path}.")
 
-  def _parse_time(self, time_str: str) -> datetime:
-    """Parse a time string into a datetime object."""
-    return datetime.strptime(time_str, "%H:%M:%S")
+  def _read_month_events(self, file_path: Path, column_widths: Optional[ColumnWidths] = None) -> Optional[GensetEvents]:
+    """Read the outage events of a month CSV file, skipping empty rows and previously calculated savings, and masking out invalid rows."""
+    return read_genset_events(file_path, self.rejects, column_widths)
+
+  def _write_month_events(self, file_path: Path, events: GensetEvents) -> None:
+    """Write the kept outage events back to a month CSV file."""
+    file_path.parent.mkdir(parents=True, exist_ok=True)
+    with open(file_path, mode='w', newline='') as outfile:
+      writer = csv.writer(outfile)
+      writer.writerow(GENSET_FIELDS)
+      writer.writerows(events.to_rows())
 
   def remove_short_close_entries(self) -> None:
     """Remove rows with 'Time Elapsed (minutes)' less than 1.1 and that are too close in time to the previous row by less than 6 minutes from the CSV files."""
     for month in self.months_list:
       file_path = Path(f"data/genset_savings_data/{self.config['year']}/{month}-Genset-Savings.csv")
-      if not file_path.exists():
+      source = locate(file_path)
+      if source is None:
         logging.warning(f"{month}-Genset-Savings.csv does not exist.")
         continue
-      filtered_data = []
-      with open(file_path, mode='r', newline='') as infile:
-        reader = csv.DictReader(infile)
-        fieldnames = reader.fieldnames
-        prev_time = None
-        for row in reader:
-          try:
-            time_elapsed = float(row["Time Elapsed (minutes)"])
-            current_time = self._parse_time(row["Time Initiated"])
-            if time_elapsed >= 1.1:
-              if prev_time is None or (current_time - prev_time).total_seconds() / 60 >= 6:
-                filtered_data.append(row)
-                prev_time = current_time
-          except ValueError:
-            logging.warning(f"Invalid data in row: {row}. Skipping.")
-            continue
-      with open(file_path, mode='w', newline='') as outfile:
-        writer = csv.DictWriter(outfile, fieldnames=fieldnames)
-        writer.writeheader()
-        writer.writerows(filtered_data)
+      events = self._read_month_events(source)
+      if events is None:
+        continue
+      self._write_month_events(file_path, self._filter_short_close_events(events))
       logging.info(f"Filtered out short entries (< 1.1 minutes) and close entries (< 6 minutes) from {file_path}.")
 
+  def _filter_short_close_events(self, events: GensetEvents) -> GensetEvents:
+    """Keep the events lasting at least 1.1 minutes that start at least 6 minutes after the previous kept event.
+
+    The duration test is one mask over the whole column. Only the events passing it are walked in order, as
+    the spacing test depends on the previous kept event.
+    """
+    keep = events.select(events.time_elapsed >= 1.1).keep
+    seconds_of_day = events.seconds_of_day
+    prev_time = None
+    for idx in np.flatnonzero(keep).tolist():
+      current_time = int(seconds_of_day[idx])
+      if prev_time is None or (current_time - prev_time) / 60 >= 6:
+        prev_time = current_time
+      else:
+        keep[idx] = False
+    return events.select(keep)
+
   def load_yield_data(self, filename: str, yield_column: str) -> Dict[str, float]:
-    """Load yield data from CSV file."""
+    """Load yield data from CSV file, rejecting invalid values."""
     year = self.config["year"]
-    yield_file = Path(f"data/yield_data/{year}/{filename}")
-    if not yield_file.exists():
+    yield_file = locate(Path(f"data/yield_data/{year}/{filename}"))
+    if yield_file is None:
       logging.warning(f"{filename} does not exist. Skipping.")
       return {}
-    with open(yield_file, mode='r', newline='') as infile:
-      reader = csv.reader(infile)
-      headers = next(reader)
-      try:
-        category_idx = 0
-        yield_idx = headers.index(yield_column)
-      except ValueError:
-        logging.error(f"Required columns not found in {yield_file}. Skipping.")
-        return {}
-      yield_data = {}
-      for row in reader:
-        try:
-          yield_data[row[category_idx]] = float(row[yield_idx])
-        except ValueError:
-          logging.warning(f"Invalid data for {row[category_idx]} in {filename}. Skipping.")
-      logging.info(f"Loaded {filename}.")
-      return yield_data
+    headers, rows = read_table(yield_file)
+    if yield_column not in headers:
+      logging.error(f"Required columns not found in {yield_file}. Skipping.")
+      return {}
+    values = column_values(rows, headers.index(yield_column))
+    yields, valid = parse_numbers(values)
+    self.rejects.record(yield_file, yield_column, values, valid, rows)
+    logging.info(f"Loaded {filename}.")
+    return {str(category): float(value) for category, value in zip(np.array(column_values(rows, 0))[valid], yields[valid])}
+
+  def _result_cache(self) -> ResultCache:
+    """Return the result cache entry of this run, keyed on the input files and the config sections this calculator reads."""
+    year = self.config["year"]
+    site = self.config["site"]
+    outputs = [Path(f"results/{year}_{site}_Genset_Fuel_Savings.xlsx"), rollup_path(year, site, "Genset_Fuel"), rollup_path(year, site, "Yield"), reject_path(year, site, "Genset_Fuel")] + render_outputs(year, site, "Genset_Fuel")
+    return ResultCache(self.config, "Genset_Fuel", ["genset_fuel", "genset_dispatch", "cost_per_kWh", "tariff"], [Path(f"data/genset_savings_data/{year}"), Path(f"data/yield_data/{year}")], outputs, type(self).__module__)
+
+  def restore_cached_results(self) -> bool:
+    """Restore the outputs of an identical earlier run from the result cache. Returns False on a miss."""
+    self.cache = self._result_cache()
+    if not self.cache.restore():
+      return False
+    self.rollup = Rollup.load(rollup_path(self.config["year"], self.config["site"], "Genset_Fuel"))
+    record_run(self.config, "Genset_Fuel", self.rollup, self.cache, restored=True)
+    return True
 
   def calculate_genset_savings(self) -> None:
     """Copy CSV data of each month into the XLSX file and calculate savings."""
+    if self.restore_cached_results():
+      return
+    self.compute_month_rollups()
+    self.build_rollup()
+    render(render_state_path(self.config["year"], self.config["site"], "Genset_Fuel"), summary_formats(self.config), self)
+    self.cache.store()
+
+  def compute_month_rollups(self) -> None:
+    """Read the outage events of each month and build the month rollups, keeping the column widths of each month sheet."""
+    year = self.config["year"]
+    for month in self.months_list:
+      file_path = locate(Path(f"data/genset_savings_data/{year}/{month}-Genset-Savings.csv"))
+      if file_path is None:
+        logging.warning(f"data/genset_savings_data/{year}/{month}-Genset-Savings.csv does not exist. Skipping.")
+        continue
+      column_widths = ColumnWidths(GENSET_FIELDS, padding=2)
+      events = self._read_month_events(file_path, column_widths)
+      if events is None:
+        continue
+      self.month_events[month] = events
+      self.month_sheets[month] = column_widths
+      self.month_rollups[month] = self._build_month_rollup(events)
+
+  def build_rollup(self) -> Rollup:
+    """Combine the month rollups, then save the rollup, the energy yield rollup, the reject report and the render state."""
+    year = self.config["year"]
+    site = self.config["site"]
+    self.rollup = Rollup.combine("Genset_Fuel", self.month_rollups.values())
+    self.rollup.save(rollup_path(year, site, "Genset_Fuel"))
+    self._build_yield_rollup().save(rollup_path(year, site, "Yield"))
+    self.rejects.write(reject_path(year, site, "Genset_Fuel"))
+    save_render_state(self, "Genset_Fuel")
+    record_run(self.config, "Genset_Fuel", self.rollup, self.cache)
+    return self.rollup
+
+  def write_workbook(self) -> Path:
+    """Write the month sheets and the yearly summary to an XLSX file."""
     year = self.config["year"]
     site = self.config["site"]
     results_dir = Path('results')
     results_dir.mkdir(exist_ok=True)
     file_name = results_dir / f"{year}_{site}_Genset_Fuel_Savings.xlsx"
     workbook = xlsxwriter.Workbook(file_name)
+    self.formatter = SheetFormatter(workbook)
     logging.info(f"Created XLSX file: {file_name}")
 
     summary_worksheet = workbook.add_worksheet(f"{site}_{year}_Savings_Summary")
@@ -145,96 +213,94 @@ class CalculateGensetSavings:
     self._calculate_year_genset_savings(workbook)
     workbook.close()
     logging.info(f"Completed calculating genset savings and writing: {file_name}")
+    return file_name
 
   def _process_month_data(self, workbook: xlsxwriter.Workbook, month: str) -> None:
-    """Process data for a specific month and write to the workbook."""
-    year = self.config["year"]
+    """Write the events and savings of a specific month to the workbook."""
     site = self.config["site"]
     worksheet = workbook.add_worksheet(f"{site}_{month}_Savings")
-    file_path = Path(f"data/genset_savings_data/{year}/{month}-Genset-Savings.csv")
-    if not file_path.exists():
-      logging.warning(f"{file_path} does not exist. Skipping.")
+    if month not in self.month_events:
       return
 
-    with open(file_path, mode='r', newline='') as infile:
-      reader = list(csv.reader(infile))
-      for row_idx, row in enumerate(reader):
-        for col_idx, cell in enumerate(row):
-          self._write_cell(worksheet, row_idx, col_idx, cell)
-      logging.info(f"Copied data from {file_path} to {worksheet.name}.")
-
-    self._write_calculations_to_worksheet(worksheet, reader, month)
+    events = self.month_events[month]
+    column_widths = self.month_sheets[month]
+    worksheet.write_row(0, 0, GENSET_FIELDS)
+    for col_idx, cells in enumerate(events.to_columns()):
+      worksheet.write_column(1, col_idx, cells)
+    logging.info(f"Copied {month} events to {worksheet.name}.")
 
-  def _write_cell(self, worksheet: xlsxwriter.Workbook.worksheet_class, row_idx: int, col_idx: int, cell: str) -> None:
-    """Write a cell to the worksheet, handling numbers appropriately."""
-    try:
-      number = float(cell) if '.' in cell else int(cell)
-      worksheet.write_number(row_idx, col_idx, number)
-    except ValueError:
-      worksheet.write(row_idx, col_idx, cell)
+    self._write_calculations_to_worksheet(worksheet, events, month, column_widths)
+    self.formatter.apply(worksheet, column_widths, [None, None, "decimal", "energy"])
 
-  def _write_calculations_to_worksheet(self, worksheet: xlsxwriter.Workbook.worksheet_class, reader: List[List[str]], month: str) -> None:
+  def _write_calculations_to_worksheet(self, worksheet: xlsxwriter.Workbook.worksheet_class, events: GensetEvents, month: str, column_widths: ColumnWidths) -> None:
     """Write calculations to the worksheet."""
-    energy_saving_col_idx = self._get_column_index(reader[0], "Energy Saving (kWh)")
-    if energy_saving_col_idx is None:
-      logging.warning(f"Energy Saving (kWh) column not found in {month}-Genset-Savings.csv. Skipping calculations.")
-      return
+    month_totals = self.month_rollups[month].total()
+    total_kwh_saved = month_totals.get("total_kwh_saved", 0.0)
+    num_outages = int(month_totals.get("num_outages", 0))
+    genset_fuel_savings = month_totals.get("genset_fuel_savings", 0.0)
+    outage_savings = month_totals.get("outage_savings", 0.0)
+    total_month_genset_savings = month_totals.get("total_genset_month_savings", 0.0)
+    self._write_savings_to_worksheet(worksheet, len(events) + 1, total_kwh_saved, num_outages, genset_fuel_savings, outage_savings, total_month_genset_savings, month, column_widths)
+
+  def _build_yield_rollup(self) -> Rollup:
+    """Build a rollup of the monthly solar, grid and genset energy yields, each dated at the start of its month."""
+    year = self.config["year"]
+    months = [month for month in self.months_list if month in self.solar_yield_data or month in self.grid_yield_data or month in self.genset_yield_data]
+    timestamps = np.array([f"{year}-{self.months_list.index(month) + 1:02d}-01" for month in months], dtype="datetime64[s]")
+    return Rollup.from_intervals("Yield", timestamps, {
+      "solar_yield": np.array([self.solar_yield_data.get(month, 0.0) for month in months], dtype=np.float64),
+      "grid_yield": np.array([self.grid_yield_data.get(month, 0.0) for month in months], dtype=np.float64),
+      "genset_yield": np.array([self.genset_yield_data.get(month, 0.0) for month in months], dtype=np.float64)
+    })
+
+  def _build_month_rollup(self, events: GensetEvents) -> Rollup:
+    """Build the month rollup from the kept outage events with an energy saving."""
+    events = events.with_saving()
+    timestamps = events.timestamps.astype("datetime64[s]")
+    kwh_saved = events.energy_saving
+    outages = np.ones(len(events), dtype=np.float64)
+    price_factors = self.tariff.factors(timestamps)
+    genset_fuel_savings, outage_savings, total_genset_savings = self._calculate_costs(kwh_saved, outages, price_factors)
+    simulation = self.dispatch.simulate_events(events)
+    measures = {
+      "total_kwh_saved": kwh_saved,
+      "num_outages": outages,
+      "genset_fuel_savings": genset_fuel_savings,
+      "outage_savings": outage_savings,
+      "total_genset_month_savings": total_genset_savings,
+      **simulation
+    }
+    if not self.tariff.is_flat:
+      measures[f"{TOU_PREFIX}total_kwh_saved"] = kwh_saved * price_factors
+    return Rollup.from_intervals("Genset_Fuel", timestamps, measures)
 
-    total_kwh_saved, num_outages = self._calculate_savings(reader, energy_saving_col_idx)
-    genset_fuel_savings, outage_savings, total_month_genset_savings = self._calculate_costs(total_kwh_saved, num_outages)
-    self._write_savings_to_worksheet(worksheet, reader, total_kwh_saved, num_outages, genset_fuel_savings, outage_savings, total_month_genset_savings, month)
-    self._adjust_column_widths(worksheet, reader)
-
-  def _get_column_index(self, header: List[str], column_name: str) -> Optional[int]:
-    """Get the index of a column in the header."""
-    for col_idx, col_name in enumerate(header):
-      if col_name == column_name:
-        return col_idx
-    return None
-
-  def _calculate_savings(self, reader: List[List[str]], energy_saving_col_idx: int) -> Tuple[float, int]:
-    """Calculate total kWh saved and number of outages."""
-    total_kwh_saved = sum(float(row[energy_saving_col_idx]) for row in reader[1:] if row[energy_saving_col_idx])
-    num_outages = len([row for row in reader[1:] if row[energy_saving_col_idx]])
-    return total_kwh_saved, num_outages
-
-  def _calculate_costs(self, total_kwh_saved: float, num_outages: int) -> Tuple[float, float, float]:
-    """Calculate genset fuel savings, outage savings, and total month genset savings."""
+  def _calculate_costs(self, total_kwh_saved: np.ndarray, num_outages: np.ndarray, price_factors: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Calculate per-event genset fuel savings, at the tariff factor of the event's start, outage savings, and total genset savings."""
     cost_fuel_plus_MTCE = self.config["genset_fuel"]["cost_fuel_plus_MTCE"]
-    genset_fuel_savings = total_kwh_saved * cost_fuel_plus_MTCE
+    genset_fuel_savings = total_kwh_saved * cost_fuel_plus_MTCE * price_factors
     cost_per_outage = self.config["genset_fuel"]["cost_per_outage"]
     outage_savings = num_outages * cost_per_outage
     total_month_genset_savings = genset_fuel_savings + outage_savings
     return genset_fuel_savings, outage_savings, total_month_genset_savings
 
-  def _write_savings_to_worksheet(self, worksheet: xlsxwriter.Workbook.worksheet_class, reader: List[List[str]], total_kwh_saved: float, num_outages: int, genset_fuel_savings: float, outage_savings: float, total_month_genset_savings: float, month: str) -> None:
+  def _write_savings_to_worksheet(self, worksheet: xlsxwriter.Workbook.worksheet_class, reader_length: int, total_kwh_saved: float, num_outages: int, genset_fuel_savings: float, outage_savings: float, total_month_genset_savings: float, month: str, column_widths: ColumnWidths) -> None:
     """Write savings data to the worksheet."""
-    worksheet.write(len(reader) + 1, 0, "Total kWh Saved")
-    worksheet.write(len(reader) + 1, 1, total_kwh_saved)
-    worksheet.write(len(reader) + 3, 0, "Number of Outages")
-    worksheet.write(len(reader) + 3, 1, num_outages)
-    worksheet.write(len(reader) + 5, 0, "Genset Fuel Savings")
-    worksheet.write(len(reader) + 5, 1, genset_fuel_savings)
-    worksheet.write(len(reader) + 7, 0, "Outage Savings")
-    worksheet.write(len(reader) + 7, 1, outage_savings)
-    worksheet.write(len(reader) + 9, 0, "Total Month Genset Savings")
-    worksheet.write(len(reader) + 9, 1, total_month_genset_savings)
-    worksheet.write(len(reader) + 11, 0, "Solar Yield")
-    worksheet.write(len(reader) + 11, 1, self.solar_yield_data.get(month, 0))
-    worksheet.write(len(reader) + 13, 0, "Grid Yield")
-    worksheet.write(len(reader) + 13, 1, self.grid_yield_data.get(month, 0))
-    worksheet.write(len(reader) + 15, 0, "Genset Yield")
-    worksheet.write(len(reader) + 15, 1, self.genset_yield_data.get(month, 0))
-    self._adjust_column_widths(worksheet, reader)
+    savings = [
+      ("Total kWh Saved", total_kwh_saved, "energy"),
+      ("Number of Outages", num_outages, "count"),
+      ("Genset Fuel Savings", genset_fuel_savings, "currency"),
+      ("Outage Savings", outage_savings, "currency"),
+      ("Total Month Genset Savings", total_month_genset_savings, "currency"),
+      ("Solar Yield", self.solar_yield_data.get(month, 0), "energy"),
+      ("Grid Yield", self.grid_yield_data.get(month, 0), "energy"),
+      ("Genset Yield", self.genset_yield_data.get(month, 0), "energy")
+    ]
+    for row_idx, (label, value, number_format) in enumerate(savings):
+      worksheet.write(reader_length + 1 + 2 * row_idx, 0, label)
+      worksheet.write(reader_length + 1 + 2 * row_idx, 1, value, self.formatter.format(number_format))
+      column_widths.observe(0, label)
     logging.info(f"Calculated genset savings for {month}.")
 
-  def _adjust_column_widths(self, worksheet: xlsxwriter.Workbook.worksheet_class, reader: List[List[str]]) -> None:
-    """Adjust the column widths based on the content."""
-    for col_idx, col_name in enumerate(reader[0]):
-      max_len = max(len(str(cell)) for cell in [col_name] + [row[col_idx] for row in reader[1:]])
-      worksheet.set_column(col_idx, col_idx, max_len + 2)
-    logging.info(f"Adjusted column widths for worksheet {worksheet.name}.")
-
   def _calculate_year_genset_savings(self, workbook: xlsxwriter.Workbook) -> None:
     """Calculate yearly savings and update the summary worksheet."""
     site = self.config["site"]
@@ -244,11 +310,13 @@ class CalculateGensetSavings:
 
     self._write_summary_headers(summary_worksheet)
     self._aggregate_yearly_savings(summary_worksheet)
+    column_widths = ColumnWidths(SUMMARY_HEADERS, padding=2)
+    column_widths.observe(0, "Yearly Totals")
+    self.formatter.apply(summary_worksheet, column_widths, SUMMARY_NUMBER_FORMATS)
 
   def _write_summary_headers(self, summary_worksheet: xlsxwriter.Workbook.worksheet_class) -> None:
     """Write headers to the summary worksheet."""
-    headers = ["Month", "Total kWh Saved", "Number of Outages", "Genset Fuel Savings", "Outage Savings", "Total Month Genset Savings", "Solar Yield", "Grid Yield", "Genset Yield"]
-    for col_idx, header in enumerate(headers):
+    for col_idx, header in enumerate(SUMMARY_HEADERS):
       summary_worksheet.write(0, col_idx, header)
     logging.info("Written headers to summary worksheet.")
 
@@ -262,7 +330,11 @@ class CalculateGensetSavings:
       "total_solar_yield_year": 0,
       "total_grid_yield_year": 0,
       "total_genset_yield_year": 0,
-      "total_genset_savings_year": 0
+      "total_genset_savings_year": 0,
+      "total_sim_fuel_litres_year": 0,
+      "total_sim_starts_year": 0,
+      "total_sim_run_hours_year": 0,
+      "total_sim_genset_savings_year": 0
     }
 
     for row_idx, month in enumerate(self.months_list, start=1):
@@ -272,39 +344,27 @@ class CalculateGensetSavings:
 
   def _process_month_summary(self, summary_worksheet: xlsxwriter.Workbook.worksheet_class, row_idx: int, month: str, totals: Dict[str, float]) -> None:
     """Process and write the summary for a specific month."""
-    year = self.config["year"]
-    site = self.config["site"]
-    worksheet_path = f"results/{year}_{site}_Genset_Fuel_Savings.xlsx"
-    worksheet_name = f"{site}_{month}_Savings"
-
-    try:
-      reader = []
-      with open(f"data/genset_savings_data/{year}/{month}-Genset-Savings.csv", mode='r', newline='') as infile:
-        reader = list(csv.reader(infile))
-      wb = openpyxl.load_workbook(worksheet_path, data_only=True)
-      worksheet = wb[worksheet_name]
-      month_data = self._read_month_data(worksheet, reader)
-      self._write_month_summary(summary_worksheet, row_idx, month, month_data)
-      self._update_yearly_totals(totals, month_data)
-      logging.info(f"Processed and written summary for {month}.")
-    except FileNotFoundError:
-      logging.error(f"File {worksheet_path} not found. Skipping {month}.")
-    except KeyError:
-      logging.error(f"Worksheet {worksheet_name} not found in {worksheet_path}. Skipping {month}.")
-    except Exception as e:
-      logging.error(f"An error occurred while processing {month}: {e}")
-
-  def _read_month_data(self, worksheet: openpyxl.worksheet.worksheet.Worksheet, reader: List[List[str]]) -> Dict[str, float]:
-    """Read month data from the worksheet."""
+    month_data = self._read_month_data(row_idx, month)
+    self._write_month_summary(summary_worksheet, row_idx, month, month_data)
+    self._update_yearly_totals(totals, month_data)
+    logging.info(f"Processed and written summary for {month}.")
+
+  def _read_month_data(self, month_number: int, month: str) -> Dict[str, float]:
+    """Read month data from the month row of the rollup."""
+    month_row = self.rollup.month_row(month_number) or {}
     return {
-      "total_kwh_saved": worksheet.cell(row=len(reader) + 2, column=2).value,
-      "num_outages": worksheet.cell(row=len(reader) + 4, column=2).value,
-      "genset_fuel_savings": worksheet.cell(row=len(reader) + 6, column=2).value,
-      "outage_savings": worksheet.cell(row=len(reader) + 8, column=2).value,
-      "total_genset_month_savings": worksheet.cell(row=len(reader) + 10, column=2).value,
-      "solar_yield": worksheet.cell(row=len(reader) + 12, column=2).value,
-      "grid_yield": worksheet.cell(row=len(reader) + 14, column=2).value,
-      "genset_yield": worksheet.cell(row=len(reader) + 16, column=2).value
+      "total_kwh_saved": month_row.get("total_kwh_saved", 0.0),
+      "num_outages": int(month_row.get("num_outages", 0)),
+      "genset_fuel_savings": month_row.get("genset_fuel_savings", 0.0),
+      "outage_savings": month_row.get("outage_savings", 0.0),
+      "total_genset_month_savings": month_row.get("total_genset_month_savings", 0.0),
+      "solar_yield": self.solar_yield_data.get(month, 0),
+      "grid_yield": self.grid_yield_data.get(month, 0),
+      "genset_yield": self.genset_yield_data.get(month, 0),
+      "sim_fuel_litres": month_row.get("sim_fuel_litres", 0.0),
+      "sim_starts": int(month_row.get("sim_starts", 0)),
+      "sim_run_hours": month_row.get("sim_run_hours", 0.0),
+      "sim_genset_savings": month_row.get("sim_genset_savings", 0.0)
     }
 
   def _write_month_summary(self, summary_worksheet: xlsxwriter.Workbook.worksheet_class, row_idx: int, month: str, month_data: Dict[str, float]) -> None:
@@ -318,6 +378,10 @@ class CalculateGensetSavings:
     summary_worksheet.write(row_idx, 6, month_data["solar_yield"])
     summary_worksheet.write(row_idx, 7, month_data["grid_yield"])
     summary_worksheet.write(row_idx, 8, month_data["genset_yield"])
+    summary_worksheet.write(row_idx, 9, month_data["sim_fuel_litres"])
+    summary_worksheet.write(row_idx, 10, month_data["sim_starts"])
+    summary_worksheet.write(row_idx, 11, month_data["sim_run_hours"])
+    summary_worksheet.write(row_idx, 12, month_data["sim_genset_savings"])
 
   def _update_yearly_totals(self, totals: Dict[str, float], month_data: Dict[str, float]) -> None:
     """Update the yearly totals with the data from a specific month."""
@@ -330,6 +394,10 @@ class CalculateGensetSavings:
       totals["total_solar_yield_year"] += float(month_data["solar_yield"]) if month_data["solar_yield"] is not None else 0
       totals["total_grid_yield_year"] += float(month_data["grid_yield"]) if month_data["grid_yield"] is not None else 0
       totals["total_genset_yield_year"] += float(month_data["genset_yield"]) if month_data["genset_yield"] is not None else 0
+      totals["total_sim_fuel_litres_year"] += float(month_data["sim_fuel_litres"])
+      totals["total_sim_starts_year"] += int(month_data["sim_starts"])
+      totals["total_sim_run_hours_year"] += float(month_data["sim_run_hours"])
+      totals["total_sim_genset_savings_year"] += float(month_data["sim_genset_savings"])
     except ValueError as e:
       logging.error(f"Value error while updating yearly totals: {e}")
     except TypeError as e:
@@ -349,12 +417,17 @@ class CalculateGensetSavings:
     summary_worksheet.write(row_idx, 6, totals["total_solar_yield_year"])
     summary_worksheet.write(row_idx, 7, totals["total_grid_yield_year"])
     summary_worksheet.write(row_idx, 8, totals["total_genset_yield_year"])
+    summary_worksheet.write(row_idx, 9, totals["total_sim_fuel_litres_year"])
+    summary_worksheet.write(row_idx, 10, totals["total_sim_starts_year"])
+    summary_worksheet.write(row_idx, 11, totals["total_sim_run_hours_year"])
+    summary_worksheet.write(row_idx, 12, totals["total_sim_genset_savings_year"])
     logging.info("Written yearly totals to summary worksheet.")
 
 if __name__ == "__main__":
-  config_file = "config/savings_config.json"
-  calculator = CalculateGensetSavings(config_file)
-  calculator.confirm_year_folder()
-  calculator.clean_month_csv_files()
-  calculator.remove_short_close_entries()
-  calculator.calculate_genset_savings()
\ No newline at end of file
+  with profiled("genset_fuel_savings"):
+    config_file = "config/savings_config.json"
+    calculator = CalculateGensetSavings(config_file)
+    calculator.confirm_year_folder()
+    calculator.clean_month_csv_files()
+    calculator.remove_short_close_entries()
+    calculator.calculate_genset_savings()
\ No newline at end of file
@@ -1,15 +1,31 @@
 import json
-import csv
+import re
 from pathlib import Path
 import sys
-from typing import Dict, List, Tuple, Optional
+from typing import Dict, Iterator, List, Tuple, Optional
 import xlsxwriter
-import openpyxl
 import logging
+import numpy as np
+from archives import locate
+from chunked import DEFAULT_BLOCK_ROWS, BlockReader, chunk_rows
+from ingest import RejectReport, column_values, parse_numbers, reject_path
+from memo import ResultCache
+from profiling import profiled
+from qc import QualityScanner, qc_path
+from render import render, render_outputs, render_state_path, save_render_state, summary_formats
+from result_store import record_run
+from records import HarmonicSamples
+from rollups import Rollup, rollup_path
+from tariff import TOU_PREFIX, Tariff
+
+HARMONIC_ORDER_COLUMN = re.compile(r"^h(\d+)(?: \(%\))?$", re.IGNORECASE)  # per-order current in % of the fundamental, e.g. "h5" or "H5 (%)"
+INTERVAL_HOURS = 5 / 60  # 5 minutes interval
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
 class CalculateHarmonicSavings:
+  RENDER_STATE = ("months_list", "rollup", "month_rollups", "harmonic_data", "month_savings", "harmonic_orders")  # attributes write_workbook() reads, saved for the render pool
+
   def __init__(self, config_file: str):
     self.config_file = config_file
     self.config = self.load_config()
@@ -17,7 +33,21 @@ class CalculateHarmonicSavings:
       "January", "February", "March", "April", "May", "June",
       "July", "August", "September", "October", "November", "December"
     ]
-    self.harmonic_data = self.load_harmonic_data("Harmonic-Distortion-Month.csv")
+    self.timestamp_format = self.config["harmonics"].get("timestamp_format", "%d/%m/%Y %H:%M")
+    self.harmonic_orders = np.array([], dtype=np.int64)
+    self.month_rollups: Dict[str, Rollup] = {}
+    self.rejects = RejectReport()
+    self.quality = QualityScanner(self.config)
+    self.harmonic_data: Dict[str, HarmonicSamples] = {}
+    self.month_savings: Dict[str, Dict[str, np.ndarray]] = {}
+    self.tariff = Tariff.from_config(self.config, "harmonics")
+
+  def load_data(self) -> None:
+    """Load the harmonic samples, or in chunked mode build the month rollups directly from blocks."""
+    if chunk_rows(self.config):
+      self.month_rollups = self.rollup_harmonic_data_in_blocks("Harmonic-Distortion-Month.csv")
+    else:
+      self.harmonic_data = self.load_harmonic_data("Harmonic-Distortion-Month.csv")
 
   def load_config(self) -> Dict:
     """Load configuration from a JSON file."""
@@ -31,30 +61,117 @@ class CalculateHarmonicSavings:
       logging.info(f"Loaded {self.config_file}.")
     return config
 
-  def load_harmonic_data(self, filename: str) -> Dict[str, List[Dict[str, float]]]:
+  def load_harmonic_data(self, filename: str) -> Dict[str, HarmonicSamples]:
     """Load harmonic distortion data from CSV file."""
+    month_blocks = {month: [] for month in self.months_list}
+    for month, samples in self._iter_month_sample_blocks(filename, DEFAULT_BLOCK_ROWS):
+      month_blocks[month].append(samples)
+    logging.info(f"Loaded {filename}.")
+    return {month: HarmonicSamples.concatenate(blocks) for month, blocks in month_blocks.items() if blocks}
+
+  def rollup_harmonic_data_in_blocks(self, filename: str) -> Dict[str, Rollup]:
+    """Stream harmonic distortion data from CSV file in blocks and build the month rollups without loading the samples."""
+    partial_rollups = {month: [] for month in self.months_list}
+    for month, samples in self._iter_month_sample_blocks(filename, chunk_rows(self.config)):
+      partial_rollups[month].append(self._build_rollup(samples, self._calculate_savings(samples)))
+    return {month: Rollup.combine("Harmonic", partials) for month, partials in partial_rollups.items() if partials}
+
+  def _iter_month_sample_blocks(self, filename: str, block_rows: Optional[int]) -> Iterator[Tuple[str, HarmonicSamples]]:
+    """Yield (month, samples) for each month present in each block of the harmonic distortion CSV file, rejecting rows with invalid readings."""
     year = self.config["year"]
-    harmonic_file = Path(f"data/harmonic_data/{year}/{filename}")
-    if not harmonic_file.exists():
+    harmonic_file = locate(Path(f"data/harmonic_data/{year}/{filename}"))
+    if harmonic_file is None:
       logging.warning(f"{filename} does not exist. Skipping.")
-      return {}
-    with open(harmonic_file, mode='r', newline='') as infile:
-      reader = csv.DictReader(infile)
-      harmonic_data = {month: [] for month in self.months_list}
-      for row in reader:
-        month = row["Month"]
-        if month in harmonic_data:
-          harmonic_data[month].append({
-            "timestamp": row["Timestamp"],
-            "THD_I": float(row["THD_I"]),
-            "THD_V": float(row["THD_V"]),
-            "Apparent Power (kVA)": float(row["Apparent Power (kVA)"])
-          })
-      logging.info(f"Loaded {filename}.")
-      return harmonic_data
+      return
+    masked_rows = self.quality.scan(harmonic_file, self.timestamp_format, ["THD_I", "THD_V", "Apparent Power (kVA)"], ["Timestamp"])
+    with BlockReader(harmonic_file, block_rows, self.timestamp_format, ["Timestamp"], self.rejects, masked_rows) as blocks:
+      month_idx = blocks.header.index("Month")
+      value_idx = [blocks.header.index(column) for column in ("THD_I", "THD_V", "Apparent Power (kVA)")] + self._harmonic_order_columns(blocks.header)
+      for timestamps, rows in blocks:
+        months = np.array(column_values(rows, month_idx))
+        columns = []
+        valid = np.ones(len(rows), dtype=bool)
+        for col_idx in value_idx:
+          values = column_values(rows, col_idx)
+          numbers, column_valid = parse_numbers(values)
+          self.rejects.record(harmonic_file, blocks.header[col_idx], values, column_valid, rows)
+          columns.append(numbers)
+          valid &= column_valid
+        samples = HarmonicSamples(timestamps, *columns[:3], np.stack(columns[3:], axis=1) if len(columns) > 3 else None).select(valid)
+        months = months[valid]
+        for month in np.unique(months):
+          if month in self.months_list:
+            yield str(month), samples.select(months == month)
+    logging.info(f"Read {blocks.rows_read} rows from {filename}.")
+
+  def _harmonic_order_columns(self, header: List[str]) -> List[int]:
+    """Find the per-order current columns, set the harmonic orders they carry and return their indices."""
+    loss_model = self.config["harmonics"].get("loss_model", "auto")
+    orders = []
+    for col_idx, column in enumerate(header):
+      match = HARMONIC_ORDER_COLUMN.match(column)
+      if match and int(match.group(1)) > 1:
+        orders.append((int(match.group(1)), col_idx))
+    orders.sort()
+    if loss_model == "thd" or not orders:
+      if loss_model == "spectrum":
+        logging.warning("No per-order harmonic columns found. Using the THD-only loss model.")
+      self.harmonic_orders = np.array([], dtype=np.int64)
+      return []
+    self.harmonic_orders = np.array([order for order, _ in orders], dtype=np.int64)
+    logging.info(f"Using the per-order loss model for harmonics {self.harmonic_orders.min()} to {self.harmonic_orders.max()}.")
+    return [col_idx for _, col_idx in orders]
+
+  def _result_cache(self) -> ResultCache:
+    """Return the result cache entry of this run, keyed on the input files and the config sections this calculator reads."""
+    year = self.config["year"]
+    site = self.config["site"]
+    outputs = [Path(f"results/{year}_{site}_Harmonic_Savings.xlsx"), rollup_path(year, site, "Harmonic"), reject_path(year, site, "Harmonic"), qc_path(year, site, "Harmonic")] + render_outputs(year, site, "Harmonic")
+    return ResultCache(self.config, "Harmonic", ["harmonics", "cost_per_kWh", "tariff", "chunk_rows", "qc"], [Path(f"data/harmonic_data/{year}")], outputs, type(self).__module__)
+
+  def restore_cached_results(self) -> bool:
+    """Restore the outputs of an identical earlier run from the result cache. Returns False on a miss."""
+    self.cache = self._result_cache()
+    if not self.cache.restore():
+      return False
+    self.rollup = Rollup.load(rollup_path(self.config["year"], self.config["site"], "Harmonic"))
+    record_run(self.config, "Harmonic", self.rollup, self.cache, restored=True)
+    return True
 
   def calculate_harmonic_savings(self) -> None:
     """Calculate harmonic savings and save to an XLSX file."""
+    if self.restore_cached_results():
+      return
+    self.compute_month_rollups()
+    self.build_rollup()
+    render(render_state_path(self.config["year"], self.config["site"], "Harmonic"), summary_formats(self.config), self)
+    self.cache.store()
+
+  def compute_month_rollups(self) -> None:
+    """Load the harmonic samples and build the month rollups, keeping the per-sample savings for the month sheets."""
+    self.load_data()
+    for month in self.months_list:
+      month_data = self.harmonic_data.get(month)
+      if month_data is not None and len(month_data):
+        self.month_savings[month] = self._calculate_savings(month_data)
+        self.month_rollups[month] = self._build_rollup(month_data, self.month_savings[month])
+    for month, rollup in self.month_rollups.items():
+      self.month_rollups[month] = self.tariff.with_demand_charges(rollup, "total_energy_losses")
+
+  def build_rollup(self) -> Rollup:
+    """Combine the month rollups, then save the rollup, the reject report, the data quality report and the render state."""
+    year = self.config["year"]
+    site = self.config["site"]
+    self.rollup = Rollup.combine("Harmonic", self.month_rollups.values())
+    self.rollup.save(rollup_path(year, site, "Harmonic"))
+    self.rejects.write(reject_path(year, site, "Harmonic"))
+    self.quality.write(qc_path(year, site, "Harmonic"))
+    save_render_state(self, "Harmonic")
+    record_run(self.config, "Harmonic", self.rollup, self.cache)
+    return self.rollup
+
+  def write_workbook(self) -> Path:
+    """Write the month sheets and the yearly summary to an XLSX file."""
     year = self.config["year"]
     site = self.config["site"]
     results_dir = Path('results')
@@ -63,8 +180,8 @@ class CalculateHarmonicSavings:
     workbook = xlsxwriter.Workbook(file_name)
     logging.info(f"Created XLSX file: {file_name}")
 
-    summary_worksheet = workbook.add_worksheet(f"{site}_{year}_Harmonic_Savings_Summary")
-    logging.info(f"Created summary worksheet: {site}_{year}_Harmonic_Savings_Summary.")
+    summary_worksheet = workbook.add_worksheet(f"{site}_{year}_Savings_Summary")
+    logging.info(f"Created summary worksheet: {site}_{year}_Savings_Summary.")
 
     for month in self.months_list:
       self._process_month_data(workbook, month)
@@ -72,68 +189,122 @@ class CalculateHarmonicSavings:
     self._calculate_year_harmonic_savings(workbook)
     workbook.close()
     logging.info(f"Completed calculating harmonic savings and writing: {file_name}")
+    return file_name
 
   def _process_month_data(self, workbook: xlsxwriter.Workbook, month: str) -> None:
-    """Process data for a specific month and write to the workbook."""
-    year = self.config["year"]
+    """Write data for a specific month to the workbook."""
     site = self.config["site"]
-    worksheet = workbook.add_worksheet(f"{site}_{month}_Harmonic_Savings")
+    worksheet = workbook.add_worksheet(f"{site}_{month}_Savings")
     month_data = self.harmonic_data.get(month, [])
-    if not month_data:
+    if len(month_data):
+      self._write_month_samples(worksheet, month_data, self.month_savings[month])
+    elif month not in self.month_rollups:
       logging.warning(f"No data for {month}. Skipping.")
       return
 
+    month_totals = self.month_rollups[month].total()
+    worksheet.write(len(month_data) + 1, 0, "Total Non-Compliant Energy (kVAh)")
+    worksheet.write(len(month_data) + 1, 1, month_totals["total_non_compliant_energy"])
+    worksheet.write(len(month_data) + 2, 0, "Total Energy Losses (kWh)")
+    worksheet.write(len(month_data) + 2, 1, month_totals["total_energy_losses"])
+    worksheet.write(len(month_data) + 3, 0, "Total Cost Savings ($)")
+    worksheet.write(len(month_data) + 3, 1, month_totals["total_cost_savings"])
+    if len(self.harmonic_orders) and month_totals["intervals"]:
+      worksheet.write(len(month_data) + 4, 0, "Mean K-Factor")
+      worksheet.write(len(month_data) + 4, 1, month_totals["k_factor_mean"])
+    logging.info(f"Processed and written data for {month}.")
+
+  def _write_month_samples(self, worksheet: xlsxwriter.Workbook.worksheet_class, month_data: HarmonicSamples, savings: Dict[str, np.ndarray]) -> None:
+    """Write the per-sample calculations of a month loaded in memory."""
     headers = ["Timestamp", "THD_I", "THD_V", "Apparent Power (kVA)", "Non-Compliant Energy (kVAh)", "Energy Losses (kWh)", "Cost Savings ($)"]
+    columns = [month_data.thd_i, month_data.thd_v, month_data.apparent_power, savings["non_compliant_energy"], savings["energy_losses"], savings["cost_savings"]]
+    if len(self.harmonic_orders):
+      headers.append("K-Factor")
+      columns.append(savings["k_factor"])
     for col_idx, header in enumerate(headers):
       worksheet.write(0, col_idx, header)
 
-    total_non_compliant_energy = 0
-    total_energy_losses = 0
-    total_cost_savings = 0
+    worksheet.write_column(1, 0, np.char.replace(np.datetime_as_string(month_data.timestamps, unit="s"), "T", " ").tolist())
+    for col_idx, values in enumerate(columns, start=1):
+      worksheet.write_column(1, col_idx, values.tolist())
 
-    for row_idx, data in enumerate(month_data, start=1):
-      non_compliant_energy, energy_losses, cost_savings = self._calculate_savings(data)
-      total_non_compliant_energy += non_compliant_energy
-      total_energy_losses += energy_losses
-      total_cost_savings += cost_savings
+  def _build_rollup(self, samples: HarmonicSamples, savings: Dict[str, np.ndarray]) -> Rollup:
+    """Build a rollup from the per-sample savings."""
+    return Rollup.from_intervals("Harmonic", samples.timestamps, self._interval_measures(savings))
 
-      worksheet.write(row_idx, 0, data["timestamp"])
-      worksheet.write(row_idx, 1, data["THD_I"])
-      worksheet.write(row_idx, 2, data["THD_V"])
-      worksheet.write(row_idx, 3, data["Apparent Power (kVA)"])
-      worksheet.write(row_idx, 4, non_compliant_energy)
-      worksheet.write(row_idx, 5, energy_losses)
-      worksheet.write(row_idx, 6, cost_savings)
+  def _interval_measures(self, savings: Dict[str, np.ndarray]) -> Dict[str, np.ndarray]:
+    """Return the rollup measures of each sample from its savings."""
+    measures = {
+      "total_non_compliant_energy": savings["non_compliant_energy"],
+      "total_thd_weighted_energy": savings["thd_weighted_energy"],
+      "total_spectrum_losses": savings["spectrum_losses"],
+      "total_energy_losses": savings["energy_losses"],
+      "total_cost_savings": savings["cost_savings"],
+      "k_factor_sum": savings["k_factor"]
+    }
+    if not self.tariff.is_flat:
+      measures[f"{TOU_PREFIX}total_thd_weighted_energy"] = savings["thd_weighted_energy"] * savings["price_factors"]
+      measures[f"{TOU_PREFIX}total_spectrum_losses"] = savings["spectrum_losses"] * savings["price_factors"]
+    return measures
 
-    worksheet.write(len(month_data) + 1, 0, "Total Non-Compliant Energy (kVAh)")
-    worksheet.write(len(month_data) + 1, 1, total_non_compliant_energy)
-    worksheet.write(len(month_data) + 2, 0, "Total Energy Losses (kWh)")
-    worksheet.write(len(month_data) + 2, 1, total_energy_losses)
-    worksheet.write(len(month_data) + 3, 0, "Total Cost Savings ($)")
-    worksheet.write(len(month_data) + 3, 1, total_cost_savings)
-    logging.info(f"Processed and written data for {month}.")
+  def _calculate_savings(self, samples: HarmonicSamples) -> Dict[str, np.ndarray]:
+    """Calculate per-interval non-compliant energy, energy losses, and cost savings.
 
-  def _calculate_savings(self, data: Dict[str, float]) -> Tuple[float, float, float]:
-    """Calculate non-compliant energy, energy losses, and cost savings."""
-    thd_i_limit = self.config["harmonic_limits"]["THD_I"]
-    thd_v_limit = self.config["harmonic_limits"]["THD_V"]
-    non_compliant_energy = 0
-    energy_losses = 0
-    cost_savings = 0
+    Energy losses come from the per-order model when the samples carry a harmonic spectrum, and from
+    loss_factor_k times the THD_I-weighted non-compliant energy otherwise. Both are kept separately
+    (thd_weighted_energy, spectrum_losses) so the losses can be re-priced without the samples. The losses
+    are priced at cost_per_kWh times the tariff factor of each sample's timestamp.
+    """
+    thd_i_limit = self.config["harmonics"]["acceptable_THD_I"]
+    thd_v_limit = self.config["harmonics"]["acceptable_THD_V"]
+    non_compliant = (samples.thd_i > thd_i_limit) | (samples.thd_v > thd_v_limit)
+    non_compliant_energy = np.where(non_compliant, samples.apparent_power * INTERVAL_HOURS, 0.0)
+    if samples.spectrum.shape[1]:
+      loss_power, k_factor = self._spectrum_losses(samples)
+      thd_weighted_energy = np.zeros(len(samples))
+      spectrum_losses = np.where(non_compliant, loss_power * INTERVAL_HOURS, 0.0)
+      energy_losses = spectrum_losses
+    else:
+      k_factor = np.zeros(len(samples))
+      thd_weighted_energy = non_compliant_energy * (samples.thd_i / 100)
+      spectrum_losses = np.zeros(len(samples))
+      energy_losses = self.config["harmonics"]["loss_factor_k"] * non_compliant_energy * (samples.thd_i / 100)
+    price_factors = self.tariff.factors(samples.timestamps)
+    return {
+      "non_compliant_energy": non_compliant_energy,
+      "thd_weighted_energy": thd_weighted_energy,
+      "spectrum_losses": spectrum_losses,
+      "energy_losses": energy_losses,
+      "cost_savings": energy_losses * self.config["cost_per_kWh"] * price_factors,
+      "k_factor": k_factor,
+      "price_factors": price_factors
+    }
 
-    if data["THD_I"] > thd_i_limit or data["THD_V"] > thd_v_limit:
-      non_compliant_energy = data["Apparent Power (kVA)"] * (5 / 60)  # 5 minutes interval
-      energy_losses = self.config["loss_factor"] * non_compliant_energy * (data["THD_I"] / 100)
-      cost_savings = energy_losses * self.config["cost_per_kwh"]
+  def _spectrum_losses(self, samples: HarmonicSamples) -> Tuple[np.ndarray, np.ndarray]:
+    """Return the harmonic I²R plus eddy-current loss power (kW) and the K-factor of each sample (IEEE C57.110).
 
-    return non_compliant_energy, energy_losses, cost_savings
+    With r_h the per-order current as a fraction of the fundamental, one (samples x orders) @ (orders x 2)
+    product gives Σ r_h² and Σ r_h² h² for every sample at once.
+    """
+    spectrum_config = self.config["harmonics"].get("spectrum", {})
+    rated_kva = spectrum_config.get("transformer_kVA", self.config["site_capacity"])
+    rated_load_loss = spectrum_config.get("load_loss_fraction", 0.01) * rated_kva  # I²R loss at rated current (kW)
+    eddy_loss_ratio = spectrum_config.get("eddy_loss_ratio", 0.1)  # eddy-current loss / I²R loss at rated current
+    ratios = samples.spectrum / 100
+    weights = np.stack((np.ones(len(self.harmonic_orders)), self.harmonic_orders.astype(np.float64) ** 2), axis=1)
+    harmonic_sums = (ratios * ratios) @ weights
+    harmonic_squares, order_weighted_squares = harmonic_sums[:, 0], harmonic_sums[:, 1]
+    fundamental_loading = (samples.apparent_power / rated_kva) ** 2 / (1 + harmonic_squares)
+    loss_power = rated_load_loss * fundamental_loading * (harmonic_squares + eddy_loss_ratio * order_weighted_squares)
+    k_factor = (1 + order_weighted_squares) / (1 + harmonic_squares)
+    return loss_power, k_factor
 
   def _calculate_year_harmonic_savings(self, workbook: xlsxwriter.Workbook) -> None:
     """Calculate yearly savings and update the summary worksheet."""
     site = self.config["site"]
     year = self.config["year"]
-    summary_worksheet = workbook.get_worksheet_by_name(f"{site}_{year}_Harmonic_Savings_Summary")
-    logging.info(f"Opened summary worksheet: {site}_{year}_Harmonic_Savings_Summary.")
+    summary_worksheet = workbook.get_worksheet_by_name(f"{site}_{year}_Savings_Summary")
+    logging.info(f"Opened summary worksheet: {site}_{year}_Savings_Summary.")
 
     self._write_summary_headers(summary_worksheet)
     self._aggregate_yearly_savings(summary_worksheet)
@@ -160,31 +331,18 @@ class CalculateHarmonicSavings:
 
   def _process_month_summary(self, summary_worksheet: xlsxwriter.Workbook.worksheet_class, row_idx: int, month: str, totals: Dict[str, float]) -> None:
     """Process and write the summary for a specific month."""
-    year = self.config["year"]
-    site = self.config["site"]
-    worksheet_path = f"results/{year}_{site}_Harmonic_Savings.xlsx"
-    worksheet_name = f"{site}_{month}_Harmonic_Savings"
-
-    try:
-      wb = openpyxl.load_workbook(worksheet_path, data_only=True)
-      worksheet = wb[worksheet_name]
-      month_data = self._read_month_data(worksheet)
-      self._write_month_summary(summary_worksheet, row_idx, month, month_data)
-      self._update_yearly_totals(totals, month_data)
-      logging.info(f"Processed and written summary for {month}.")
-    except FileNotFoundError:
-      logging.error(f"File {worksheet_path} not found. Skipping {month}.")
-    except KeyError:
-      logging.error(f"Worksheet {worksheet_name} not found in {worksheet_path}. Skipping {month}.")
-    except Exception as e:
-      logging.error(f"An error occurred while processing {month}: {e}")
+    month_data = self._read_month_data(row_idx)
+    self._write_month_summary(summary_worksheet, row_idx, month, month_data)
+    self._update_yearly_totals(totals, month_data)
+    logging.info(f"Processed and written summary for {month}.")
 
-  def _read_month_data(self, worksheet: openpyxl.worksheet.worksheet.Worksheet) -> Dict[str, float]:
-    """Read month data from the worksheet."""
+  def _read_month_data(self, month_number: int) -> Dict[str, float]:
+    """Read month data from the month row of the rollup."""
+    month_row = self.rollup.month_row(month_number) or {}
     return {
-      "total_non_compliant_energy": worksheet.cell(row=worksheet.max_row - 3, column=2).value,
-      "total_energy_losses": worksheet.cell(row=worksheet.max_row - 2, column=2).value,
-      "total_cost_savings": worksheet.cell(row=worksheet.max_row - 1, column=2).value
+      "total_non_compliant_energy": month_row.get("total_non_compliant_energy", 0.0),
+      "total_energy_losses": month_row.get("total_energy_losses", 0.0),
+      "total_cost_savings": month_row.get("total_cost_savings", 0.0)
     }
 
   def _write_month_summary(self, summary_worksheet: xlsxwriter.Workbook.worksheet_class, row_idx: int, month: str, month_data: Dict[str, float]) -> None:
@@ -217,6 +375,7 @@ class CalculateHarmonicSavings:
     logging.info("Written yearly totals to summary worksheet.")
 
 if __name__ == "__main__":
-  config_file = "config/harmonic_savings_config.json"
-  calculator = CalculateHarmonicSavings(config_file)
-  calculator.calculate_harmonic_savings()
\ No newline at end of file
+  with profiled("harmonics_savings"):
+    config_file = "config/savings_config.json"
+    calculator = CalculateHarmonicSavings(config_file)
+    calculator.calculate_harmonic_savings()
\ No newline at end of file
@@ -0,0 +1,185 @@
+import hashlib
+import json
+import logging
+import os
+import shutil
+import sys
+import threading
+import time
+from pathlib import Path
+from types import ModuleType
+from typing import Dict, Iterable, List, Optional, Sequence, Set
+from archives import folder_archives
+
+CACHE_DIR = Path("results/cache")
+DIGESTS_FILE = "digests.json"
+MANIFEST_FILE = "manifest.json"
+DEFAULT_MAX_MB = 512
+HASH_BLOCK_BYTES = 1 << 20
+SCRIPTS_DIR = Path(__file__).resolve().parent
+_CACHE_LOCK = threading.Lock()  # calculators may run on concurrent pipeline threads
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+def _file_digest(path: Path) -> str:
+  """Return the BLAKE2b digest of a file's contents."""
+  digest = hashlib.blake2b(digest_size=16)
+  with open(path, mode='rb') as infile:
+    for block in iter(lambda: infile.read(HASH_BLOCK_BYTES), b""):
+      digest.update(block)
+  return digest.hexdigest()
+
+def _local_modules(module: ModuleType, seen: Optional[Set[str]] = None) -> Set[str]:
+  """Return the source files of a script module and of the sibling script modules it uses, transitively."""
+  seen = seen if seen is not None else set()
+  module_file = getattr(module, "__file__", None)
+  if not module_file or Path(module_file).resolve().parent != SCRIPTS_DIR or module_file in seen:
+    return seen
+  seen.add(module_file)
+  for value in vars(module).values():
+    dependency = value if isinstance(value, ModuleType) else sys.modules.get(getattr(value, "__module__", None) or "")
+    if dependency is not None:
+      _local_modules(dependency, seen)
+  return seen
+
+def source_digests(module_name: str) -> Dict[str, str]:
+  """Return the digest of the source of a loaded script module and of every sibling script module it uses."""
+  return {source: _file_digest(Path(source)) for source in sorted(_local_modules(sys.modules[module_name]))}
+
+def input_files(inputs: Iterable[Path]) -> List[Path]:
+  """Return the input files, the files under input folders and the zip archives beside input folders."""
+  files = []
+  for path in inputs:
+    path = Path(path)
+    if path.is_file():
+      files.append(path)
+      continue
+    if path.is_dir():
+      files.extend(sorted(file for file in path.rglob("*") if file.is_file()))
+    files.extend(folder_archives(path))
+  return files
+
+class ResultCache:
+  """Memoize a calculator's output files on disk.
+
+  The key is a digest of the calculator's input files, the config sections it reads and the source of the
+  script modules it uses. On a hit the saved workbook, rollup and reject report are copied back instead of
+  recomputing them. Entries live in results/cache/{key}/ and the least recently used are evicted when the
+  cache grows past cache.max_MB. Input file digests are reused while a file's size and mtime are unchanged.
+  """
+
+  def __init__(self, config: Dict, calculator: str, sections: Sequence[str], inputs: Iterable[Path], outputs: Sequence[Path], module_name: str, cache_dir: Path = CACHE_DIR):
+    cache_config = config.get("cache", {})
+    self.enabled = cache_config.get("enabled", True)
+    self.max_bytes = cache_config.get("max_MB", DEFAULT_MAX_MB) * 1024 * 1024
+    self.calculator = calculator
+    self.cache_dir = cache_dir
+    self.outputs = [Path(output) for output in outputs]
+    self.inputs = [Path(path) for path in inputs]
+    self.config_sections = {section: config.get(section) for section in sections}
+    self.input_digests: Dict[str, str] = {}
+    self.key = self._key(config, self.inputs, module_name) if self.enabled else ""
+    self.entry_dir = cache_dir / self.key
+
+  def _input_digests(self, inputs: Iterable[Path]) -> Dict[str, str]:
+    """Return the content digest of every input file and of the zip archives beside input folders, hashing only files whose size or mtime changed."""
+    files = input_files(inputs)
+    digests_path = self.cache_dir / DIGESTS_FILE
+    with _CACHE_LOCK:
+      known = json.loads(digests_path.read_text()) if digests_path.exists() else {}
+    digests, changed = {}, {}
+    for file in files:
+      stat = file.stat()
+      entry = known.get(str(file))
+      if not entry or entry[0] != stat.st_size or entry[1] != stat.st_mtime_ns:
+        entry = [stat.st_size, stat.st_mtime_ns, _file_digest(file)]
+        changed[str(file)] = entry
+      digests[str(file)] = entry[2]
+    if changed:
+      with _CACHE_LOCK:
+        known = json.loads(digests_path.read_text()) if digests_path.exists() else {}
+        known.update(changed)
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        temporary = digests_path.with_suffix(f".{os.getpid()}.tmp")
+        temporary.write_text(json.dumps(known))
+        os.replace(temporary, digests_path)
+    return digests
+
+  def _key(self, config: Dict, inputs: Iterable[Path], module_name: str) -> str:
+    """Return the cache key of the calculator run."""
+    code = source_digests(module_name)
+    self.input_digests = self._input_digests(inputs)
+    fingerprint = {
+      "calculator": self.calculator,
+      "year": config["year"],
+      "site": config["site"],
+      "config": self.config_sections,
+      "inputs": self.input_digests,
+      "code": code
+    }
+    return hashlib.blake2b(json.dumps(fingerprint, sort_keys=True).encode(), digest_size=16).hexdigest()
+
+  def restore(self) -> bool:
+    """Copy the cached outputs back into place. Returns False on a miss."""
+    manifest_path = self.entry_dir / MANIFEST_FILE
+    if not self.enabled or not manifest_path.exists():
+      return False
+    manifest = json.loads(manifest_path.read_text())
+    for output in self.outputs:
+      cached = manifest["outputs"].get(str(output))
+      if cached:
+        output.parent.mkdir(parents=True, exist_ok=True)
+        shutil.copy2(self.entry_dir / cached, output)
+      else:
+        output.unlink(missing_ok=True)
+    os.utime(manifest_path)
+    logging.info(f"{self.calculator} inputs and config are unchanged. Restored the results from {self.entry_dir}.")
+    return True
+
+  def store(self) -> None:
+    """Save the outputs that exist under the run's key, then evict least recently used entries over the size limit."""
+    if not self.enabled:
+      return
+    self.entry_dir.mkdir(parents=True, exist_ok=True)
+    outputs = {}
+    for idx, output in enumerate(self.outputs):
+      if output.exists():
+        cached = f"{idx}{output.suffix}"
+        shutil.copy2(output, self.entry_dir / cached)
+        outputs[str(output)] = cached
+    (self.entry_dir / MANIFEST_FILE).write_text(json.dumps({"calculator": self.calculator, "created": time.time(), "outputs": outputs}))
+    logging.info(f"Cached {self.calculator} results in {self.entry_dir}.")
+    with _CACHE_LOCK:
+      evict(self.cache_dir, self.max_bytes)
+
+def cache_entries(cache_dir: Path = CACHE_DIR) -> List[Dict]:
+  """Return the cache entries with their calculator, size and last use, least recently used first."""
+  entries = []
+  for manifest_path in cache_dir.glob(f"*/{MANIFEST_FILE}"):
+    entry_dir = manifest_path.parent
+    entries.append({
+      "dir": entry_dir,
+      "calculator": json.loads(manifest_path.read_text())["calculator"],
+      "bytes": sum(file.stat().st_size for file in entry_dir.iterdir()),
+      "last_used": manifest_path.stat().st_mtime
+    })
+  return sorted(entries, key=lambda entry: entry["last_used"])
+
+def evict(cache_dir: Path, max_bytes: int) -> None:
+  """Delete least recently used entries until the cache fits in max_bytes."""
+  entries = cache_entries(cache_dir)
+  total = sum(entry["bytes"] for entry in entries)
+  for entry in entries:
+    if total <= max_bytes:
+      break
+    shutil.rmtree(entry["dir"], ignore_errors=True)
+    total -= entry["bytes"]
+    logging.info(f"Evicted cached {entry['calculator']} results {entry['dir'].name}.")
+
+if __name__ == "__main__":
+  if sys.argv[1:] == ["clear"]:
+    shutil.rmtree(CACHE_DIR, ignore_errors=True)
+    logging.info(f"Cleared {CACHE_DIR}.")
+  else:
+    for entry in cache_entries():
+      print(f"{entry['dir'].name}  {entry['calculator']:<18} {entry['bytes'] / 1024:>10.1f} KiB  {time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(entry['last_used']))}")
@@ -0,0 +1,240 @@
+import json
+import logging
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Callable, Dict, List, Optional
+import numpy as np
+import xlsxwriter
+from formatting import ColumnWidths, SheetFormatter
+from profiling import profiled
+from rollups import Rollup, rollup_path
+from tariff import DEMAND_CHARGES, TOU_PREFIX
+from voltage_engine import PERCENT_PER_UNIT_DEVIATION
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+DRAWS_PER_CHUNK = 2048  # draws evaluated per task; chunks are seeded by index so results do not depend on the worker count
+PERCENTILES = (10, 50, 90)
+PARAMETERS = (
+  "harmonics.loss_factor_k",
+  "voltage_stability.efficiency_derate_per_percent_deviation",
+  "genset_fuel.cost_per_outage",
+  "genset_fuel.cost_fuel_plus_MTCE"
+)
+DISTRIBUTIONS = {
+  "fixed": lambda rng, spec, draws: np.full(draws, float(spec["value"])),
+  "uniform": lambda rng, spec, draws: rng.uniform(spec["low"], spec["high"], draws),
+  "triangular": lambda rng, spec, draws: rng.triangular(spec["low"], spec["mode"], spec["high"], draws),
+  "normal": lambda rng, spec, draws: np.clip(rng.normal(spec["mean"], spec["std"], draws), 0.0, None),
+  "lognormal": lambda rng, spec, draws: spec["median"] * np.exp(spec["sigma"] * rng.standard_normal(draws))
+}
+
+def _genset_model(months: Dict[str, np.ndarray], params: Dict[str, np.ndarray], config: Dict) -> np.ndarray:
+  """Genset fuel and outage savings: kWh saved at the fuel plus maintenance cost, plus the cost of each avoided outage."""
+  return months["total_kwh_saved"] * params["genset_fuel.cost_fuel_plus_MTCE"][:, None] + months["num_outages"] * params["genset_fuel.cost_per_outage"][:, None]
+
+def _harmonic_losses(months: Dict[str, np.ndarray], params: Dict[str, np.ndarray], config: Dict) -> np.ndarray:
+  """Harmonic energy losses: loss_factor_k times the THD_I-weighted non-compliant energy, plus the per-order model losses."""
+  return months["total_thd_weighted_energy"] * params["harmonics.loss_factor_k"][:, None] + months["total_spectrum_losses"]
+
+def _harmonic_model(months: Dict[str, np.ndarray], params: Dict[str, np.ndarray], config: Dict) -> np.ndarray:
+  """Harmonic savings: the harmonic energy losses priced at cost_per_kWh."""
+  return _harmonic_losses(months, params, config) * config["cost_per_kWh"]
+
+def _voltage_losses(months: Dict[str, np.ndarray], params: Dict[str, np.ndarray], config: Dict) -> np.ndarray:
+  """Voltage stability losses: the mitigated deviation energy times the efficiency derate per 1% deviation."""
+  return months["mitigated_deviation_energy"] * (params["voltage_stability.efficiency_derate_per_percent_deviation"][:, None] * PERCENT_PER_UNIT_DEVIATION)
+
+def _voltage_model(months: Dict[str, np.ndarray], params: Dict[str, np.ndarray], config: Dict) -> np.ndarray:
+  """Voltage stability savings: the voltage stability losses priced at cost_per_kWh_mismatch."""
+  return _voltage_losses(months, params, config) * config["voltage_stability"]["cost_per_kWh_mismatch"]
+
+def _fixed_model(measure: str) -> Callable:
+  """Return a model for a calculator without sampled parameters, whose savings are the same in every draw."""
+  def model(months: Dict[str, np.ndarray], params: Dict[str, np.ndarray], config: Dict) -> np.ndarray:
+    return np.broadcast_to(months[measure], (len(params[PARAMETERS[0]]), len(months[measure])))
+  return model
+
+# Savings per draw and month of each calculator as a function of the monthly rollup rows and the sampled parameters.
+MODELS = {
+  "Genset_Fuel": (("total_kwh_saved", "num_outages"), _genset_model),
+  "Harmonic": (("total_thd_weighted_energy", "total_spectrum_losses"), _harmonic_model),
+  "Voltage_Stability": (("mitigated_deviation_energy",), _voltage_model),
+  "Frequency": (("total_savings",), _fixed_model("total_savings")),
+  "Power_Factor": (("total_cost_savings",), _fixed_model("total_cost_savings"))
+}
+
+# Avoided losses per draw and month of the calculators whose rollups carry a demand charge upper bound.
+DEMAND_LOSSES = {
+  "Harmonic": _harmonic_losses,
+  "Voltage_Stability": _voltage_losses
+}
+DEMAND_SUFFIX = " Demand Charges (upper bound)"  # appended to the calculator name of the demand charge ranges
+
+def _config_value(config: Dict, parameter: str) -> float:
+  """Return the point estimate of a dotted config parameter."""
+  section, key = parameter.split(".")
+  return float(config[section][key])
+
+def _evaluate_chunk(month_data: Dict[str, Dict[str, np.ndarray]], config: Dict, distributions: Dict[str, Dict], seed: np.random.SeedSequence, draws: int) -> Dict[str, np.ndarray]:
+  """Sample the parameters for one chunk of draws and evaluate every calculator model on them.
+
+  A stored demand charge upper bound was priced on the avoided losses at the point estimates, so each draw
+  scales it by the month's losses at the sampled parameters over those at the point estimates. This is exact
+  when the sampled parameters scale every hour of the month alike, as for the voltage derate and for the
+  harmonic losses of a month priced by one loss model.
+  """
+  rng = np.random.default_rng(seed)
+  params = {}
+  for parameter in PARAMETERS:
+    spec = distributions.get(parameter)
+    params[parameter] = DISTRIBUTIONS[spec["distribution"]](rng, spec, draws) if spec else np.full(draws, _config_value(config, parameter))
+  results = {calculator: MODELS[calculator][1](months, params, config) for calculator, months in month_data.items()}
+  point_params = {parameter: np.full(1, _config_value(config, parameter)) for parameter in PARAMETERS}
+  for calculator, losses in DEMAND_LOSSES.items():
+    months = month_data.get(calculator)
+    if months is None or DEMAND_CHARGES not in months:
+      continue
+    point_losses = losses(months, point_params, config)
+    scale = np.divide(losses(months, params, config), point_losses, out=np.zeros((draws, len(point_losses[0]))), where=point_losses > 0)
+    results[f"{calculator}{DEMAND_SUFFIX}"] = months[DEMAND_CHARGES] * scale
+  return results
+
+class MonteCarloSavings:
+  def __init__(self, config_file: str):
+    self.config_file = config_file
+    self.config = self.load_config()
+    self.monte_carlo_config = self.config.get("monte_carlo", {})
+    self.distributions = self._load_distributions()
+
+  def load_config(self) -> Dict:
+    """Load configuration from a JSON file."""
+    config_path = Path(self.config_file)
+    if not config_path.exists():
+      logging.error(f"{self.config_file} does not exist. Exiting.")
+      sys.exit()
+    logging.info(f"{self.config_file} exists. Loading...")
+    with open(config_path) as f:
+      config = json.load(f)
+      logging.info(f"Loaded {self.config_file}.")
+    return config
+
+  def _load_distributions(self) -> Dict[str, Dict]:
+    """Validate the configured parameter distributions."""
+    distributions = self.monte_carlo_config.get("parameters", {})
+    for parameter, spec in distributions.items():
+      if parameter not in PARAMETERS:
+        logging.error(f"Monte Carlo parameter {parameter} is not supported. Supported parameters: {', '.join(PARAMETERS)}. Exiting.")
+        sys.exit()
+      if spec.get("distribution") not in DISTRIBUTIONS:
+        logging.error(f"Unknown distribution {spec.get('distribution')} for {parameter}. Supported distributions: {', '.join(DISTRIBUTIONS)}. Exiting.")
+        sys.exit()
+    return distributions
+
+  def load_month_data(self) -> Dict[str, Dict[str, np.ndarray]]:
+    """Read the monthly rows each calculator model needs from the saved rollups.
+
+    Rollups priced with a time-of-use tariff carry the tariff-weighted measure, which is read in place of
+    the plain one, and the demand charge upper bound, which is re-priced in every draw.
+    """
+    year = self.config["year"]
+    site = self.config["site"]
+    month_data = {}
+    for calculator, (measures, _) in MODELS.items():
+      path = rollup_path(year, site, calculator)
+      if not path.exists():
+        logging.warning(f"{path} does not exist. Run the {calculator} calculator first. Skipping.")
+        continue
+      rollup = Rollup.load(path)
+      missing_measures = [measure for measure in measures if measure not in rollup.table("month")]
+      if missing_measures:
+        logging.error(f"{path} has no {missing_measures}. Re-run the {calculator} calculator. Skipping.")
+        continue
+      month_rows = [rollup.month_row(month_number) or {} for month_number in range(1, 13)]
+      month_table = rollup.table("month")
+      sources = {measure: f"{TOU_PREFIX}{measure}" if f"{TOU_PREFIX}{measure}" in month_table else measure for measure in measures}
+      if DEMAND_CHARGES in month_table:
+        sources[DEMAND_CHARGES] = DEMAND_CHARGES
+      month_data[calculator] = {measure: np.array([row.get(source, 0.0) for row in month_rows]) for measure, source in sources.items()}
+      logging.info(f"Loaded monthly rollup rows from {path}.")
+    return month_data
+
+  def run(self, month_data: Dict[str, Dict[str, np.ndarray]], draws: int) -> Dict[str, np.ndarray]:
+    """Evaluate all draws in chunks over a process pool and return the savings per draw and month of each calculator."""
+    chunk_sizes = [min(DRAWS_PER_CHUNK, draws - start) for start in range(0, draws, DRAWS_PER_CHUNK)]
+    seeds = np.random.SeedSequence(self.monte_carlo_config.get("seed")).spawn(len(chunk_sizes))
+    workers = min(self.monte_carlo_config.get("workers") or os.cpu_count() or 1, len(chunk_sizes))
+    arguments = ([month_data] * len(chunk_sizes), [self.config] * len(chunk_sizes), [self.distributions] * len(chunk_sizes), seeds, chunk_sizes)
+    if workers > 1:
+      with ProcessPoolExecutor(max_workers=workers) as executor:
+        chunks = list(executor.map(_evaluate_chunk, *arguments))
+    else:
+      chunks = list(map(_evaluate_chunk, *arguments))
+    logging.info(f"Evaluated {draws} draws in {len(chunk_sizes)} chunks on {workers} worker(s).")
+    return {calculator: np.concatenate([chunk[calculator] for chunk in chunks]) for calculator in chunks[0]}
+
+  def point_estimates(self, month_data: Dict[str, Dict[str, np.ndarray]]) -> Dict[str, np.ndarray]:
+    """Evaluate every calculator model at the configured point estimates."""
+    return _evaluate_chunk(month_data, self.config, {}, np.random.SeedSequence(0), 1)
+
+  def calculate_savings_uncertainty(self, draws: Optional[int] = None) -> None:
+    """Run the Monte Carlo simulation and write P10/P50/P90 savings per calculator to an XLSX file."""
+    draws = draws or self.monte_carlo_config.get("draws", 10000)
+    month_data = self.load_month_data()
+    if not month_data:
+      logging.error("No rollups found for the Monte Carlo simulation. Exiting.")
+      sys.exit()
+    samples = self.run(month_data, draws)
+    point_estimates = self.point_estimates(month_data)
+
+    year = self.config["year"]
+    site = self.config["site"]
+    results_dir = Path('results')
+    results_dir.mkdir(exist_ok=True)
+    file_name = results_dir / f"{year}_{site}_Monte_Carlo_Savings.xlsx"
+    workbook = xlsxwriter.Workbook(file_name)
+    self.formatter = SheetFormatter(workbook)
+    logging.info(f"Created XLSX file: {file_name}")
+    self._write_year_percentiles(workbook.add_worksheet(f"{site}_{year}_Savings_Range"), samples, point_estimates, draws)
+    self._write_month_percentiles(workbook.add_worksheet(f"{site}_{year}_Monthly_Range"), samples)
+    workbook.close()
+    logging.info(f"Completed Monte Carlo savings and writing: {file_name}")
+
+  def _write_year_percentiles(self, worksheet: xlsxwriter.Workbook.worksheet_class, samples: Dict[str, np.ndarray], point_estimates: Dict[str, np.ndarray], draws: int) -> None:
+    """Write the yearly savings point estimate, mean and percentiles of each calculator."""
+    headers = ["Calculator", "Point Estimate", "Mean"] + [f"P{percentile}" for percentile in PERCENTILES]
+    worksheet.write_row(0, 0, headers)
+    for row_idx, (calculator, month_savings) in enumerate(samples.items(), start=1):
+      year_savings = month_savings.sum(axis=1)
+      percentiles = np.percentile(year_savings, PERCENTILES)
+      worksheet.write_row(row_idx, 0, [calculator, float(point_estimates[calculator].sum()), float(year_savings.mean())] + percentiles.tolist())
+      logging.info(f"{calculator}: P10 {percentiles[0]:.2f}, P50 {percentiles[1]:.2f}, P90 {percentiles[2]:.2f} over {draws} draws.")
+    worksheet.write(len(samples) + 2, 0, f"{draws} draws. P10 is the savings exceeded in 90% of the draws.")
+    column_widths = ColumnWidths(headers, padding=2)
+    for calculator in samples:
+      column_widths.observe(0, calculator)
+    self.formatter.apply(worksheet, column_widths, [None] + ["currency"] * (len(headers) - 1))
+
+  def _write_month_percentiles(self, worksheet: xlsxwriter.Workbook.worksheet_class, samples: Dict[str, np.ndarray]) -> None:
+    """Write the monthly savings percentiles of each calculator."""
+    months_list = [
+      "January", "February", "March", "April", "May", "June",
+      "July", "August", "September", "October", "November", "December"
+    ]
+    headers: List[str] = ["Month"]
+    worksheet.write_column(1, 0, months_list)
+    for calculator, month_savings in samples.items():
+      percentiles = np.percentile(month_savings, PERCENTILES, axis=0)
+      for percentile, values in zip(PERCENTILES, percentiles):
+        worksheet.write_column(1, len(headers), values.tolist())
+        headers.append(f"{calculator} P{percentile}")
+    worksheet.write_row(0, 0, headers)
+    self.formatter.apply(worksheet, ColumnWidths(headers, padding=2), [None] + ["currency"] * (len(headers) - 1))
+
+if __name__ == "__main__":
+  with profiled("monte_carlo"):
+    config_file = "config/savings_config.json"
+    calculator = MonteCarloSavings(config_file)
+    calculator.calculate_savings_uncertainty(int(sys.argv[1]) if len(sys.argv) > 1 else None)
@@ -0,0 +1,260 @@
+import argparse
+import json
+import logging
+import os
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterable, List, NamedTuple, Optional, Sequence, Tuple
+from archives import folder_exists
+from frequency_savings import CalculateFrequencySavings
+from genset_fuel_savings import CalculateGensetSavings
+from harmonics_savings import CalculateHarmonicSavings
+from power_factor_savings import CalculatePowerFactorSavings
+from profiling import profiled
+from render import RenderPool, render, render_state_path, summary_formats
+from rollups import Rollup
+from voltage_savings import CalculateVoltageStabilitySavings
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+CALCULATORS = {
+  "genset": CalculateGensetSavings,
+  "frequency": CalculateFrequencySavings,
+  "power_factor": CalculatePowerFactorSavings,
+  "voltage": CalculateVoltageStabilitySavings,
+  "harmonics": CalculateHarmonicSavings
+}
+# The data folder of each calculator, holding one folder (or zip archive) per year.
+DATA_FOLDERS = {
+  "genset": Path("data/genset_savings_data"),
+  "frequency": Path("data/frequency_savings_data"),
+  "power_factor": Path("data/power_factor_data"),
+  "voltage": Path("data/voltage_data"),
+  "harmonics": Path("data/harmonic_data")
+}
+# Stages between ingest and compute that rewrite a calculator's input files, as (stage, method) in order.
+PREPARATION_STAGES = {
+  "genset": [("clean", "clean_month_csv_files"), ("filter", "remove_short_close_entries")]
+}
+TOTALS_STAGE = "totals"
+
+class Stage(NamedTuple):
+  name: str
+  func: Callable[..., Any]
+  deps: Tuple[str, ...]
+  partial: bool = False  # run with None for failed dependencies instead of being skipped
+
+class Pipeline:
+  """Lazily evaluated DAG of named stages.
+
+  A stage is called with the results of its dependencies, in order, and its result is kept. run() evaluates
+  only the stages the requested targets depend on, each at most once, and stages whose dependencies are met
+  run concurrently on a thread pool. Dependencies must be added before the stages that use them, so the
+  graph cannot have a cycle.
+
+  A stage that raises is recorded in failed, and the stages depending on it are recorded in skipped, unless
+  they were added as partial. Independent stages still run, so one failing branch does not lose the results
+  of the others.
+  """
+
+  def __init__(self, workers: int = 0):
+    self.workers = workers or os.cpu_count() or 1
+    self.stages: Dict[str, Stage] = {}
+    self.results: Dict[str, Any] = {}
+    self.failed: Dict[str, str] = {}
+    self.skipped: Dict[str, str] = {}
+
+  def add(self, name: str, func: Callable[..., Any], deps: Sequence[str] = (), partial: bool = False) -> None:
+    """Add a stage that depends on stages already in the pipeline."""
+    if name in self.stages:
+      raise ValueError(f"Stage {name} is already in the pipeline.")
+    missing = [dep for dep in deps if dep not in self.stages]
+    if missing:
+      raise ValueError(f"Stage {name} depends on unknown stages: {', '.join(missing)}.")
+    self.stages[name] = Stage(name, func, tuple(deps), partial)
+
+  def required(self, targets: Iterable[str]) -> List[str]:
+    """Return the stages not yet evaluated that the targets depend on, themselves included, in dependency order."""
+    order: List[str] = []
+    seen = set()
+
+    def visit(name: str) -> None:
+      if name in seen or name in self.results or name in self.failed or name in self.skipped:
+        return
+      seen.add(name)
+      for dep in self.stages[name].deps:
+        visit(dep)
+      order.append(name)
+
+    for target in targets:
+      if target not in self.stages:
+        raise ValueError(f"Unknown stage {target}. Stages: {', '.join(self.stages)}.")
+      visit(target)
+    return order
+
+  def _resolved(self, name: str) -> bool:
+    """Return True if a stage has a result, failed or was skipped."""
+    return name in self.results or name in self.failed or name in self.skipped
+
+  def _timed(self, stage: Stage, *args: Any) -> Tuple[Any, float]:
+    """Call a stage and return its result and run time.
+
+    The calculators call sys.exit() on a missing config or data folder. Here that fails the stage, not the run.
+    """
+    start = time.perf_counter()
+    try:
+      result = stage.func(*args)
+    except SystemExit as error:
+      raise RuntimeError(f"the calculator exited{'' if error.code is None else f' with status {error.code}'}, see the error above") from None
+    return result, time.perf_counter() - start
+
+  def run(self, targets: Iterable[str]) -> Dict[str, Any]:
+    """Evaluate the targets and return the results of those that did not fail or get skipped."""
+    targets = list(targets)
+    pending = self.required(targets)
+    running: Dict[Future, str] = {}
+    with ThreadPoolExecutor(max_workers=self.workers) as executor:
+      while pending or running:
+        ready = [name for name in pending if all(self._resolved(dep) for dep in self.stages[name].deps)]
+        for name in ready:
+          pending.remove(name)
+          stage = self.stages[name]
+          unmet = [dep for dep in stage.deps if dep not in self.results]
+          if unmet and not stage.partial:
+            self.skipped[name] = f"{', '.join(unmet)} did not finish"
+            logging.warning(f"Skipped stage {name}: {self.skipped[name]}.")
+            continue
+          running[executor.submit(self._timed, stage, *[self.results.get(dep) for dep in stage.deps])] = name
+        if not running:
+          continue
+        done, _ = wait(running, return_when=FIRST_COMPLETED)
+        for future in done:
+          name = running.pop(future)
+          try:
+            self.results[name], elapsed = future.result()
+          except Exception as error:
+            self.failed[name] = str(error)
+            logging.exception(f"Stage {name} failed: {error}")
+            continue
+          logging.info(f"Stage {name} finished in {elapsed:.2f} s.")
+    return {target: self.results[target] for target in targets if target in self.results}
+
+def _ingest(calculator_class: type, config_file: str) -> Any:
+  """Construct a calculator, which loads its config and small inputs, and confirm its data folder exists."""
+  calculator = calculator_class(config_file)
+  if hasattr(calculator, "confirm_year_folder"):
+    calculator.confirm_year_folder()
+  return calculator
+
+def _prepare(method: str) -> Callable[[Any], Any]:
+  """Return a stage that runs one preparation method of a calculator and passes the calculator on."""
+  def prepare(calculator: Any) -> Any:
+    getattr(calculator, method)()
+    return calculator
+  return prepare
+
+def _compute(calculator: Any) -> Tuple[Any, bool]:
+  """Restore the calculator's cached results, or build its month rollups on a miss."""
+  restored = calculator.restore_cached_results()
+  if not restored:
+    calculator.compute_month_rollups()
+  return calculator, restored
+
+def _rollup(computed: Tuple[Any, bool]) -> Rollup:
+  """Return the restored rollup, or combine and save the month rollups."""
+  calculator, restored = computed
+  return calculator.rollup if restored else calculator.build_rollup()
+
+def _render(render_pool: Optional[RenderPool], summaries: Sequence[str]) -> Callable[[Tuple[Any, bool], Rollup], Any]:
+  """Return a stage that renders a calculator's reports from its saved state, then caches its outputs unless they were restored from the cache.
+
+  With a render pool the stage only submits the job and returns its future, so the thread goes on with other
+  stages while the workbook is written in another process. The outputs are cached when the pool is waited on.
+  Restored results are rendered too, which the render cache skips unless the summary formats changed.
+  """
+  def render_stage(computed: Tuple[Any, bool], rollup: Rollup) -> Any:
+    calculator, restored = computed
+    state_path = render_state_path(calculator.config["year"], calculator.config["site"], rollup.calculator)
+    store = None if restored else calculator.cache.store
+    if render_pool is not None:
+      return render_pool.submit(state_path, summaries, store)
+    paths = render(state_path, summaries)
+    if store is not None:
+      store()
+    return paths
+  return render_stage
+
+def available_calculators(config_file: str, calculators: Sequence[str]) -> List[str]:
+  """Return the calculators whose data folder for the configured year exists, logging the others."""
+  with open(config_file) as f:
+    year = json.load(f)["year"]
+  available = [name for name in calculators if folder_exists(DATA_FOLDERS[name] / str(year))]
+  for name in calculators:
+    if name not in available:
+      logging.warning(f"{DATA_FOLDERS[name] / str(year)} does not exist. Leaving out {name}.")
+  return available
+
+def totals_path(year: int, site: str) -> Path:
+  """Return where the JSON savings totals are written."""
+  return Path(f"results/{year}_{site}_Savings_Totals.json")
+
+def build_pipeline(config_file: str, calculators: Sequence[str], workers: int = 0, render_pool: Optional[RenderPool] = None) -> Pipeline:
+  """Build the stages of the calculators, one independent branch each, and a totals stage over the rollups of the branches that finish.
+
+  Each branch is ingest -> [clean -> filter] -> compute -> rollup -> render, named "{calculator}.{stage}".
+  Without a render pool, the render stages write the reports themselves.
+  """
+  with open(config_file) as f:
+    config = json.load(f)
+  pipeline = Pipeline(workers)
+  render_stage = _render(render_pool, summary_formats(config))
+  for name in calculators:
+    pipeline.add(f"{name}.ingest", lambda calculator_class=CALCULATORS[name]: _ingest(calculator_class, config_file))
+    previous = f"{name}.ingest"
+    for stage, method in PREPARATION_STAGES.get(name, []):
+      pipeline.add(f"{name}.{stage}", _prepare(method), [previous])
+      previous = f"{name}.{stage}"
+    pipeline.add(f"{name}.compute", _compute, [previous])
+    pipeline.add(f"{name}.rollup", _rollup, [f"{name}.compute"])
+    pipeline.add(f"{name}.render", render_stage, [f"{name}.compute", f"{name}.rollup"])
+
+  def write_totals(*rollups: Optional[Rollup]) -> Dict[str, Dict[str, float]]:
+    totals = {name: rollup.total() for name, rollup in zip(calculators, rollups) if rollup is not None}
+    path = totals_path(config["year"], config["site"])
+    path.parent.mkdir(exist_ok=True)
+    path.write_text(json.dumps(totals, indent=2))
+    logging.info(f"Wrote savings totals to {path}.")
+    return totals
+
+  pipeline.add(TOTALS_STAGE, write_totals, [f"{name}.rollup" for name in calculators], partial=True)
+  return pipeline
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser(description="Run the savings calculators as a pipeline of stages.")
+  parser.add_argument("calculators", nargs="*", help=f"calculators to run: {', '.join(CALCULATORS)} (default: all)")
+  parser.add_argument("--available", action="store_true", help="only run the calculators whose data folder for the configured year exists")
+  parser.add_argument("--json", action="store_true", help="only compute the rollups and write the JSON totals, without the workbooks")
+  parser.add_argument("--targets", nargs="+", default=[], help="stages to evaluate, e.g. genset.rollup")
+  parser.add_argument("--workers", type=int, default=0, help="concurrent stages (default: one per CPU)")
+  parser.add_argument("--render-workers", type=int, default=0, help="processes rendering the reports in the background (default: one per CPU)")
+  parser.add_argument("--config", default="config/savings_config.json")
+  args = parser.parse_args()
+  unknown = [name for name in args.calculators if name not in CALCULATORS]
+  if unknown:
+    parser.error(f"unknown calculators: {', '.join(unknown)}")
+  calculators = args.calculators or list(CALCULATORS)
+  if args.available:
+    calculators = available_calculators(args.config, calculators)
+  with profiled("pipeline"), RenderPool(args.render_workers) as render_pool:
+    pipeline = build_pipeline(args.config, calculators, args.workers, render_pool)
+    targets = args.targets or [TOTALS_STAGE] + ([] if args.json else [f"{name}.render" for name in calculators])
+    results = pipeline.run(targets)
+    render_pool.wait()
+    if TOTALS_STAGE in results:
+      print(json.dumps(results[TOTALS_STAGE], indent=2))
+  failed = list(pipeline.failed) + [f"render of {path}" for path in render_pool.failed]
+  if failed:
+    logging.error(f"Failed: {', '.join(failed)}. Skipped: {', '.join(pipeline.skipped) or 'none'}.")
+    sys.exit(1)
@@ -4,12 +4,26 @@ import math
 import sys
 from pathlib import Path
 from typing import Dict, List, Tuple
-import csv
+import numpy as np
 import xlsxwriter
+from archives import locate
+from chunked import BlockReader, chunk_rows
+from formatting import ColumnWidths, SheetFormatter
+from ingest import RejectReport, column_values, parse_numbers, reject_path
+from memo import ResultCache
+from profiling import profiled
+from qc import QualityScanner, qc_path
+from render import render, render_outputs, render_state_path, save_render_state, summary_formats
+from result_store import record_run
+from rollups import Rollup, rollup_path
+
+SUMMARY_HEADERS = ["Month", "Total Cost Savings"]
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
 class CalculatePowerFactorSavings:
+  RENDER_STATE = ("months_list", "rollup", "month_rollups", "month_sheets")  # attributes write_workbook() reads, saved for the render pool
+
   def __init__(self, config_file: str):
     self.config_file = config_file
     self.config = self.load_config()
@@ -17,6 +31,10 @@ class CalculatePowerFactorSavings:
       "January", "February", "March", "April", "May", "June",
       "July", "August", "September", "October", "November", "December"
     ]
+    self.month_rollups: Dict[str, Rollup] = {}
+    self.month_sheets: Dict[str, Tuple[int, ColumnWidths]] = {}
+    self.rejects = RejectReport()
+    self.quality = QualityScanner(self.config)
 
   def load_config(self) -> Dict:
     """Load configuration from a JSON file."""
@@ -30,50 +48,103 @@ class CalculatePowerFactorSavings:
       logging.info(f"Loaded {self.config_file}.")
     return config
 
+  def _result_cache(self) -> ResultCache:
+    """Return the result cache entry of this run, keyed on the input files and the config sections this calculator reads."""
+    year = self.config["year"]
+    site = self.config["site"]
+    outputs = [Path(f"results/{year}_{site}_Power_Factor_Savings.xlsx"), rollup_path(year, site, "Power_Factor"), reject_path(year, site, "Power_Factor"), qc_path(year, site, "Power_Factor")] + render_outputs(year, site, "Power_Factor")
+    return ResultCache(self.config, "Power_Factor", ["power_factor", "qc"], [Path(f"data/power_factor_data/{year}")], outputs, type(self).__module__)
+
+  def restore_cached_results(self) -> bool:
+    """Restore the outputs of an identical earlier run from the result cache. Returns False on a miss."""
+    self.cache = self._result_cache()
+    if not self.cache.restore():
+      return False
+    self.rollup = Rollup.load(rollup_path(self.config["year"], self.config["site"], "Power_Factor"))
+    record_run(self.config, "Power_Factor", self.rollup, self.cache, restored=True)
+    return True
+
   def calculate_power_factor_savings(self) -> None:
     """Calculate power factor savings and write to an XLSX file."""
+    if self.restore_cached_results():
+      return
+    self.compute_month_rollups()
+    self.build_rollup()
+    render(render_state_path(self.config["year"], self.config["site"], "Power_Factor"), summary_formats(self.config), self)
+    self.cache.store()
+
+  def compute_month_rollups(self) -> None:
+    """Read the power factor readings of each month and build the month rollups."""
+    for month in self.months_list:
+      self._process_month_data(month)
+
+  def build_rollup(self) -> Rollup:
+    """Combine the month rollups, then save the rollup, the reject report, the data quality report and the render state."""
+    year = self.config["year"]
+    site = self.config["site"]
+    self.rollup = Rollup.combine("Power_Factor", self.month_rollups.values())
+    self.rollup.save(rollup_path(year, site, "Power_Factor"))
+    self.rejects.write(reject_path(year, site, "Power_Factor"))
+    self.quality.write(qc_path(year, site, "Power_Factor"))
+    save_render_state(self, "Power_Factor")
+    record_run(self.config, "Power_Factor", self.rollup, self.cache)
+    return self.rollup
+
+  def write_workbook(self) -> Path:
+    """Write the month sheets and the yearly summary to an XLSX file."""
     year = self.config["year"]
     site = self.config["site"]
     results_dir = Path('results')
     results_dir.mkdir(exist_ok=True)
     file_name = results_dir / f"{year}_{site}_Power_Factor_Savings.xlsx"
     workbook = xlsxwriter.Workbook(file_name)
+    self.formatter = SheetFormatter(workbook)
     logging.info(f"Created XLSX file: {file_name}")
 
     summary_worksheet = workbook.add_worksheet(f"{site}_{year}_Savings_Summary")
     logging.info(f"Created summary worksheet: {site}_{year}_Savings_Summary.")
 
     for month in self.months_list:
-      self._process_month_data(workbook, month)
+      worksheet = workbook.add_worksheet(f"{site}_{month}_Savings")
+      if month in self.month_sheets:
+        self._write_calculations_to_worksheet(worksheet, month)
 
     self._calculate_year_power_factor_savings(workbook)
     workbook.close()
     logging.info(f"Completed calculating power factor savings and writing: {file_name}")
+    return file_name
 
-  def _process_month_data(self, workbook: xlsxwriter.Workbook, month: str) -> None:
-    """Process data for a specific month and write to the workbook."""
+  def _process_month_data(self, month: str) -> None:
+    """Build the rollup of a specific month and keep its row count and column widths for the month sheet."""
     year = self.config["year"]
-    site = self.config["site"]
-    worksheet = workbook.add_worksheet(f"{site}_{month}_Savings")
-    file_path = Path(f"data/power_factor_data/{year}/{month}-Power-Factor-Data.csv")
-    if not file_path.exists():
-      logging.warning(f"{file_path} does not exist. Skipping {month}.")
+    file_path = locate(Path(f"data/power_factor_data/{year}/{month}-Power-Factor-Data.csv"))
+    if file_path is None:
+      logging.warning(f"data/power_factor_data/{year}/{month}-Power-Factor-Data.csv does not exist. Skipping {month}.")
       return
 
-    with open(file_path, mode='r', newline='') as infile:
-      reader = list(csv.reader(infile))
-      self._write_calculations_to_worksheet(worksheet, reader, month)
-
-  def _write_calculations_to_worksheet(self, worksheet: xlsxwriter.Workbook.worksheet_class, reader: List[List[str]], month: str) -> None:
+    timestamp_format = self.config["power_factor"].get("timestamp_format", "%d/%m/%Y %H:%M")
+    masked_rows = self.quality.scan(file_path, timestamp_format, ["Power Factor"])
+    with BlockReader(file_path, chunk_rows(self.config), timestamp_format, rejects=self.rejects, skip_rows=masked_rows) as blocks:
+      power_factor_col_idx = self._get_column_index(blocks.header, "Power Factor")
+      if power_factor_col_idx is None:
+        logging.error(f"Power Factor column not found in {month} data. Skipping.")
+        return
+
+      column_widths = ColumnWidths(blocks.header)
+      partial_rollups = []
+      for timestamps, rows in blocks:
+        partial_rollups.append(self._build_block_rollup(blocks.file_path, timestamps, rows, power_factor_col_idx))
+        column_widths.update(rows)
+    self.month_rollups[month] = Rollup.combine("Power_Factor", partial_rollups)
+    self.month_sheets[month] = (blocks.rows_read + 1, column_widths)
+
+  def _write_calculations_to_worksheet(self, worksheet: xlsxwriter.Workbook.worksheet_class, month: str) -> None:
     """Write calculations to the worksheet."""
-    power_factor_col_idx = self._get_column_index(reader[0], "Power Factor")
-    if power_factor_col_idx is None:
-      logging.error(f"Power Factor column not found in {month} data. Skipping.")
-      return
-
-    total_cost_savings = self._calculate_savings(reader, power_factor_col_idx)
-    self._write_savings_to_worksheet(worksheet, reader, total_cost_savings, month)
-    self._adjust_column_widths(worksheet, reader)
+    reader_length, column_widths = self.month_sheets[month]
+    total_cost_savings = self.month_rollups[month].total().get("total_cost_savings", 0.0)
+    self._write_savings_to_worksheet(worksheet, reader_length, total_cost_savings, month)
+    column_widths.observe(0, "Total Cost Savings")
+    self.formatter.apply(worksheet, column_widths, [None, "currency"])
 
   def _get_column_index(self, header: List[str], column_name: str) -> int:
     """Get the index of a column in the header."""
@@ -82,32 +153,35 @@ class CalculatePowerFactorSavings:
         return col_idx
     return None
 
-  def _calculate_savings(self, reader: List[List[str]], power_factor_col_idx: int) -> float:
-    """Calculate total cost savings."""
-    total_cost_savings = 0.0
-    for row in reader[1:]:
-      try:
-        power_factor = float(row[power_factor_col_idx])
-        if power_factor < self.config["power_factor"]["target_power_factor"]:
-          penalty = self.config["power_factor"]["penalty_rate"] * (self.config["power_factor"]["target_power_factor"] - power_factor)
-          total_cost_savings += penalty
-      except ValueError:
-        continue
-    return total_cost_savings
-
-  def _write_savings_to_worksheet(self, worksheet: xlsxwriter.Workbook.worksheet_class, reader: List[List[str]], total_cost_savings: float, month: str) -> None:
+  def _build_block_rollup(self, file_path: Path, timestamps: np.ndarray, rows: List[List[str]], power_factor_col_idx: int) -> Rollup:
+    """Build a partial rollup from one block of timestamped power factor readings, rejecting invalid readings."""
+    values = column_values(rows, power_factor_col_idx)
+    power_factors, valid = parse_numbers(values)
+    self.rejects.record(file_path, "Power Factor", values, valid, rows)
+    return Rollup.from_intervals("Power_Factor", timestamps[valid], self._interval_measures(power_factors[valid]))
+
+  def _interval_measures(self, power_factors: np.ndarray) -> Dict[str, np.ndarray]:
+    """Return the rollup measures of each interval: its cost savings and whether it was below the target power factor."""
+    return {
+      "total_cost_savings": self._calculate_savings(power_factors),
+      "low_power_factor_intervals": (power_factors < self.config["power_factor"]["target_power_factor"]).astype(np.float64)
+    }
+
+  def _calculate_savings(self, power_factors: np.ndarray) -> np.ndarray:
+    """Calculate the per-interval cost savings.
+
+    The penalty is priced per unit of power factor shortfall, not per kWh, so the time-of-use tariff does not apply.
+    """
+    target_power_factor = self.config["power_factor"]["target_power_factor"]
+    shortfall = np.clip(target_power_factor - power_factors, 0.0, None)
+    return self.config["power_factor"]["penalty_rate"] * shortfall
+
+  def _write_savings_to_worksheet(self, worksheet: xlsxwriter.Workbook.worksheet_class, reader_length: int, total_cost_savings: float, month: str) -> None:
     """Write savings data to the worksheet."""
-    worksheet.write(len(reader) + 1, 0, "Total Cost Savings")
-    worksheet.write(len(reader) + 1, 1, total_cost_savings)
+    worksheet.write(reader_length + 1, 0, "Total Cost Savings")
+    worksheet.write(reader_length + 1, 1, total_cost_savings)
     logging.info(f"Calculated power factor savings for {month}.")
 
-  def _adjust_column_widths(self, worksheet: xlsxwriter.Workbook.worksheet_class, reader: List[List[str]]) -> None:
-    """Adjust the column widths based on the content."""
-    for col_idx, col_name in enumerate(reader[0]):
-      max_len = max(len(str(cell)) for cell in [col_name] + [row[col_idx] for row in reader[1:]])
-      worksheet.set_column(col_idx, col_idx, max_len)
-    logging.info(f"Adjusted column widths for worksheet {worksheet.name}.")
-
   def _calculate_year_power_factor_savings(self, workbook: xlsxwriter.Workbook) -> None:
     """Calculate yearly savings and update the summary worksheet."""
     site = self.config["site"]
@@ -117,11 +191,13 @@ class CalculatePowerFactorSavings:
 
     self._write_summary_headers(summary_worksheet)
     self._aggregate_yearly_savings(summary_worksheet)
+    column_widths = ColumnWidths(SUMMARY_HEADERS)
+    column_widths.observe(0, "Yearly Totals")
+    self.formatter.apply(summary_worksheet, column_widths, [None, "currency"])
 
   def _write_summary_headers(self, summary_worksheet: xlsxwriter.Workbook.worksheet_class) -> None:
     """Write headers to the summary worksheet."""
-    headers = ["Month", "Total Cost Savings"]
-    for col_idx, header in enumerate(headers):
+    for col_idx, header in enumerate(SUMMARY_HEADERS):
       summary_worksheet.write(0, col_idx, header)
     logging.info("Written headers to summary worksheet.")
 
@@ -130,33 +206,16 @@ class CalculatePowerFactorSavings:
     total_cost_savings_year = 0.0
 
     for row_idx, month in enumerate(self.months_list, start=1):
-      month_data = self._read_month_data(month)
+      month_data = self._read_month_data(row_idx)
       total_cost_savings_year += month_data["total_cost_savings"]
       self._write_month_summary(summary_worksheet, row_idx, month, month_data)
 
     self._write_yearly_totals(summary_worksheet, total_cost_savings_year)
 
-  def _read_month_data(self, month: str) -> Dict[str, float]:
-    """Read month data from the worksheet."""
-    year = self.config["year"]
-    site = self.config["site"]
-    file_path = Path(f"results/{year}_{site}_Power_Factor_Savings.xlsx")
-    worksheet_name = f"{site}_{month}_Savings"
-
-    try:
-      workbook = xlsxwriter.Workbook(file_path)
-      worksheet = workbook.get_worksheet_by_name(worksheet_name)
-      total_cost_savings = worksheet.cell(len(reader) + 2, 2).value
-      return {"total_cost_savings": total_cost_savings}
-    except FileNotFoundError:
-      logging.error(f"{file_path} not found.")
-      return {"total_cost_savings": 0.0}
-    except KeyError:
-      logging.error(f"Worksheet {worksheet_name} not found in {file_path}.")
-      return {"total_cost_savings": 0.0}
-    except Exception as e:
-      logging.error(f"Error reading month data: {e}")
-      return {"total_cost_savings": 0.0}
+  def _read_month_data(self, month_number: int) -> Dict[str, float]:
+    """Read month data from the month row of the rollup."""
+    month_row = self.rollup.month_row(month_number) or {}
+    return {"total_cost_savings": month_row.get("total_cost_savings", 0.0)}
 
   def _write_month_summary(self, summary_worksheet: xlsxwriter.Workbook.worksheet_class, row_idx: int, month: str, month_data: Dict[str, float]) -> None:
     """Write the summary for a specific month."""
@@ -171,6 +230,7 @@ class CalculatePowerFactorSavings:
     logging.info("Written yearly totals to summary worksheet.")
 
 if __name__ == "__main__":
-  config_file = "config/savings_config.json"
-  calculator = CalculatePowerFactorSavings(config_file)
-  calculator.calculate_power_factor_savings()
\ No newline at end of file
+  with profiled("power_factor_savings"):
+    config_file = "config/savings_config.json"
+    calculator = CalculatePowerFactorSavings(config_file)
+    calculator.calculate_power_factor_savings()
\ No newline at end of file
@@ -0,0 +1,455 @@
+import argparse
+import csv
+import io
+import json
+import logging
+import time
+from itertools import islice
+from pathlib import Path
+from typing import Callable, Dict, List, NamedTuple, Optional, Sequence, Tuple
+import numpy as np
+from archives import locate, open_binary, uncompressed_size
+from frequency_savings import CalculateFrequencySavings
+from genset_fuel_savings import CalculateGensetSavings
+from harmonics_savings import CalculateHarmonicSavings
+from ingest import clean_header, column_values, join_columns, parse_numbers, parse_timestamp_column, sniff_format
+from power_factor_savings import CalculatePowerFactorSavings
+from profiling import profiled
+from records import HarmonicSamples
+from rollups import COUNT_COLUMN, MEAN_SUFFIX, SUM_SUFFIX, Rollup, rollup_path
+from voltage_engine import INTERVAL_SAMPLE_SIZE
+from voltage_savings import CalculateVoltageStabilitySavings
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+DEFAULT_BUDGET_SECONDS = 2.0
+SAMPLING_SHARE = 0.5  # share of a calculator's budget spent drawing rows; the rest prices them and looks up matching rows
+STRATA = 32  # byte ranges a file is split into; rows of a time-ordered file are drawn from every stretch of the month
+ROUND_ROWS = 8  # rows drawn per stratum in each sampling round
+FULL_READ_BYTES = 1 << 20  # files up to this size are read whole, giving exact results
+LINE_WINDOW_BYTES = 1024  # bytes read back from a random offset to find the start of its row; rows are assumed shorter
+QUANTILES = (5, 50, 95)
+Z_95 = 1.96
+CONFIG_FILE = "config/savings_config.json"
+MONTHS = [
+  "January", "February", "March", "April", "May", "June",
+  "July", "August", "September", "October", "November", "December"
+]
+
+class PreviewResult(NamedTuple):
+  calculator: str
+  month: str
+  rows_sampled: int
+  rows_estimated: float
+  exact: bool  # every row was read, so the estimates are the exact totals
+  seconds: float
+  estimates: Dict[str, Tuple[float, float]]  # measure: (estimate, half-width of its 95% confidence interval)
+  quantiles: Dict[str, Dict[int, float]]  # reading: {percentile: value}
+
+class RowSampler:
+  """Draw rows of a time-ordered CSV file for preview estimates.
+
+  A plain file is split into STRATA byte ranges, each a stretch of the month, and rows are drawn with
+  replacement at random byte offsets of every range, so a row is drawn with probability proportional to its
+  length in bytes. Totals are Hansen-Hurwitz estimates: the byte size of each range times the mean of the
+  sampled values per byte, which also holds for a row straddling two ranges. A file or time range no larger than full_read_bytes is read whole instead, in one draw,
+  and a compressed or archived file, which cannot be seeked, is read from the start for as long as the budget allows.
+  """
+
+  def __init__(self, file_path: Path, timestamp_format: str, timestamp_columns: Sequence[str] = (), rng: Optional[np.random.Generator] = None, time_range: Optional[Tuple[np.datetime64, np.datetime64]] = None, full_read_bytes: int = FULL_READ_BYTES):
+    self.file_path = Path(file_path)
+    self.timestamp_format = timestamp_format
+    self.rng = rng if rng is not None else np.random.default_rng()
+    csv_format = sniff_format(self.file_path)
+    self.encoding = csv_format.encoding
+    self.dialect = csv_format.dialect
+    self._file = open_binary(self.file_path)
+    header_line = self._file.readline()
+    self.header = clean_header(self._parse(header_line))
+    self._timestamp_idx = [self.header.index(column) for column in timestamp_columns] or [0]
+    self.seekable = self.file_path.is_file() and self.file_path.suffix.lower() != ".gz"
+    self.data_start = len(header_line)
+    self.data_end = self.file_path.stat().st_size if self.seekable else uncompressed_size(self.file_path)
+    start, end = self.data_start, self.data_end
+    if self.seekable and time_range is not None:
+      start, end = self.offsets_of(np.array(time_range, dtype="datetime64[s]")).tolist()
+    self.sequential = not self.seekable or end - start <= full_read_bytes
+    self.bounds = np.array([start, end]) if self.sequential else np.linspace(start, end, STRATA + 1).astype(np.int64)
+    self._position = start
+    if self.seekable:
+      self._file.seek(start)
+    self.rows: List[List[str]] = []
+    self.row_strata: List[int] = []
+    self.row_bytes: List[int] = []
+    self.first_row = 0  # number of the first row read in sequence, counting the non-empty data rows before it
+    self.complete = end <= start
+
+  def __enter__(self) -> "RowSampler":
+    return self
+
+  def __exit__(self, *exc_info) -> None:
+    self._file.close()
+
+  def _parse(self, line: bytes) -> List[str]:
+    """Split one CSV line into fields."""
+    return next(csv.reader([line.decode(self.encoding)], self.dialect), [])
+
+  def _row_at(self, offset: int) -> Tuple[int, bytes]:
+    """Return the start offset and the bytes of the row holding a byte offset."""
+    window_start = max(offset - LINE_WINDOW_BYTES, self.data_start)
+    self._file.seek(window_start)
+    start = window_start + self._file.read(offset - window_start).rfind(b"\n") + 1
+    self._file.seek(start)
+    return start, self._file.readline()
+
+  def timestamps(self, rows: Optional[List[List[str]]] = None) -> Tuple[np.ndarray, np.ndarray]:
+    """Parse the timestamps of the sampled rows, or of the given rows, into a datetime64[s] array and a validity mask."""
+    rows = self.rows if rows is None else rows
+    values = column_values(rows, self._timestamp_idx[0])
+    for idx in self._timestamp_idx[1:]:
+      values = join_columns(values, column_values(rows, idx))
+    return parse_timestamp_column(values, self.timestamp_format)
+
+  def offsets_of(self, times: np.ndarray) -> np.ndarray:
+    """Return the byte offset of the first row at or after each time, bisecting the plain file on all times at once."""
+    low = np.full(len(times), self.data_start, dtype=np.int64)
+    high = np.full(len(times), self.data_end, dtype=np.int64)
+    while True:
+      active = np.flatnonzero(low < high)
+      if not len(active):
+        return low
+      middle = (low[active] + high[active]) // 2
+      timestamps, valid = self.timestamps([self._parse(self._row_at(offset)[1]) for offset in middle.tolist()])
+      before = valid & (timestamps < times[active])
+      low[active] = np.where(before, middle + 1, low[active])
+      high[active] = np.where(before, high[active], middle)
+
+  def lookup(self, times: np.ndarray) -> Tuple[List[List[str]], np.ndarray]:
+    """Return the rows of a plain file with the given timestamps, empty where there is none, and a found mask."""
+    rows = [self._parse(self._row_at(offset)[1]) if offset < self.data_end else [] for offset in self.offsets_of(times).tolist()]
+    timestamps, valid = self.timestamps(rows)
+    return rows, valid & (timestamps == times)
+
+  def leading_timestamps(self, count: int) -> np.ndarray:
+    """Return the valid timestamps of the first rows of a plain file."""
+    self._file.seek(self.data_start)
+    timestamps, valid = self.timestamps([self._parse(line) for line in islice(self._file, count)])
+    self._file.seek(self._position)
+    return timestamps[valid]
+
+  def _add(self, line: bytes, stratum: int) -> None:
+    self.rows.append(self._parse(line))
+    self.row_strata.append(stratum)
+    self.row_bytes.append(len(line))
+
+  def draw(self, rows_per_stratum: int = ROUND_ROWS) -> None:
+    """Draw one round of rows: rows_per_stratum from each byte range, all rows of a small plain file, or the next rows of a compressed file."""
+    if self.complete:
+      return
+    if self.sequential and self.seekable:
+      if self._position > self.data_start:
+        self._file.seek(self.data_start)
+        self.first_row = sum(1 for line in io.BytesIO(self._file.read(self._position - self.data_start)) if line.strip(b"\r\n"))
+      for line in io.BytesIO(self._file.read(int(self.bounds[1]) - self._position)):
+        self._add(line, 0)
+      self._position = int(self.bounds[1])
+      self.complete = True
+      return
+    if self.sequential:
+      lines = list(islice(self._file, rows_per_stratum * STRATA))
+      for line in lines:
+        if self._position >= self.bounds[1]:
+          break
+        self._add(line, 0)
+        self._position += len(line)
+      self.complete = self._position >= self.bounds[1] or len(lines) < rows_per_stratum * STRATA
+      return
+    for stratum in range(STRATA):
+      low, high = int(self.bounds[stratum]), int(self.bounds[stratum + 1])
+      if high <= low:
+        continue
+      for offset in self.rng.integers(low, high, rows_per_stratum).tolist():
+        self._add(self._row_at(offset)[1], stratum)
+
+  def weights(self) -> np.ndarray:
+    """Return the number of rows of the file each sampled row stands for."""
+    row_bytes = np.array(self.row_bytes, dtype=np.float64)
+    if self.sequential:
+      return np.full(len(row_bytes), (self.bounds[1] - self.bounds[0]) / max(row_bytes.sum(), 1.0))
+    strata = np.array(self.row_strata, dtype=np.int64)
+    draws = np.bincount(strata, minlength=STRATA)
+    return np.diff(self.bounds)[strata] / (draws[strata] * row_bytes)
+
+  def total(self, values: np.ndarray) -> Tuple[float, float]:
+    """Return the estimated total of a per-row value over the file and the half-width of its 95% confidence interval.
+
+    A file read in sequence has an exact total once it is read to the end, and no bound before that, as its
+    first rows are not a random sample.
+    """
+    if self.sequential:
+      return float(values @ self.weights()), 0.0 if self.complete else np.nan
+    strata = np.array(self.row_strata, dtype=np.int64)
+    draws = np.bincount(strata, minlength=STRATA).astype(np.float64)
+    per_byte = values / np.array(self.row_bytes, dtype=np.float64)
+    means = np.divide(np.bincount(strata, weights=per_byte, minlength=STRATA), draws, out=np.zeros(STRATA), where=draws > 0)
+    squares = np.bincount(strata, weights=(per_byte - means[strata]) ** 2, minlength=STRATA)
+    variances = np.divide(squares, draws * (draws - 1), out=np.zeros(STRATA), where=draws > 1)
+    stratum_bytes = np.diff(self.bounds).astype(np.float64)
+    return float(stratum_bytes @ means), Z_95 * float(np.sqrt(stratum_bytes ** 2 @ variances))
+
+def weighted_quantiles(values: np.ndarray, weights: np.ndarray, percentiles: Sequence[int] = QUANTILES) -> Dict[int, float]:
+  """Return the percentiles of values whose samples stand for weights rows each."""
+  if not len(values):
+    return {percentile: np.nan for percentile in percentiles}
+  order = np.argsort(values, kind="stable")
+  cumulative = np.cumsum(weights[order])
+  cumulative = (cumulative - weights[order] / 2) / cumulative[-1]
+  return {percentile: float(np.interp(percentile / 100, cumulative, values[order])) for percentile in percentiles}
+
+def sample_within(samplers: Sequence[RowSampler], deadline: float) -> None:
+  """Draw rounds of rows from each sampler until they are all complete or the deadline passes, always drawing at least one round."""
+  while True:
+    for sampler in samplers:
+      sampler.draw()
+    if all(sampler.complete for sampler in samplers) or time.perf_counter() >= deadline:
+      return
+
+def _summarize(calculator: str, month: str, sampler: RowSampler, valid: np.ndarray, measures: Dict[str, np.ndarray], readings: Dict[str, np.ndarray], started: float) -> PreviewResult:
+  """Estimate the month totals of per-row measures computed for the valid sampled rows, and the quantiles of their readings.
+
+  SUM_SUFFIX measures are estimated as their mean per interval, a ratio of two estimated totals, whose bound is
+  that of the total of the residuals from the mean, over the interval count.
+  """
+  weights = sampler.weights()
+  if sampler.sequential and not sampler.complete:
+    logging.warning(f"{sampler.file_path} cannot be sampled and was not read to the end within the budget. The {calculator} estimates are extrapolated from its first {len(sampler.rows)} rows and have no error bound.")
+  estimates = {COUNT_COLUMN: sampler.total(valid.astype(np.float64))}
+  count = estimates[COUNT_COLUMN][0]
+  for measure, values in measures.items():
+    row_values = np.zeros(len(valid))
+    row_values[valid] = values
+    if measure.endswith(SUM_SUFFIX):
+      mean = sampler.total(row_values)[0] / count if count else 0.0
+      bound = sampler.total(row_values - mean * valid)[1] / count if count else np.nan
+      estimates[measure[:-len(SUM_SUFFIX)] + MEAN_SUFFIX] = (mean, bound)
+    else:
+      estimates[measure] = sampler.total(row_values)
+  return PreviewResult(
+    calculator,
+    month,
+    len(sampler.rows),
+    float(weights.sum()),
+    sampler.sequential and sampler.complete,
+    time.perf_counter() - started,
+    estimates,
+    {reading: weighted_quantiles(values, weights[valid]) for reading, values in readings.items()}
+  )
+
+def _unmasked(sampler: RowSampler, masked_rows: Optional[np.ndarray]) -> np.ndarray:
+  """Return which rows of a file or time range read whole are non-empty and not masked, numbering the non-empty data rows as the data quality scan does."""
+  non_empty = np.array([bool(row) for row in sampler.rows], dtype=bool)
+  if masked_rows is None or not len(masked_rows):
+    return non_empty
+  return non_empty & ~np.isin(sampler.first_row + np.cumsum(non_empty) - 1, masked_rows)
+
+def _quality_kept(sampler: RowSampler, scan: Callable[[], Optional[np.ndarray]]) -> np.ndarray:
+  """Return the sampled rows to price: when the file was read whole, those the calculator's data quality scan leaves in, as in the exact results.
+
+  Sampled rows are all kept, as masking them would need a scan of the whole file.
+  """
+  if sampler.sequential and sampler.complete:
+    return _unmasked(sampler, scan())
+  return np.ones(len(sampler.rows), dtype=bool)
+
+def _month_file(pattern: str, year: int, month: str) -> Optional[Path]:
+  """Locate a month's input file, warning when it is missing."""
+  file_path = locate(Path(pattern.format(year=year, month=month)))
+  if file_path is None:
+    logging.warning(f"{pattern.format(year=year, month=month)} does not exist. Skipping.")
+  return file_path
+
+def preview_frequency(config_file: str, month: str, budget: float, rng: np.random.Generator) -> Optional[PreviewResult]:
+  """Preview a month of frequency savings from sampled deviations, priced with the calculator's own cost formulas."""
+  started = time.perf_counter()
+  calculator = CalculateFrequencySavings(config_file)
+  file_path = _month_file("data/frequency_savings_data/{year}/{month}-Frequency-Savings.csv", calculator.config["year"], month)
+  if file_path is None:
+    return None
+  timestamp_format = calculator.config["frequency_deviation"].get("timestamp_format", "%d/%m/%Y %H:%M")
+  with RowSampler(file_path, timestamp_format, rng=rng) as sampler:
+    sample_within([sampler], started + budget * SAMPLING_SHARE)
+  _, valid = sampler.timestamps()
+  valid &= _quality_kept(sampler, lambda: calculator.quality.scan(file_path, timestamp_format, ["Frequency Deviation (Hz)"], stuck_columns=[]))
+  deviations, numeric = parse_numbers(column_values(sampler.rows, sampler.header.index("Frequency Deviation (Hz)")))
+  valid &= numeric
+  costs = calculator._calculate_costs(deviations[valid])
+  return _summarize("Frequency", month, sampler, valid, costs, {"|Frequency Deviation| (Hz)": np.abs(deviations[valid])}, started)
+
+def preview_power_factor(config_file: str, month: str, budget: float, rng: np.random.Generator) -> Optional[PreviewResult]:
+  """Preview a month of power factor savings from sampled readings, priced with the calculator's own formulas."""
+  started = time.perf_counter()
+  calculator = CalculatePowerFactorSavings(config_file)
+  file_path = _month_file("data/power_factor_data/{year}/{month}-Power-Factor-Data.csv", calculator.config["year"], month)
+  if file_path is None:
+    return None
+  timestamp_format = calculator.config["power_factor"].get("timestamp_format", "%d/%m/%Y %H:%M")
+  with RowSampler(file_path, timestamp_format, rng=rng) as sampler:
+    sample_within([sampler], started + budget * SAMPLING_SHARE)
+  _, valid = sampler.timestamps()
+  valid &= _quality_kept(sampler, lambda: calculator.quality.scan(file_path, timestamp_format, ["Power Factor"]))
+  power_factors, numeric = parse_numbers(column_values(sampler.rows, sampler.header.index("Power Factor")))
+  valid &= numeric
+  measures = calculator._interval_measures(power_factors[valid])
+  return _summarize("Power_Factor", month, sampler, valid, measures, {"Power Factor": power_factors[valid]}, started)
+
+def preview_harmonics(config_file: str, month: str, budget: float, rng: np.random.Generator) -> Optional[PreviewResult]:
+  """Preview a month of harmonic savings from samples of the month's rows of the yearly file.
+
+  The month's rows are found by bisecting the time-ordered file, and the month is still taken from the Month column.
+  """
+  started = time.perf_counter()
+  calculator = CalculateHarmonicSavings(config_file)
+  year = calculator.config["year"]
+  file_path = _month_file("data/harmonic_data/{year}/Harmonic-Distortion-Month.csv", year, month)
+  if file_path is None:
+    return None
+  month_start = np.datetime64(f"{year}-{MONTHS.index(month) + 1:02d}", "M")
+  time_range = (month_start.astype("datetime64[s]"), (month_start + 1).astype("datetime64[s]"))
+  with RowSampler(file_path, calculator.timestamp_format, ["Timestamp"], rng, time_range) as sampler:
+    sample_within([sampler], started + budget * SAMPLING_SHARE)
+  header = sampler.header
+  timestamps, valid = sampler.timestamps()
+  valid &= _quality_kept(sampler, lambda: calculator.quality.scan(file_path, calculator.timestamp_format, ["THD_I", "THD_V", "Apparent Power (kVA)"], ["Timestamp"]))
+  valid &= np.array(column_values(sampler.rows, header.index("Month"))) == month
+  columns = []
+  for col_idx in [header.index(column) for column in ("THD_I", "THD_V", "Apparent Power (kVA)")] + calculator._harmonic_order_columns(header):
+    numbers, numeric = parse_numbers(column_values(sampler.rows, col_idx))
+    columns.append(numbers)
+    valid &= numeric
+  samples = HarmonicSamples(timestamps, *columns[:3], np.stack(columns[3:], axis=1) if len(columns) > 3 else None).select(valid)
+  measures = calculator._interval_measures(calculator._calculate_savings(samples))
+  return _summarize("Harmonic", month, sampler, valid, measures, {"THD_I (%)": samples.thd_i}, started)
+
+def preview_voltage(config_file: str, month: str, budget: float, rng: np.random.Generator) -> Optional[PreviewResult]:
+  """Preview a month of voltage stability savings from sampled grid voltages and the load voltages at the same timestamps.
+
+  When both files are small enough to be read whole, they are masked by the data quality scan, aligned and
+  run through the engine as the calculator does, giving exact results. Otherwise grid rows are drawn from every
+  stretch of the month, and each round is matched to the load file by bisection before the next is drawn, as
+  the lookups cost more than the draws. Demand charges are then left out, as they depend on the month's peak
+  hour, which a sample cannot place.
+  """
+  started = time.perf_counter()
+  calculator = CalculateVoltageStabilitySavings(config_file)
+  engine = calculator.engine
+  year = calculator.config["year"]
+  grid_file = _month_file("data/voltage_data/{year}/{month}-Grid-Voltage.csv", year, month)
+  load_file = _month_file("data/voltage_data/{year}/{month}-Load-Voltage.csv", year, month)
+  if grid_file is None or load_file is None:
+    return None
+  with RowSampler(load_file, engine.timestamp_format, rng=rng) as load, RowSampler(grid_file, engine.timestamp_format, rng=rng, full_read_bytes=FULL_READ_BYTES if load.sequential else 0) as grid:
+    if not grid.seekable or not load.seekable:
+      logging.warning(f"Voltage previews need plain grid and load files to match their timestamps. Skipping {month}.")
+      return None
+    if grid.sequential and load.sequential:
+      return _voltage_whole_month(calculator, month, grid, load, started)
+    interval_hours = engine.infer_interval_hours(grid.leading_timestamps(INTERVAL_SAMPLE_SIZE + 1))
+    load_rows: List[List[str]] = []
+    found = np.array([], dtype=bool)
+    while True:
+      grid.draw()
+      timestamps, _ = grid.timestamps(grid.rows[len(load_rows):])
+      rows, round_found = load.lookup(timestamps)
+      load_rows.extend(rows)
+      found = np.concatenate((found, round_found))
+      if grid.complete or time.perf_counter() >= started + budget:
+        break
+  timestamps, valid = grid.timestamps()
+  grid_voltage, grid_numeric = parse_numbers(column_values(grid.rows, grid.header.index("Grid_Voltage")))
+  load_voltage, load_numeric = parse_numbers(column_values(load_rows, load.header.index("Load_Voltage")))
+  valid &= grid_numeric & found & load_numeric
+  intervals = engine.compute_intervals(timestamps[valid], grid_voltage[valid], load_voltage[valid], interval_hours)
+  return _summarize("Voltage_Stability", month, grid, valid, engine.interval_measures(intervals), {"Grid Voltage (V)": grid_voltage[valid]}, started)
+
+def _voltage_whole_month(calculator: CalculateVoltageStabilitySavings, month: str, grid: RowSampler, load: RowSampler, started: float) -> PreviewResult:
+  """Return the exact voltage stability results of a month whose grid and load files are read whole."""
+  engine = calculator.engine
+  series = []
+  for sampler, column in ((grid, "Grid_Voltage"), (load, "Load_Voltage")):
+    sampler.draw()
+    kept = _unmasked(sampler, calculator.quality.scan(sampler.file_path, engine.timestamp_format, [column]))
+    timestamps, valid = sampler.timestamps()
+    voltages, numeric = parse_numbers(column_values(sampler.rows, sampler.header.index(column)))
+    valid &= kept & numeric
+    series += [timestamps[valid], voltages[valid]]
+  timestamps, grid_voltage, load_voltage = engine.align_series(*series)
+  totals = engine.run([(timestamps, grid_voltage, load_voltage)])["rollup"].total()
+  return PreviewResult("Voltage_Stability", month, len(grid.rows), float(len(grid.rows)), True, time.perf_counter() - started, {measure: (value, 0.0) for measure, value in totals.items()}, {"Grid Voltage (V)": weighted_quantiles(grid_voltage, np.ones(len(grid_voltage)))})
+
+def preview_genset(config_file: str, month: str, budget: float, rng: np.random.Generator) -> Optional[PreviewResult]:
+  """Preview a month of genset savings from all of its events, filtered in memory as the filter stage would.
+
+  Month event files are small, and the short and close event filter depends on the previous kept event, which
+  a sample would not keep, so the preview is exact.
+  """
+  started = time.perf_counter()
+  calculator = CalculateGensetSavings(config_file)
+  file_path = _month_file("data/genset_savings_data/{year}/{month}-Genset-Savings.csv", calculator.config["year"], month)
+  if file_path is None:
+    return None
+  events = calculator._read_month_events(file_path)
+  if events is None:
+    return None
+  totals = calculator._build_month_rollup(calculator._filter_short_close_events(events)).total()
+  return PreviewResult("Genset_Fuel", month, len(events), float(len(events)), True, time.perf_counter() - started, {measure: (value, 0.0) for measure, value in totals.items()}, {})
+
+PREVIEWS: Dict[str, Callable[[str, str, float, np.random.Generator], Optional[PreviewResult]]] = {
+  "genset": preview_genset,
+  "frequency": preview_frequency,
+  "power_factor": preview_power_factor,
+  "voltage": preview_voltage,
+  "harmonics": preview_harmonics
+}
+
+def stored_month(year: int, site: str, calculator: str, month_number: int) -> Dict[str, float]:
+  """Return the exact measures of a month from the calculator's saved rollup, empty if it has none."""
+  path = rollup_path(year, site, calculator)
+  if month_number < 1 or not path.exists():
+    return {}
+  return Rollup.load(path).month_row(month_number) or {}
+
+def preview(names: Sequence[str], month: str, budget: float = DEFAULT_BUDGET_SECONDS, seed: Optional[int] = None, config_file: str = CONFIG_FILE) -> List[PreviewResult]:
+  """Preview a month of each named calculator, sharing the time budget equally between them."""
+  rng = np.random.default_rng(seed)
+  results = []
+  for name in names:
+    result = PREVIEWS[name](config_file, month, budget / len(names), rng)
+    if result is not None:
+      results.append(result)
+      logging.info(f"Previewed {result.calculator} {month} from {result.rows_sampled} of about {result.rows_estimated:.0f} rows in {result.seconds:.2f}s{' (exact)' if result.exact else ''}.")
+  return results
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser(description="Estimate a month of savings within a fixed time budget from sampled rows, with 95% error bounds.")
+  parser.add_argument("calculators", nargs="*", help=f"calculators to preview: {', '.join(PREVIEWS)} (default: all)")
+  parser.add_argument("--month", required=True, choices=MONTHS)
+  parser.add_argument("--budget", type=float, default=DEFAULT_BUDGET_SECONDS, help="seconds for all the calculators together")
+  parser.add_argument("--seed", type=int, help="random seed, for repeatable samples")
+  parser.add_argument("--config", default=CONFIG_FILE)
+  args = parser.parse_args()
+  unknown = [name for name in args.calculators if name not in PREVIEWS]
+  if unknown:
+    parser.error(f"unknown calculators: {', '.join(unknown)}")
+  with profiled("preview"):
+    results = preview(args.calculators or list(PREVIEWS), args.month, args.budget, args.seed, args.config)
+  config = json.loads(Path(args.config).read_text())
+  print("Calculator,Month,Measure,Estimate,Bound (95%),Stored,Previous Month")
+  for result in results:
+    month_number = MONTHS.index(result.month) + 1
+    stored = stored_month(config["year"], config["site"], result.calculator, month_number)
+    previous = stored_month(config["year"], config["site"], result.calculator, month_number - 1)
+    for measure, (estimate, bound) in result.estimates.items():
+      print(f"{result.calculator},{result.month},{measure},{estimate:.4f},{bound:.4f},{stored.get(measure, '')},{previous.get(measure, '')}")
+  for result in results:
+    for reading, quantiles in result.quantiles.items():
+      print(f"{result.calculator},{result.month},{reading},{','.join(f'P{percentile}={value:.4f}' for percentile, value in quantiles.items())}")
@@ -0,0 +1,190 @@
+import csv
+import logging
+import time
+from collections import Counter
+from itertools import islice
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+import numpy as np
+from archives import open_text
+from chunked import DEFAULT_BLOCK_ROWS
+from ingest import clean_header, column_values, join_columns, parse_numbers, parse_timestamp_column, sniff_format
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+CHECKS = ("gap", "duplicate", "out_of_order", "stuck", "outlier")
+MASKABLE_CHECKS = ("duplicate", "out_of_order", "stuck", "outlier")  # a gap has no rows to mask
+CHECK_LABELS = {"gap": "missing intervals", "duplicate": "duplicated rows", "out_of_order": "out-of-order rows", "stuck": "stuck values", "outlier": "outliers"}
+QC_HEADERS = ["File", "Column", "Check", "Start", "End", "Rows", "Detail"]
+MAD_SCALE = 1.4826  # scales the median absolute deviation to the standard deviation of normally distributed data
+DEFAULT_QC_CONFIG = {
+  "enabled": True,
+  "mask": list(MASKABLE_CHECKS),
+  "gap_factor": 1.5,
+  "stuck_intervals": 30,
+  "outlier_MADs": 10.0
+}
+
+def qc_path(year: int, site: str, calculator: str, qc_dir: Path = Path("results/qc")) -> Path:
+  """Return the path of a calculator's data quality report."""
+  return qc_dir / f"{year}_{site}_{calculator}_QC.csv"
+
+def read_series(file_path: Path, timestamp_format: str, value_columns: Sequence[str], timestamp_columns: Sequence[str] = ()) -> Tuple[np.ndarray, np.ndarray, List[np.ndarray]]:
+  """Read the row numbers, timestamps and value columns of a CSV export in file order, in blocks of DEFAULT_BLOCK_ROWS rows.
+
+  Rows are numbered as BlockReader numbers them, counting the non-empty data rows. Rows with an invalid
+  timestamp are left out. Invalid values, and all values of a column missing from the header, are NaN.
+  """
+  csv_format = sniff_format(file_path)
+  numbers, timestamps, values = [], [], [[] for _ in value_columns]
+  rows_read = 0
+  with open_text(file_path, csv_format.encoding) as infile:
+    reader = csv.reader(infile, csv_format.dialect)
+    header = clean_header(next(reader))
+    timestamp_idx = [header.index(column) for column in timestamp_columns] or [0]
+    value_idx = [header.index(column) if column in header else len(header) for column in value_columns]
+    while True:
+      rows = [row for row in islice(reader, DEFAULT_BLOCK_ROWS) if row]
+      if not rows:
+        break
+      stamps = column_values(rows, timestamp_idx[0])
+      for idx in timestamp_idx[1:]:
+        stamps = join_columns(stamps, column_values(rows, idx))
+      block_timestamps, valid = parse_timestamp_column(stamps, timestamp_format)
+      numbers.append(np.flatnonzero(valid) + rows_read)
+      timestamps.append(block_timestamps[valid])
+      for column_values_read, idx in zip(values, value_idx):
+        column_values_read.append(parse_numbers(column_values(rows, idx))[0][valid])
+      rows_read += len(rows)
+  if not numbers:
+    return np.array([], dtype=np.int64), np.array([], dtype="datetime64[s]"), [np.array([], dtype=np.float64) for _ in value_columns]
+  return np.concatenate(numbers), np.concatenate(timestamps), [np.concatenate(column) for column in values]
+
+def _stamp(timestamp: np.datetime64) -> str:
+  """Format a timestamp for the report."""
+  return str(timestamp.astype("datetime64[s]")).replace("T", " ")
+
+def _runs(flags: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+  """Return the first and last index of each run of consecutive True flags."""
+  padded = np.concatenate(([False], flags, [False]))
+  edges = np.flatnonzero(padded[1:] != padded[:-1])
+  return edges[::2], edges[1::2] - 1
+
+class QualityScanner:
+  """Scan calculator inputs for data quality issues, in file order, and collect them in one compact report.
+
+  Each file is checked for gaps longer than gap_factor times its median interval, duplicated and
+  out-of-order timestamps, values stuck at the same reading for stuck_intervals rows or more, and values
+  more than outlier_MADs scaled median absolute deviations from the median. Each check is one vectorized
+  pass over the file's columns. The rows failing the checks listed in qc.mask are returned as row numbers for
+  BlockReader to skip. Runs of consecutive flagged rows are reported as one row each.
+  """
+
+  def __init__(self, config: Dict):
+    qc_config = {**DEFAULT_QC_CONFIG, **config.get("qc", {})}
+    self.enabled = qc_config["enabled"]
+    self.mask = [check for check in qc_config["mask"] if check in MASKABLE_CHECKS]
+    self.gap_factor = qc_config["gap_factor"]
+    self.stuck_intervals = qc_config["stuck_intervals"]
+    self.outlier_MADs = qc_config["outlier_MADs"]
+    self.rows: List[List] = []
+    self.counts: Counter = Counter()
+    self.masked: Counter = Counter()
+
+  def __len__(self) -> int:
+    return len(self.rows)
+
+  def check_timestamps(self, timestamps: np.ndarray) -> Tuple[Dict[str, np.ndarray], float]:
+    """Flag the gaps (on the row after each gap), duplicated timestamps and out-of-order timestamps of a series in file order, and return its median interval in seconds.
+
+    A row is a duplicate if it repeats the latest timestamp so far, and out of order if it is earlier than it.
+    """
+    seconds = timestamps.astype(np.int64)
+    latest = np.maximum.accumulate(seconds)
+    previous = np.concatenate(([np.iinfo(np.int64).min], latest[:-1])) if len(seconds) else latest
+    steps = seconds - previous
+    forward = steps[1:][steps[1:] > 0]
+    interval = float(np.median(forward)) if len(forward) else 0.0
+    gap = np.zeros(len(seconds), dtype=bool)
+    if interval:
+      gap[1:] = steps[1:] > self.gap_factor * interval
+    return {"gap": gap, "duplicate": seconds == previous, "out_of_order": seconds < previous}, interval
+
+  def check_values(self, values: np.ndarray, stuck: bool = True) -> Tuple[Dict[str, np.ndarray], Tuple[float, float]]:
+    """Flag the stuck and outlying values of a column, and return the limits outside which values are outliers. NaN values are neither."""
+    stuck_flags = np.zeros(len(values), dtype=bool)
+    if stuck and self.stuck_intervals and len(values):
+      starts = np.flatnonzero(np.concatenate(([True], values[1:] != values[:-1])))
+      lengths = np.diff(np.append(starts, len(values)))
+      stuck_flags = np.repeat(lengths >= self.stuck_intervals, lengths) & ~np.isnan(values)
+    finite = values[np.isfinite(values)]
+    outliers = np.zeros(len(values), dtype=bool)
+    limits = (np.nan, np.nan)
+    if len(finite):
+      median = float(np.median(finite))
+      spread = float(np.median(np.abs(finite - median))) * MAD_SCALE
+      if spread > 0:
+        limits = (median - self.outlier_MADs * spread, median + self.outlier_MADs * spread)
+        outliers = (values < limits[0]) | (values > limits[1])
+    return {"stuck": stuck_flags, "outlier": outliers}, limits
+
+  def _report(self, file_path: Path, column: str, check: str, timestamps: np.ndarray, flags: np.ndarray, detail: Callable[[int], str]) -> None:
+    """Add one report row per run of consecutive flagged rows, described by the detail of the run's first row."""
+    starts, ends = _runs(flags)
+    for start, end in zip(starts.tolist(), ends.tolist()):
+      self.rows.append([str(file_path), column, check, _stamp(timestamps[start]), _stamp(timestamps[end]), end - start + 1, detail(start)])
+    self.counts[(str(file_path), check)] += int(flags.sum())
+
+  def scan(self, file_path: Path, timestamp_format: str, value_columns: Sequence[str], timestamp_columns: Sequence[str] = (), stuck_columns: Optional[Sequence[str]] = None) -> Optional[np.ndarray]:
+    """Scan one input file and return the sorted numbers of the rows to mask, or None when the scan is disabled.
+
+    Values are checked for being stuck only in stuck_columns (default: all value columns), as some readings,
+    such as a frequency deviation of zero, may legitimately stay the same.
+    """
+    if not self.enabled:
+      return None
+    started = time.perf_counter()
+    numbers, timestamps, columns = read_series(file_path, timestamp_format, value_columns, timestamp_columns)
+    read_seconds = time.perf_counter() - started
+    timestamp_column = " + ".join(timestamp_columns) or "Timestamp"
+    timestamp_flags, interval = self.check_timestamps(timestamps)
+    latest = np.maximum.accumulate(timestamps) if len(timestamps) else timestamps
+    for row in np.flatnonzero(timestamp_flags["gap"]).tolist():
+      missing = int(round((timestamps[row] - latest[row - 1]).astype(np.int64) / interval)) - 1
+      self.rows.append([str(file_path), timestamp_column, "gap", _stamp(latest[row - 1]), _stamp(timestamps[row]), missing, f"{missing} missing intervals of {interval:g} s"])
+      self.counts[(str(file_path), "gap")] += missing
+    flags = {check: timestamp_flags[check] for check in ("duplicate", "out_of_order")}
+    self._report(file_path, timestamp_column, "duplicate", timestamps, flags["duplicate"], lambda row: f"repeats {_stamp(timestamps[row])}")
+    self._report(file_path, timestamp_column, "out_of_order", timestamps, flags["out_of_order"], lambda row: f"earlier than {_stamp(latest[row - 1])}")
+    flags["stuck"] = np.zeros(len(timestamps), dtype=bool)
+    flags["outlier"] = np.zeros(len(timestamps), dtype=bool)
+    for column, values in zip(value_columns, columns):
+      value_flags, (low, high) = self.check_values(values, stuck_columns is None or column in stuck_columns)
+      self._report(file_path, column, "stuck", timestamps, value_flags["stuck"], lambda row, values=values: f"stuck at {values[row]:g}")
+      self._report(file_path, column, "outlier", timestamps, value_flags["outlier"], lambda row, values=values, low=low, high=high: f"{values[row]:g} outside {low:g} to {high:g}")
+      flags["stuck"] |= value_flags["stuck"]
+      flags["outlier"] |= value_flags["outlier"]
+    masked = np.zeros(len(timestamps), dtype=bool)
+    for check in self.mask:
+      masked |= flags[check]
+    self.masked[str(file_path)] += int(masked.sum())
+    logging.info(f"Scanned {len(timestamps)} rows of {file_path} in {time.perf_counter() - started:.2f} s ({read_seconds:.2f} s reading). Masked {int(masked.sum())} rows.")
+    return numbers[masked]
+
+  def write(self, path: Path) -> None:
+    """Write the report to a CSV file, or delete an earlier report when no issue was found, and log the counts per input file."""
+    if not self.rows:
+      path.unlink(missing_ok=True)
+      return
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, mode='w', newline='') as outfile:
+      writer = csv.writer(outfile)
+      writer.writerow(QC_HEADERS)
+      writer.writerows(self.rows)
+    for (source, check), count in sorted(self.counts.items()):
+      if count:
+        logging.warning(f"{source}: {count} {CHECK_LABELS[check]}.")
+    for source, count in self.masked.items():
+      if count:
+        logging.warning(f"Masked {count} rows of {source}.")
+    logging.info(f"Wrote {len(self.rows)} data quality issues to {path}.")
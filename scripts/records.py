@@ -0,0 +1,141 @@
+import logging
+from pathlib import Path
+from typing import List, Optional, Sequence, Tuple
+import numpy as np
+from formatting import ColumnWidths
+from ingest import RejectReport, column_values, join_columns, parse_numbers, parse_timestamp_column, read_table
+
+GENSET_FIELDS = ["Date", "Time Initiated", "Time Elapsed (minutes)", "Energy Saving (kWh)"]
+
+def format_number(value: float) -> str:
+  """Format a float as the shortest text that reads back to the same value, without a trailing '.0'."""
+  return str(int(value)) if value.is_integer() else repr(value)
+
+class GensetEvents:
+  """Struct-of-arrays container for genset outage events: one NumPy column per field instead of one object per event.
+
+  timestamps holds the start of each event in seconds since the epoch, and energy_saving is NaN for events
+  without a recorded saving. keep masks the events that are in use: rows that failed to parse, and rows the
+  short and close event filter drops, are masked out rather than copied away.
+  """
+  __slots__ = ("timestamps", "time_elapsed", "energy_saving", "keep")
+
+  def __init__(self, timestamps: np.ndarray, time_elapsed: np.ndarray, energy_saving: np.ndarray, keep: Optional[np.ndarray] = None):
+    self.timestamps = timestamps
+    self.time_elapsed = time_elapsed
+    self.energy_saving = energy_saving
+    self.keep = keep if keep is not None else np.ones(len(timestamps), dtype=bool)
+
+  def __len__(self) -> int:
+    return int(self.keep.sum())
+
+  @classmethod
+  def parse(cls, dates: Sequence[str], times: Sequence[str], elapsed_values: Sequence[str], energy_values: Sequence[str]) -> Tuple["GensetEvents", np.ndarray, np.ndarray, np.ndarray]:
+    """Parse the text columns of a genset export, as whole columns.
+
+    Returns the events, with the rows holding an invalid value masked out, and the validity of the timestamp,
+    elapsed time and energy saving of each row. An empty energy saving is valid and kept as NaN.
+    """
+    timestamps, valid_timestamps = parse_timestamp_column(join_columns(dates, times), "%Y-%m-%d %H:%M:%S")
+    time_elapsed, valid_elapsed = parse_numbers(elapsed_values)
+    energy_saving, valid_energy = parse_numbers(energy_values)
+    has_energy = np.array(energy_values) != ""
+    valid_energy |= ~has_energy
+    events = cls(timestamps.astype(np.int64), time_elapsed, np.where(has_energy, energy_saving, np.nan), valid_timestamps & valid_elapsed & valid_energy)
+    return events, valid_timestamps, valid_elapsed, valid_energy
+
+  @classmethod
+  def concatenate(cls, parts: Sequence["GensetEvents"]) -> "GensetEvents":
+    """Join event containers end to end."""
+    if not parts:
+      return cls(np.array([], dtype=np.int64), np.array([], dtype=np.float64), np.array([], dtype=np.float64))
+    return cls(*(np.concatenate([getattr(part, field) for part in parts]) for field in cls.__slots__))
+
+  def select(self, mask: np.ndarray) -> "GensetEvents":
+    """Return the kept events that are also selected by a boolean mask, with the other rows masked out."""
+    return GensetEvents(self.timestamps, self.time_elapsed, self.energy_saving, self.keep & mask)
+
+  def kept(self) -> "GensetEvents":
+    """Return the kept events only, without the masked rows."""
+    return GensetEvents(self.timestamps[self.keep], self.time_elapsed[self.keep], self.energy_saving[self.keep])
+
+  def with_saving(self) -> "GensetEvents":
+    """Return the kept events that have an energy saving, without the masked rows."""
+    return self.select(~np.isnan(self.energy_saving)).kept()
+
+  @property
+  def seconds_of_day(self) -> np.ndarray:
+    """Return the time of day each event was initiated, in seconds."""
+    return self.timestamps % 86400
+
+  def _initiated(self) -> Tuple[List[str], List[str]]:
+    """Return the date and time each kept event was initiated, as text."""
+    initiated = np.datetime_as_string(self.timestamps[self.keep].astype("datetime64[s]")).tolist()
+    return [stamp[:10] for stamp in initiated], [stamp[11:] for stamp in initiated]
+
+  def to_rows(self) -> List[List[str]]:
+    """Return the kept events as CSV text rows in GENSET_FIELDS order."""
+    dates, times = self._initiated()
+    elapsed = [format_number(value) for value in self.time_elapsed[self.keep].tolist()]
+    energy = ["" if value != value else format_number(value) for value in self.energy_saving[self.keep].tolist()]
+    return [list(row) for row in zip(dates, times, elapsed, energy)]
+
+  def to_columns(self) -> List[list]:
+    """Return the kept events as worksheet columns in GENSET_FIELDS order, numbers as numbers."""
+    dates, times = self._initiated()
+    energy = ["" if value != value else value for value in self.energy_saving[self.keep].tolist()]
+    return [dates, times, self.time_elapsed[self.keep].tolist(), energy]
+
+def read_genset_events(file_path: Path, rejects: Optional[RejectReport] = None, column_widths: Optional[ColumnWidths] = None) -> Optional[GensetEvents]:
+  """Read the outage events of a month CSV file, skipping empty rows and previously calculated savings.
+
+  The date/time, elapsed time and energy columns are parsed as whole columns. Rows with an invalid value
+  are masked out and recorded in the reject report, if one is given. The column widths, if given, are
+  updated with the text of the kept rows in GENSET_FIELDS order.
+  """
+  header, rows = read_table(file_path)
+  missing_fields = [field for field in GENSET_FIELDS if field not in header]
+  if missing_fields:
+    logging.error(f"Columns {missing_fields} not found in {file_path}. Skipping.")
+    return None
+  date_idx, time_idx, elapsed_idx, energy_idx = (header.index(field) for field in GENSET_FIELDS)
+  rows = [row for row in rows if "Total savings" not in row]
+  dates, times = column_values(rows, date_idx), column_values(rows, time_idx)
+  elapsed_values, energy_values = column_values(rows, elapsed_idx), column_values(rows, energy_idx)
+  events, valid_timestamps, valid_elapsed, valid_energy = GensetEvents.parse(dates, times, elapsed_values, energy_values)
+  if rejects is not None:
+    rejects.record(file_path, "Date + Time Initiated", join_columns(dates, times), valid_timestamps, rows, "invalid timestamp")
+    rejects.record(file_path, GENSET_FIELDS[2], elapsed_values, valid_elapsed, rows)
+    rejects.record(file_path, GENSET_FIELDS[3], energy_values, valid_energy, rows)
+  if column_widths is not None:
+    column_widths.update([row for row, kept in zip(zip(dates, times, elapsed_values, energy_values), events.keep.tolist()) if kept])
+  if not events.keep.all():
+    logging.warning(f"Skipped {int((~events.keep).sum())} invalid rows of {file_path}.")
+  return events
+
+class HarmonicSamples:
+  """Struct-of-arrays container for harmonic samples: one NumPy column per field instead of one dict per sample.
+
+  spectrum holds the per-order currents in % of the fundamental as a (samples x orders) matrix, with
+  zero columns when the export carries THD only.
+  """
+  __slots__ = ("timestamps", "thd_i", "thd_v", "apparent_power", "spectrum")
+
+  def __init__(self, timestamps: np.ndarray, thd_i: np.ndarray, thd_v: np.ndarray, apparent_power: np.ndarray, spectrum: Optional[np.ndarray] = None):
+    self.timestamps = timestamps
+    self.thd_i = thd_i
+    self.thd_v = thd_v
+    self.apparent_power = apparent_power
+    self.spectrum = spectrum if spectrum is not None else np.empty((len(timestamps), 0))
+
+  def __len__(self) -> int:
+    return len(self.timestamps)
+
+  def select(self, mask: np.ndarray) -> "HarmonicSamples":
+    """Return the samples selected by a boolean mask or index array."""
+    return HarmonicSamples(self.timestamps[mask], self.thd_i[mask], self.thd_v[mask], self.apparent_power[mask], self.spectrum[mask])
+
+  @classmethod
+  def concatenate(cls, parts: Sequence["HarmonicSamples"]) -> "HarmonicSamples":
+    """Join sample containers end to end."""
+    return cls(*(np.concatenate([getattr(part, field) for part in parts]) for field in cls.__slots__))
@@ -0,0 +1,246 @@
+import argparse
+import csv
+import hashlib
+import html
+import importlib
+import json
+import logging
+import multiprocessing
+import os
+import pickle
+import sys
+import threading
+import time
+from concurrent.futures import Future, ProcessPoolExecutor
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+from memo import source_digests
+from profiling import profiled
+from rollups import SAVINGS_MEASURES, Rollup
+from tariff import DEMAND_CHARGES
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+RENDER_DIR = Path("results/render")
+SUMMARY_FORMATS = ("csv", "html")
+# The measures of each calculator's summaries besides its SAVINGS_MEASURES, with their labels. Measures a rollup
+# does not carry, such as the demand charges without a tariff, are left out.
+SUMMARY_MEASURES = {
+  "Genset_Fuel": [
+    ("total_kwh_saved", "kWh Saved"), ("num_outages", "Outages"), ("genset_fuel_savings", "Genset Fuel Savings"),
+    ("outage_savings", "Outage Savings"), ("sim_genset_savings", "Simulated Genset Savings")
+  ],
+  "Frequency": [
+    ("total_deviation_cost", "Deviation Cost"), ("maintenance_cost", "Maintenance Cost"), ("downtime_cost", "Downtime Cost"),
+    ("penalty_cost", "Penalty Cost"), ("out_of_tolerance_intervals", "Out-of-Tolerance Intervals")
+  ],
+  "Power_Factor": [("low_power_factor_intervals", "Low Power Factor Intervals")],
+  "Voltage_Stability": [
+    ("mitigated_deviation_energy", "Mitigated Deviation Energy (kWh)"), ("out_of_tolerance_intervals", "Out-of-Tolerance Intervals"),
+    (DEMAND_CHARGES, "Demand Charges (upper bound)")
+  ],
+  "Harmonic": [
+    ("total_non_compliant_energy", "Non-Compliant Energy (kVAh)"), ("total_energy_losses", "Energy Losses (kWh)"),
+    ("k_factor_mean", "Mean K-Factor"), (DEMAND_CHARGES, "Demand Charges (upper bound)")
+  ]
+}
+MONTHS = [
+  "January", "February", "March", "April", "May", "June",
+  "July", "August", "September", "October", "November", "December"
+]
+
+def render_state_path(year: int, site: str, calculator: str, render_dir: Path = RENDER_DIR) -> Path:
+  """Return where the state a calculator's reports are rendered from is saved."""
+  return render_dir / f"{year}_{site}_{calculator}.pkl"
+
+def render_outputs(year: int, site: str, calculator: str) -> List[Path]:
+  """Return the render state of a calculator and the render cache manifest beside it, for the calculator's result cache."""
+  state_path = render_state_path(year, site, calculator)
+  return [state_path, state_path.with_suffix(".json")]
+
+def summary_path(year: int, site: str, calculator: str, summary_format: str) -> Path:
+  """Return where a calculator's CSV or HTML summary is written."""
+  return Path(f"results/{year}_{site}_{calculator}_Summary.{summary_format}")
+
+def summary_formats(config: Dict) -> List[str]:
+  """Return the summary formats listed in render.summaries, warning about unknown ones."""
+  formats = config.get("render", {}).get("summaries", [])
+  unknown = [summary_format for summary_format in formats if summary_format not in SUMMARY_FORMATS]
+  if unknown:
+    logging.warning(f"Unknown summary formats {unknown} in render.summaries. Use {', '.join(SUMMARY_FORMATS)}.")
+  return [summary_format for summary_format in formats if summary_format in SUMMARY_FORMATS]
+
+def save_render_state(calculator: Any, name: str) -> Path:
+  """Save the RENDER_STATE attributes of a calculator, with its site and year, as the state its reports are rendered from."""
+  config = calculator.config
+  calculator_class = type(calculator)
+  state = {
+    "module": Path(sys.modules[calculator_class.__module__].__file__).stem,
+    "class": calculator_class.__name__,
+    "config": {"year": config["year"], "site": config["site"]},
+    "attributes": {attribute: getattr(calculator, attribute) for attribute in calculator_class.RENDER_STATE}
+  }
+  path = render_state_path(config["year"], config["site"], name)
+  path.parent.mkdir(parents=True, exist_ok=True)
+  temporary = path.with_suffix(f".{os.getpid()}.tmp")
+  temporary.write_bytes(pickle.dumps(state, protocol=pickle.HIGHEST_PROTOCOL))
+  os.replace(temporary, path)
+  logging.info(f"Saved {name} render state to {path}.")
+  return path
+
+def restore_calculator(state: Dict) -> Any:
+  """Rebuild a calculator from a saved render state, without running its constructor, which loads the config and inputs."""
+  calculator_class = getattr(importlib.import_module(state["module"]), state["class"])
+  calculator = calculator_class.__new__(calculator_class)
+  calculator.config = state["config"]
+  for attribute, value in state["attributes"].items():
+    setattr(calculator, attribute, value)
+  return calculator
+
+def summary_measures(rollup: Rollup) -> List[Tuple[str, str]]:
+  """Return the measures of a rollup shown in its summaries, as (measure, label), starting with its savings."""
+  totals = rollup.total()
+  listed = [(SAVINGS_MEASURES[rollup.calculator], "Savings")] if rollup.calculator in SAVINGS_MEASURES else []
+  listed += SUMMARY_MEASURES.get(rollup.calculator, [])
+  return [(measure, label) for measure, label in listed if measure in totals]
+
+def summary_rows(rollup: Rollup) -> Tuple[List[str], List[List]]:
+  """Return the headers and rows of a summary: the summary measures of each month with data, then the yearly totals."""
+  listed = summary_measures(rollup)
+  measures = [measure for measure, _ in listed]
+  rows = []
+  for month_number, month in enumerate(MONTHS, start=1):
+    month_row = rollup.month_row(month_number)
+    if month_row:
+      rows.append([month] + [month_row[measure] for measure in measures])
+  totals = rollup.total()
+  rows.append(["Yearly Total"] + [totals.get(measure, 0.0) for measure in measures])
+  return ["Month"] + [label for _, label in listed], rows
+
+def write_summary_csv(rollup: Rollup, path: Path, title: str) -> Path:
+  """Write the month summary of a rollup to a CSV file."""
+  headers, rows = summary_rows(rollup)
+  with open(path, mode='w', newline='') as outfile:
+    writer = csv.writer(outfile)
+    writer.writerow(headers)
+    writer.writerows(rows)
+  return path
+
+def write_summary_html(rollup: Rollup, path: Path, title: str) -> Path:
+  """Write the month summary of a rollup to a standalone HTML table."""
+  headers, rows = summary_rows(rollup)
+  lines = [
+    "<!DOCTYPE html>",
+    f"<html><head><meta charset=\"utf-8\"><title>{html.escape(title)}</title></head><body>",
+    f"<h1>{html.escape(title)}</h1>",
+    "<table border=\"1\">",
+    "<tr>" + "".join(f"<th>{html.escape(header)}</th>" for header in headers) + "</tr>"
+  ]
+  for row in rows:
+    lines.append(f"<tr><td>{html.escape(row[0])}</td>" + "".join(f"<td align=\"right\">{value:,.2f}</td>" for value in row[1:]) + "</tr>")
+  lines.append("</table></body></html>")
+  path.write_text("\n".join(lines) + "\n")
+  return path
+
+SUMMARY_WRITERS: Dict[str, Callable[[Rollup, Path, str], Path]] = {"csv": write_summary_csv, "html": write_summary_html}
+
+def _file_stat(path: Path) -> List[int]:
+  """Return the size and modification time of a file, or an empty list if it does not exist."""
+  if not path.exists():
+    return []
+  stat = path.stat()
+  return [stat.st_size, stat.st_mtime_ns]
+
+def render(state_path: Path, summaries: Sequence[str] = (), calculator: Any = None) -> List[Path]:
+  """Render the workbook and summaries of a saved calculator state, unless the render cache has them. Returns the report paths.
+
+  The cache key digests the saved state, the summary formats and the source of the calculator's script
+  modules. When the manifest beside the state has the same key and every report it lists is as it was
+  written, nothing is rendered. A calculator that still holds its state in memory can be passed instead
+  of loading the saved one.
+  """
+  started = time.perf_counter()
+  name = state_path.stem
+  state_bytes = state_path.read_bytes()
+  if calculator is None:
+    calculator = restore_calculator(pickle.loads(state_bytes))
+  code = sorted(source_digests(type(calculator).__module__).values())
+  key = hashlib.blake2b(state_bytes + json.dumps({"summaries": list(summaries), "code": code}).encode(), digest_size=16).hexdigest()
+  manifest_path = state_path.with_suffix(".json")
+  if manifest_path.exists():
+    manifest = json.loads(manifest_path.read_text())
+    if manifest["key"] == key and all(_file_stat(Path(path)) == stat for path, stat in manifest["outputs"].items()):
+      logging.info(f"{name} results are unchanged since they were rendered. Skipped rendering.")
+      return [Path(path) for path in manifest["outputs"]]
+
+  year = calculator.config["year"]
+  site = calculator.config["site"]
+  calculator_name = calculator.rollup.calculator
+  paths = [calculator.write_workbook()]
+  for summary_format in summaries:
+    title = f"{site} {year} {calculator_name.replace('_', ' ')} Savings"
+    paths.append(SUMMARY_WRITERS[summary_format](calculator.rollup, summary_path(year, site, calculator_name, summary_format), title))
+  manifest_path.write_text(json.dumps({"key": key, "outputs": {str(path): _file_stat(path) for path in paths}}))
+  logging.info(f"Rendered {', '.join(str(path) for path in paths)} in {time.perf_counter() - started:.2f} s.")
+  return paths
+
+class RenderPool:
+  """Process pool that renders reports from saved calculator states in the background.
+
+  submit() only queues a job and returns, so the thread that computed the results moves on while
+  xlsxwriter runs in another process. Jobs are given the path of a saved state, not the calculator
+  itself. Workers are spawned rather than forked, as jobs are submitted from the pipeline's threads.
+  wait() collects the jobs and runs the follow-up of each, such as caching the calculator's outputs,
+  on the waiting thread. A failed job is logged and recorded in failed, and the other jobs are collected.
+  """
+
+  def __init__(self, workers: int = 0):
+    self.workers = workers or os.cpu_count() or 1
+    self.executor = ProcessPoolExecutor(max_workers=self.workers, mp_context=multiprocessing.get_context("spawn"))
+    self.jobs: List[Tuple[Path, Future, Optional[Callable[[], None]]]] = []
+    self.failed: List[Path] = []
+    self._lock = threading.Lock()
+
+  def __enter__(self) -> "RenderPool":
+    return self
+
+  def __exit__(self, *exc_info: Any) -> None:
+    self.executor.shutdown(wait=True)
+
+  def submit(self, state_path: Path, summaries: Sequence[str] = (), then: Optional[Callable[[], None]] = None) -> Future:
+    """Queue the rendering of a saved state, with an optional follow-up once it is rendered."""
+    future = self.executor.submit(render, state_path, list(summaries))
+    with self._lock:
+      self.jobs.append((state_path, future, then))
+    return future
+
+  def wait(self) -> List[Path]:
+    """Wait for the queued jobs in submission order and run the follow-ups of those that succeeded. Returns the rendered paths."""
+    paths = []
+    with self._lock:
+      jobs, self.jobs = self.jobs, []
+    for state_path, future, then in jobs:
+      try:
+        paths.extend(future.result())
+      except Exception as error:
+        self.failed.append(state_path)
+        logging.exception(f"Rendering {state_path} failed: {error}")
+        continue
+      if then is not None:
+        then()
+    return paths
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser(description="Render the workbooks and summaries of saved calculator results on a process pool.")
+  parser.add_argument("states", nargs="*", type=Path, help=f"render states to render (default: all in {RENDER_DIR})")
+  parser.add_argument("--summaries", nargs="*", default=[], choices=SUMMARY_FORMATS, help="summary formats to write besides the workbook")
+  parser.add_argument("--workers", type=int, default=0, help="render processes (default: one per CPU)")
+  args = parser.parse_args()
+  states = args.states or sorted(RENDER_DIR.glob("*.pkl"))
+  with profiled("render"), RenderPool(args.workers) as render_pool:
+    for state_path in states:
+      render_pool.submit(state_path, args.summaries)
+    for path in render_pool.wait():
+      print(path)
+  if render_pool.failed:
+    sys.exit(1)
@@ -0,0 +1,181 @@
+import argparse
+import json
+import logging
+import sqlite3
+import time
+from contextlib import closing
+from itertools import islice, repeat
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, Optional, Sequence, Tuple
+import numpy as np
+from memo import ResultCache, input_files
+from profiling import profiled
+from rollups import SAVINGS_MEASURES, Rollup, interval_means
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+STORE_PATH = Path("results/savings.sqlite")
+UPSERT_BATCH_ROWS = 50000  # rows per executemany call, bounding the memory of the generated parameter tuples
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+  run_id INTEGER PRIMARY KEY,
+  site TEXT NOT NULL,
+  year INTEGER NOT NULL,
+  calculator TEXT NOT NULL,
+  recorded_at TEXT NOT NULL,
+  restored INTEGER NOT NULL,
+  cache_key TEXT NOT NULL,
+  config TEXT NOT NULL,
+  inputs TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS runs_by_calculator ON runs (site, year, calculator, run_id);
+CREATE TABLE IF NOT EXISTS month_results (
+  site TEXT NOT NULL,
+  year INTEGER NOT NULL,
+  month INTEGER NOT NULL,
+  calculator TEXT NOT NULL,
+  measure TEXT NOT NULL,
+  value REAL NOT NULL,
+  run_id INTEGER NOT NULL,
+  PRIMARY KEY (site, year, month, calculator, measure)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS hour_results (
+  site TEXT NOT NULL,
+  year INTEGER NOT NULL,
+  month INTEGER NOT NULL,
+  calculator TEXT NOT NULL,
+  hour TEXT NOT NULL,
+  measure TEXT NOT NULL,
+  value REAL NOT NULL,
+  run_id INTEGER NOT NULL,
+  PRIMARY KEY (site, year, month, calculator, hour, measure)
+) WITHOUT ROWID;
+"""
+MONTH_UPSERT = """
+INSERT INTO month_results (site, year, month, calculator, measure, value, run_id) VALUES (?, ?, ?, ?, ?, ?, ?)
+ON CONFLICT (site, year, month, calculator, measure) DO UPDATE SET value = excluded.value, run_id = excluded.run_id
+"""
+HOUR_UPSERT = """
+INSERT INTO hour_results (site, year, month, calculator, hour, measure, value, run_id) VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+ON CONFLICT (site, year, month, calculator, hour, measure) DO UPDATE SET value = excluded.value, run_id = excluded.run_id
+"""
+
+def connect(path: Path = STORE_PATH) -> sqlite3.Connection:
+  """Open the store in WAL mode, so readers do not block the writer, creating the tables on first use."""
+  path.parent.mkdir(parents=True, exist_ok=True)
+  connection = sqlite3.connect(path, timeout=30)
+  connection.execute("PRAGMA journal_mode=WAL")
+  connection.execute("PRAGMA synchronous=NORMAL")
+  connection.executescript(SCHEMA)
+  return connection
+
+def _inputs(cache: ResultCache) -> Dict[str, Dict]:
+  """Return the size, modification time and, when the result cache hashed it, the digest of every input file of a run."""
+  files = {}
+  for file in input_files(cache.inputs):
+    stat = file.stat()
+    files[str(file)] = {"bytes": stat.st_size, "modified": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(stat.st_mtime)), "digest": cache.input_digests.get(str(file))}
+  return files
+
+def _month_rows(site: str, year: int, calculator: str, rollup: Rollup, run_id: int) -> Iterator[Tuple]:
+  """Yield the month_results rows of a rollup, one per month and measure, with months matched as in the yearly summaries."""
+  for month in range(1, 13):
+    month_row = rollup.month_row(month)
+    for measure, value in (month_row or {}).items():
+      yield (site, year, month, calculator, measure, value, run_id)
+
+def _hour_rows(site: str, year: int, calculator: str, rollup: Rollup, run_id: int) -> Iterator[Tuple]:
+  """Yield the hour_results rows of a rollup, one per hour and measure, with ratio sums as their mean per interval."""
+  table = interval_means(rollup.table("hour"))
+  hours = np.datetime_as_string(table["period"], unit="h").tolist()
+  months = (table["period"].astype("datetime64[M]").astype(np.int64) % 12 + 1).tolist()
+  for measure, values in table.items():
+    if measure != "period":
+      yield from zip(repeat(site), repeat(year), months, repeat(calculator), hours, repeat(measure), values.tolist(), repeat(run_id))
+
+def _upsert(connection: sqlite3.Connection, statement: str, rows: Iterable[Tuple]) -> int:
+  """Upsert rows in batches of UPSERT_BATCH_ROWS with executemany and return the row count."""
+  rows = iter(rows)
+  count = 0
+  while True:
+    batch = list(islice(rows, UPSERT_BATCH_ROWS))
+    if not batch:
+      return count
+    connection.executemany(statement, batch)
+    count += len(batch)
+
+def record_run(config: Dict, calculator: str, rollup: Rollup, cache: ResultCache, restored: bool = False, path: Path = STORE_PATH) -> Optional[int]:
+  """Record a calculator run's provenance and upsert its month and hour results in one transaction. Returns the run id.
+
+  Results are left as they are when the latest recorded run of the calculator has the same result cache key,
+  as is the case for runs restored from the cache. Rows the run did not write, such as months no longer in the
+  data, are deleted.
+  """
+  store_config = config.get("store", {})
+  if not store_config.get("enabled", True):
+    return None
+  site = config["site"]
+  year = config["year"]
+  with closing(connect(path)) as connection, connection:
+    latest = connection.execute("SELECT cache_key FROM runs WHERE site = ? AND year = ? AND calculator = ? ORDER BY run_id DESC LIMIT 1", (site, year, calculator)).fetchone()
+    run_id = connection.execute(
+      "INSERT INTO runs (site, year, calculator, recorded_at, restored, cache_key, config, inputs) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+      (site, year, calculator, time.strftime("%Y-%m-%dT%H:%M:%S"), int(restored), cache.key, json.dumps(cache.config_sections), json.dumps(_inputs(cache)))
+    ).lastrowid
+    if cache.key and latest and latest[0] == cache.key:
+      logging.info(f"Recorded {calculator} run {run_id} in {path}. Results are unchanged since the previous run.")
+      return run_id
+    rows = _upsert(connection, MONTH_UPSERT, _month_rows(site, year, calculator, rollup, run_id))
+    connection.execute("DELETE FROM month_results WHERE site = ? AND year = ? AND calculator = ? AND run_id != ?", (site, year, calculator, run_id))
+    if store_config.get("hour_results", True):
+      rows += _upsert(connection, HOUR_UPSERT, _hour_rows(site, year, calculator, rollup, run_id))
+      connection.execute("DELETE FROM hour_results WHERE site = ? AND year = ? AND calculator = ? AND run_id != ?", (site, year, calculator, run_id))
+  logging.info(f"Recorded {calculator} run {run_id} and upserted {rows} result rows in {path}.")
+  return run_id
+
+def yearly_summary(connection: sqlite3.Connection, site: str, year: int) -> Dict[str, Dict[int, float]]:
+  """Return the monthly savings of every calculator of a site and year, read through the results index."""
+  pairs = list(SAVINGS_MEASURES.items())
+  rows = connection.execute(
+    f"SELECT calculator, month, value FROM month_results WHERE site = ? AND year = ? AND (calculator, measure) IN (VALUES {', '.join(['(?, ?)'] * len(pairs))}) ORDER BY month",
+    [site, year] + [value for pair in pairs for value in pair]
+  ).fetchall()
+  summary: Dict[str, Dict[int, float]] = {calculator: {} for calculator in SAVINGS_MEASURES}
+  for calculator, month, value in rows:
+    summary[calculator][month] = value
+  return summary
+
+def _print_rows(headers: Sequence[str], rows: Iterable[Sequence]) -> None:
+  """Print a header and rows as CSV."""
+  print(",".join(headers))
+  for row in rows:
+    print(",".join("" if value is None else str(value) for value in row))
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser(description="Query the SQLite store of calculator results and run provenance.")
+  parser.add_argument("--store", type=Path, default=STORE_PATH)
+  commands = parser.add_subparsers(dest="command", required=True)
+  summary_parser = commands.add_parser("summary", help="monthly savings of each calculator for a site and year")
+  summary_parser.add_argument("site")
+  summary_parser.add_argument("year", type=int)
+  runs_parser = commands.add_parser("runs", help="recorded runs, latest first")
+  runs_parser.add_argument("--site")
+  runs_parser.add_argument("--year", type=int)
+  runs_parser.add_argument("--calculator")
+  runs_parser.add_argument("--limit", type=int, default=20)
+  query_parser = commands.add_parser("query", help="run an SQL query and print the rows as CSV")
+  query_parser.add_argument("sql")
+  args = parser.parse_args()
+  with profiled("result_store"), closing(connect(args.store)) as connection:
+    if args.command == "summary":
+      summary = yearly_summary(connection, args.site, args.year)
+      _print_rows(["Month"] + list(summary), ([month] + [summary[calculator].get(month, "") for calculator in summary] for month in range(1, 13)))
+      print(",".join(["Yearly Total"] + [str(sum(months.values())) for months in summary.values()]))
+    elif args.command == "runs":
+      filters = [(column, value) for column, value in (("site", args.site), ("year", args.year), ("calculator", args.calculator)) if value is not None]
+      where = f"WHERE {' AND '.join(f'{column} = ?' for column, _ in filters)}" if filters else ""
+      cursor = connection.execute(f"SELECT run_id, site, year, calculator, recorded_at, restored, cache_key FROM runs {where} ORDER BY run_id DESC LIMIT ?", [value for _, value in filters] + [args.limit])
+      _print_rows([column[0] for column in cursor.description], cursor)
+    else:
+      cursor = connection.execute(args.sql)
+      _print_rows([column[0] for column in cursor.description or []], cursor)
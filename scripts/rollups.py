@@ -0,0 +1,151 @@
+import logging
+import sys
+from pathlib import Path
+from typing import Any, Dict, Iterable, Optional
+import numpy as np
+
+ROLLUP_LEVELS = ("hour", "day", "month", "year")
+LEVEL_UNITS = {"hour": "datetime64[h]", "day": "datetime64[D]", "month": "datetime64[M]", "year": "datetime64[Y]"}
+COUNT_COLUMN = "intervals"
+# Measures that sum a per-interval ratio, such as a K-factor, end in SUM_SUFFIX. Their sums only combine
+# levels correctly, so month_row() and total() report them as their mean per interval, ending in MEAN_SUFFIX.
+SUM_SUFFIX = "_sum"
+MEAN_SUFFIX = "_mean"
+# The savings measure of each calculator's rollup.
+SAVINGS_MEASURES = {
+  "Genset_Fuel": "total_genset_month_savings",
+  "Frequency": "total_savings",
+  "Power_Factor": "total_cost_savings",
+  "Voltage_Stability": "cost_savings",
+  "Harmonic": "total_cost_savings"
+}
+
+def group_starts(keys: np.ndarray) -> np.ndarray:
+  """Return the index where each run of equal keys starts. Keys must be sorted."""
+  if not len(keys):
+    return np.array([], dtype=np.intp)
+  return np.flatnonzero(np.concatenate(([True], keys[1:] != keys[:-1])))
+
+def _group_table(keys: np.ndarray, columns: Dict[str, np.ndarray]) -> Dict[str, np.ndarray]:
+  """Sum every column over runs of equal sorted keys into a table keyed by 'period'."""
+  starts = group_starts(keys)
+  table = {"period": keys[starts]}
+  for name, values in columns.items():
+    table[name] = np.add.reduceat(values, starts) if len(starts) else values[:0]
+  return table
+
+def interval_means(columns: Dict[str, Any]) -> Dict[str, Any]:
+  """Replace each SUM_SUFFIX measure of a row or table of sums by its mean per interval, 0 where there are no intervals."""
+  counts = np.asarray(columns.get(COUNT_COLUMN, 0.0), dtype=np.float64)
+  means = {}
+  for name, values in columns.items():
+    if name.endswith(SUM_SUFFIX):
+      mean = np.divide(values, counts, out=np.zeros_like(counts), where=counts > 0)
+      means[name[:-len(SUM_SUFFIX)] + MEAN_SUFFIX] = float(mean) if mean.ndim == 0 else mean
+    else:
+      means[name] = values
+  return means
+
+class Rollup:
+  """Hierarchical hour -> day -> month -> year sums of per-interval measures for one calculator."""
+
+  def __init__(self, calculator: str, levels: Dict[str, Dict[str, np.ndarray]]):
+    self.calculator = calculator
+    self.levels = levels
+
+  @classmethod
+  def from_intervals(cls, calculator: str, timestamps: np.ndarray, measures: Dict[str, np.ndarray]) -> "Rollup":
+    """Build every level from interval timestamps and measures. Raw data is only scanned once, for the hour level."""
+    order = np.argsort(timestamps, kind="stable")
+    hour_keys = timestamps[order].astype(LEVEL_UNITS["hour"])
+    columns = {name: np.asarray(values, dtype=np.float64)[order] for name, values in measures.items()}
+    columns[COUNT_COLUMN] = np.ones(len(hour_keys), dtype=np.float64)
+    return cls.from_hours(calculator, _group_table(hour_keys, columns))
+
+  @classmethod
+  def from_hours(cls, calculator: str, hour_table: Dict[str, np.ndarray]) -> "Rollup":
+    """Derive the day, month and year levels from an hour table."""
+    levels = {"hour": hour_table}
+    previous = hour_table
+    for level in ROLLUP_LEVELS[1:]:
+      keys = previous["period"].astype(LEVEL_UNITS[level])
+      previous = _group_table(keys, {name: values for name, values in previous.items() if name != "period"})
+      levels[level] = previous
+    return cls(calculator, levels)
+
+  @classmethod
+  def combine(cls, calculator: str, rollups: Iterable["Rollup"]) -> "Rollup":
+    """Combine rollups (e.g. one per month) by merging their hour tables and re-deriving the upper levels."""
+    hour_tables = [rollup.levels["hour"] for rollup in rollups if len(rollup.levels["hour"]["period"])]
+    if not hour_tables:
+      return cls.empty(calculator)
+    names = list(hour_tables[0].keys())
+    merged = {name: np.concatenate([table[name] for table in hour_tables]) for name in names}
+    order = np.argsort(merged["period"], kind="stable")
+    columns = {name: merged[name][order] for name in names if name != "period"}
+    return cls.from_hours(calculator, _group_table(merged["period"][order], columns))
+
+  @classmethod
+  def empty(cls, calculator: str, measures: Iterable[str] = ()) -> "Rollup":
+    """Create a rollup without any intervals."""
+    hour_table = {"period": np.array([], dtype=LEVEL_UNITS["hour"])}
+    for name in list(measures) + [COUNT_COLUMN]:
+      hour_table[name] = np.array([], dtype=np.float64)
+    return cls.from_hours(calculator, hour_table)
+
+  def table(self, level: str) -> Dict[str, np.ndarray]:
+    """Return the columns of one rollup level."""
+    return self.levels[level]
+
+  def month_row(self, month_number: int) -> Optional[Dict[str, float]]:
+    """Return the measures of one month of the reporting year, or None when the month has no intervals.
+
+    Months are matched on month-of-year, as a reporting year's data folder may hold the previous December.
+    SUM_SUFFIX measures are returned as their mean per interval.
+    """
+    table = self.levels["month"]
+    matches = table["period"].astype(np.int64) % 12 + 1 == month_number
+    if not matches.any():
+      return None
+    return interval_means({name: float(values[matches].sum()) for name, values in table.items() if name != "period"})
+
+  def total(self) -> Dict[str, float]:
+    """Return the measures summed over the whole rollup, with SUM_SUFFIX measures as their mean per interval."""
+    return interval_means({name: float(values.sum()) for name, values in self.levels["year"].items() if name != "period"})
+
+  def save(self, path: Path) -> None:
+    """Save all levels to a compressed columnar .npz file."""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    arrays = {f"{level}/{name}": values for level, table in self.levels.items() for name, values in table.items()}
+    np.savez_compressed(path, calculator=np.array(self.calculator), **arrays)
+    logging.info(f"Saved {self.calculator} rollup to {path}.")
+
+  @classmethod
+  def load(cls, path: Path) -> "Rollup":
+    """Load a rollup saved with save()."""
+    levels: Dict[str, Dict[str, np.ndarray]] = {level: {} for level in ROLLUP_LEVELS}
+    with np.load(path) as data:
+      calculator = str(data["calculator"])
+      for key in data.files:
+        if "/" in key:
+          level, name = key.split("/", 1)
+          levels[level][name] = data[key]
+    return cls(calculator, levels)
+
+def rollup_path(year: int, site: str, calculator: str) -> Path:
+  """Return where a calculator's rollup is stored."""
+  return Path(f"results/rollups/{year}_{site}_{calculator}.npz")
+
+def print_rollup(path: Path, level: str) -> None:
+  """Print one level of a stored rollup as CSV."""
+  table = Rollup.load(path).table(level)
+  names = list(table.keys())
+  print(",".join(names))
+  for row_idx in range(len(table["period"])):
+    print(",".join(str(table[name][row_idx]) for name in names))
+
+if __name__ == "__main__":
+  if len(sys.argv) != 3 or sys.argv[2] not in ROLLUP_LEVELS:
+    print(f"Usage: python scripts/rollups.py <rollup.npz> <{'|'.join(ROLLUP_LEVELS)}>")
+    sys.exit(1)
+  print_rollup(Path(sys.argv[1]), sys.argv[2])
@@ -0,0 +1,138 @@
+import logging
+import sys
+from typing import Dict, Iterable, Sequence, Tuple
+import numpy as np
+from rollups import Rollup, group_starts
+
+DAY_TYPES = ("weekday", "saturday", "sunday")  # holidays follow the sunday schedule
+FLAT_PERIOD = "flat"
+DEMAND_CHARGES = "demand_charge_upper_bound"  # rollup measure of the most demand charges the avoided losses could save, not in the cost savings
+TOU_PREFIX = "tou_"  # prefix of rollup measures weighted by the tariff factor, which Monte Carlo re-prices in place of the plain measure
+# Config sections whose savings are priced per kWh, and so can be priced with the tariff. The power factor penalty
+# and the frequency deviation costs are priced per unit of shortfall and per Hz, which the hour of day does not change.
+KWH_PRICED_SECTIONS = ("harmonics", "voltage_stability", "genset_fuel")
+
+class Tariff:
+  """Time-of-use energy rates and monthly demand charges, looked up from a precomputed hourly calendar.
+
+  Every hour of a weekday, saturday and sunday belongs to a rate period (e.g. peak, standard, off_peak).
+  The first time a year is priced, the schedules and holidays are expanded into one array holding the period
+  of every hour of that year, so pricing an interval array is a datetime64[h] conversion and an index lookup.
+
+  Calculators price with their own flat price times factors(): the period rate divided by the reference
+  rate (cost_per_kWh). With no tariff configured every factor is exactly 1.0. Only the calculators of
+  KWH_PRICED_SECTIONS are priced with a tariff.
+
+  Demand charges are booked with with_demand_charges() by the harmonics and voltage stability calculators only,
+  as their avoided losses are grid energy that lowers the site's hourly demand. Genset fuel savings are energy
+  the genset supplies during grid outages, which does not reduce the demand drawn from the grid. The charge is
+  an upper bound kept apart from the cost savings: the site's billed peak is usually at another hour than the
+  peak of the avoided losses, and the calculators have no site demand series to find it.
+  """
+
+  def __init__(self, reference_rate: float, rates: Dict[str, float], schedules: Dict[str, Sequence[Tuple[int, int, str]]], holidays: Iterable[str] = (), demand_charge_per_kW: float = 0.0, demand_periods: Sequence[str] = ()):
+    self.reference_rate = reference_rate
+    self.period_names = list(rates)
+    self.rates = np.array([rates[name] for name in self.period_names], dtype=np.float64)
+    self.period_factors = self.rates / reference_rate
+    self.week_table = np.stack([self._day_periods(day_type, schedules[day_type]) for day_type in DAY_TYPES])
+    self.holidays = np.array(sorted(holidays), dtype="datetime64[D]")
+    self.demand_charge_per_kW = demand_charge_per_kW
+    self.demand_periods = np.array([self.period_names.index(name) for name in demand_periods or self.period_names], dtype=np.int64)
+    self.is_flat = len(self.period_names) == 1 and self.period_factors[0] == 1.0 and not demand_charge_per_kW
+    self._calendars: Dict[Tuple[int, int], np.ndarray] = {}
+
+  @classmethod
+  def flat(cls, reference_rate: float) -> "Tariff":
+    """Create a tariff with one rate at all hours, whose factors are all 1.0."""
+    return cls(reference_rate, {FLAT_PERIOD: reference_rate}, {day_type: [(0, 24, FLAT_PERIOD)] for day_type in DAY_TYPES})
+
+  @classmethod
+  def from_config(cls, config: Dict, section: str) -> "Tariff":
+    """Create the tariff a calculator's config section is priced with: the "tariff" section if it is enabled and applies to the section, otherwise flat."""
+    tariff_config = config.get("tariff", {})
+    if not tariff_config.get("enabled", False) or section not in tariff_config.get("apply_to", []):
+      return cls.flat(config["cost_per_kWh"])
+    not_kwh_priced = [name for name in tariff_config["apply_to"] if name not in KWH_PRICED_SECTIONS]
+    if not_kwh_priced:
+      logging.warning(f"Tariff apply_to lists {', '.join(not_kwh_priced)}, which are not priced per kWh and stay at flat rates.")
+    rates = tariff_config["rates"]
+    schedules = {day_type: [tuple(hours) for hours in tariff_config[day_type]] for day_type in DAY_TYPES}
+    used = {name for schedule in schedules.values() for _, _, name in schedule} | set(tariff_config.get("demand_periods", []))
+    unknown = sorted(used - set(rates))
+    if unknown:
+      logging.error(f"Tariff periods {', '.join(unknown)} have no rate. Rates: {', '.join(rates)}. Exiting.")
+      sys.exit()
+    logging.info(f"Pricing {section} with the time-of-use tariff.")
+    return cls(config["cost_per_kWh"], rates, schedules, tariff_config.get("holidays", []), tariff_config.get("demand_charge_per_kW", 0.0), tariff_config.get("demand_periods", []))
+
+  def _day_periods(self, day_type: str, schedule: Sequence[Tuple[int, int, str]]) -> np.ndarray:
+    """Return the period of each hour of a day from (start hour, end hour, period) ranges covering 0 to 24."""
+    periods = np.full(24, -1, dtype=np.int64)
+    for start, end, name in schedule:
+      periods[start:end] = self.period_names.index(name)
+    if (periods < 0).any():
+      logging.error(f"The {day_type} tariff schedule does not cover hours {np.flatnonzero(periods < 0).tolist()}. Exiting.")
+      sys.exit()
+    return periods
+
+  def calendar(self, first_year: int, last_year: int) -> np.ndarray:
+    """Return the period of every hour from the start of first_year to the end of last_year, built once per year range."""
+    key = (first_year, last_year)
+    if key not in self._calendars:
+      days = np.arange(np.datetime64(f"{first_year}-01-01"), np.datetime64(f"{last_year + 1}-01-01"))
+      weekdays = (days.astype(np.int64) + 3) % 7  # 1970-01-01 was a Thursday; 0 is Monday
+      day_types = np.where(weekdays == 5, 1, np.where(weekdays == 6, 2, 0))
+      day_types[np.isin(days, self.holidays)] = 2
+      self._calendars[key] = self.week_table[day_types].ravel()
+    return self._calendars[key]
+
+  def periods(self, timestamps: np.ndarray) -> np.ndarray:
+    """Return the rate period index of each timestamp."""
+    hours = timestamps.astype("datetime64[h]")
+    if not len(hours):
+      return np.array([], dtype=np.int64)
+    first_year, last_year = (int(hour.astype("datetime64[Y]").astype(np.int64)) + 1970 for hour in (hours.min(), hours.max()))
+    offsets = (hours - np.datetime64(f"{first_year}-01-01T00", "h")).astype(np.int64)
+    return self.calendar(first_year, last_year)[offsets]
+
+  def factors(self, timestamps: np.ndarray) -> np.ndarray:
+    """Return the price factor of each timestamp: its period rate divided by the reference rate."""
+    if self.is_flat:
+      return np.ones(len(timestamps))
+    return self.period_factors[self.periods(timestamps)]
+
+  def rates_at(self, timestamps: np.ndarray) -> np.ndarray:
+    """Return the energy rate of each timestamp."""
+    return self.rates[self.periods(timestamps)]
+
+  def demand_charges(self, hour_periods: np.ndarray, hour_energy: np.ndarray) -> np.ndarray:
+    """Return the upper bound of the avoided demand charge of each row of a sorted hour table, placed at the peak hour of its month.
+
+    The energy of an hour (kWh) is its mean demand (kW), so each month is charged demand_charge_per_kW on
+    its highest hourly energy within the demand periods. The charge sits at that month's first peak hour.
+    It is what the site would save if its billed peak fell at that hour; at any other hour it saves less.
+    """
+    charges = np.zeros(len(hour_periods))
+    if not self.demand_charge_per_kW or not len(hour_periods):
+      return charges
+    demand = np.where(np.isin(self.periods(hour_periods), self.demand_periods), hour_energy, 0.0)
+    starts = group_starts(hour_periods.astype("datetime64[M]"))
+    peaks = np.maximum.reduceat(demand, starts)
+    month_idx = np.repeat(np.arange(len(starts)), np.diff(np.append(starts, len(demand))))
+    peak_rows = np.flatnonzero(demand == peaks[month_idx])
+    _, first = np.unique(month_idx[peak_rows], return_index=True)
+    charges[peak_rows[first]] = peaks[month_idx[peak_rows[first]]] * self.demand_charge_per_kW
+    return charges
+
+  def with_demand_charges(self, rollup: Rollup, energy_measure: str, energy_scale: float = 1.0) -> Rollup:
+    """Add the upper bound of the avoided demand charges of an energy measure, times energy_scale, to a rollup as DEMAND_CHARGES.
+
+    The cost measures are left as they are, so the savings only count the energy charges.
+    """
+    if not self.demand_charge_per_kW:
+      return rollup
+    hour_table = dict(rollup.table("hour"))
+    charges = self.demand_charges(hour_table["period"], hour_table[energy_measure] * energy_scale)
+    hour_table[DEMAND_CHARGES] = charges
+    return Rollup.from_hours(rollup.calculator, hour_table)
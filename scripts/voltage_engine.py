@@ -0,0 +1,205 @@
+import logging
+from itertools import chain
+from typing import Dict, Iterable, List, Optional, Tuple
+import numpy as np
+from ingest import parse_timestamps
+from qc import DEFAULT_QC_CONFIG
+from rollups import Rollup
+from tariff import TOU_PREFIX, Tariff
+
+DEFAULT_INTERVAL_HOURS = 1 / 12  # 5-minute logging, used when the interval cannot be inferred
+INTERVAL_SAMPLE_SIZE = 4096  # leading timestamp spacings used to infer the interval, identical for whole-file and chunked runs
+# efficiency_derate_per_percent_deviation is the fractional efficiency loss per 1% voltage deviation, while the
+# mitigated deviation energy is weighted by the deviation as a fraction of nominal, so the derate is scaled by 100.
+PERCENT_PER_UNIT_DEVIATION = 100
+
+class VoltageStabilityEngine:
+    """Vectorized voltage stability savings over full-resolution grid/load voltage series."""
+
+    def __init__(self, config: Dict):
+        self.config = config
+        voltage_config = config["voltage_stability"]
+        self.nominal_voltage = voltage_config["nominal_voltage"]
+        self.voltage_tolerance = voltage_config["voltage_tolerance"]
+        self.cost_per_kWh_mismatch = voltage_config["cost_per_kWh_mismatch"]
+        self.efficiency_derate = voltage_config.get("efficiency_derate_per_percent_deviation", 0.01)  # fraction lost per 1% deviation
+        self.loss_per_unit_deviation = self.efficiency_derate * PERCENT_PER_UNIT_DEVIATION  # fraction lost per 100% deviation
+        self.timestamp_format = voltage_config.get("timestamp_format", "%d/%m/%Y %H:%M")
+        self.site_capacity = config["site_capacity"]
+        self.gap_factor = {**DEFAULT_QC_CONFIG, **config.get("qc", {})}["gap_factor"]  # a longer step, in intervals, ends a sag or swell run
+        self.tariff = Tariff.from_config(config, "voltage_stability")
+
+    def parse_timestamps(self, values: List[str]) -> np.ndarray:
+        """Parse timestamp strings into a datetime64[s] array."""
+        return parse_timestamps(values, self.timestamp_format)
+
+    def align_series(self, grid_timestamps: np.ndarray, grid_voltage: np.ndarray, load_timestamps: np.ndarray, load_voltage: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Sort both series by time and keep only the timestamps present in both."""
+        grid_order = np.argsort(grid_timestamps, kind="stable")
+        load_order = np.argsort(load_timestamps, kind="stable")
+        grid_timestamps, grid_voltage = grid_timestamps[grid_order], grid_voltage[grid_order]
+        load_timestamps, load_voltage = load_timestamps[load_order], load_voltage[load_order]
+        timestamps, grid_idx, load_idx = np.intersect1d(grid_timestamps, load_timestamps, assume_unique=False, return_indices=True)
+        dropped = max(len(grid_timestamps), len(load_timestamps)) - len(timestamps)
+        if dropped:
+            logging.warning(f"Dropped {dropped} voltage samples without a matching grid/load timestamp.")
+        return timestamps, grid_voltage[grid_idx], load_voltage[load_idx]
+
+    def infer_interval_hours(self, timestamps: np.ndarray) -> float:
+        """Infer the logging interval in hours from the median spacing of the leading timestamps."""
+        if len(timestamps) < 2:
+            return DEFAULT_INTERVAL_HOURS
+        deltas = np.diff(timestamps[:INTERVAL_SAMPLE_SIZE + 1]).astype("timedelta64[s]").astype(np.float64)
+        deltas = deltas[deltas > 0]
+        if not len(deltas):
+            return DEFAULT_INTERVAL_HOURS
+        return float(np.median(deltas)) / 3600
+
+    def compute_intervals(self, timestamps: np.ndarray, grid_voltage: np.ndarray, load_voltage: np.ndarray, interval_hours: float) -> Dict[str, np.ndarray]:
+        """Compute ΔV_grid, ΔV_load, the tolerance mask, the mitigated deviation energy and the cost savings for every interval.
+
+        The mitigated deviation energy is the affected energy times the mitigated deviation (ΔV_grid - ΔV_load) / V_nominal.
+        The efficiency loss is efficiency_derate (a fraction) per 1% deviation, so it is priced at
+        loss_per_unit_deviation * cost_per_kWh_mismatch, times the tariff factor of the interval. The default
+        derate of 0.01 prices the mitigated deviation energy at cost_per_kWh_mismatch.
+        """
+        delta_v_grid = np.abs(grid_voltage - self.nominal_voltage)
+        delta_v_load = np.abs(load_voltage - self.nominal_voltage)
+        out_of_tolerance = delta_v_grid > self.voltage_tolerance * self.nominal_voltage
+        energy_mismatch = self.site_capacity * interval_hours
+        mitigated_deviation_energy = np.where(out_of_tolerance, energy_mismatch * (delta_v_grid - delta_v_load) / self.nominal_voltage, 0.0)
+        price_factors = self.tariff.factors(timestamps)
+        cost_savings = mitigated_deviation_energy * self.loss_per_unit_deviation * self.cost_per_kWh_mismatch * price_factors
+        return {
+            "delta_v_grid": delta_v_grid,
+            "delta_v_load": delta_v_load,
+            "out_of_tolerance": out_of_tolerance,
+            "mitigated_deviation_energy": mitigated_deviation_energy,
+            "cost_savings": cost_savings,
+            "price_factors": price_factors
+        }
+
+    def interval_measures(self, intervals: Dict[str, np.ndarray]) -> Dict[str, np.ndarray]:
+        """Return the rollup measures of each interval from compute_intervals()."""
+        measures = {
+            "cost_savings": intervals["cost_savings"],
+            "mitigated_deviation_energy": intervals["mitigated_deviation_energy"],
+            "out_of_tolerance_intervals": intervals["out_of_tolerance"]
+        }
+        if not self.tariff.is_flat:
+            measures[f"{TOU_PREFIX}mitigated_deviation_energy"] = intervals["mitigated_deviation_energy"] * intervals["price_factors"]
+        return measures
+
+    def _max_step(self, interval_hours: float) -> np.timedelta64:
+        """Return the longest timestamp step within a sag or swell run: gap_factor intervals, as the data quality scan marks gaps."""
+        return np.timedelta64(int(self.gap_factor * interval_hours * 3600), "s")
+
+    def _runs(self, mask: np.ndarray, breaks: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """Return start and end (exclusive) indices of contiguous True runs in a mask, also ending a run before each row where breaks is True."""
+        continues = np.zeros(len(mask) + 1, dtype=bool)
+        continues[1:-1] = mask[:-1] & mask[1:] & ~breaks[1:]
+        starts = np.flatnonzero(mask & ~continues[:-1])
+        ends = np.flatnonzero(mask & ~continues[1:]) + 1
+        return starts, ends
+
+    def event_counts(self, timestamps: np.ndarray, grid_voltage: np.ndarray, interval_hours: float) -> Dict[str, Dict]:
+        """Count sag and swell runs in one block of grid voltage, keeping the runs touching the block edges mergeable.
+
+        A run ends at a timestamp step longer than gap_factor intervals, as the readings missing in the gap are unknown.
+        """
+        limit = self.voltage_tolerance * self.nominal_voltage
+        events = {
+            "sag": grid_voltage < self.nominal_voltage - limit,
+            "swell": grid_voltage > self.nominal_voltage + limit
+        }
+        breaks = np.zeros(len(timestamps), dtype=bool)
+        breaks[1:] = np.diff(timestamps) > self._max_step(interval_hours)
+        first_time, last_time = (timestamps[0], timestamps[-1]) if len(timestamps) else (None, None)
+        counts = {}
+        for event_type, mask in events.items():
+            starts, ends = self._runs(mask, breaks)
+            lengths = ends - starts
+            head = int(ends[0]) if len(starts) and starts[0] == 0 else 0
+            tail = int(len(mask) - starts[-1]) if len(starts) and ends[-1] == len(mask) else 0
+            extreme: Optional[float] = None
+            if len(starts):
+                extreme = float(grid_voltage[mask].min() if event_type == "sag" else grid_voltage[mask].max())
+            counts[event_type] = {
+                "events": int(len(starts)),
+                "intervals": int(lengths.sum()),
+                "longest": int(lengths.max()) if len(lengths) else 0,
+                "extreme_voltage": extreme,
+                "head": head,
+                "tail": tail,
+                "full": head == len(mask),
+                "first_time": first_time,
+                "last_time": last_time
+            }
+        return counts
+
+    def merge_event_counts(self, first: Dict[str, Dict], second: Dict[str, Dict], interval_hours: float) -> Dict[str, Dict]:
+        """Merge the event counts of two consecutive blocks, joining a run that crosses the boundary unless there is a gap between the blocks."""
+        merged = {}
+        for event_type, a in first.items():
+            b = second[event_type]
+            contiguous = a["last_time"] is None or b["first_time"] is None or b["first_time"] - a["last_time"] <= self._max_step(interval_hours)
+            joined = contiguous and a["tail"] > 0 and b["head"] > 0
+            extremes = [value for value in (a["extreme_voltage"], b["extreme_voltage"]) if value is not None]
+            merged[event_type] = {
+                "events": a["events"] + b["events"] - int(joined),
+                "intervals": a["intervals"] + b["intervals"],
+                "longest": max(a["longest"], b["longest"], a["tail"] + b["head"] if joined else 0),
+                "extreme_voltage": (min(extremes) if event_type == "sag" else max(extremes)) if extremes else None,
+                "head": a["head"] + b["head"] if a["full"] and contiguous else a["head"],
+                "tail": a["tail"] + b["tail"] if b["full"] and contiguous else b["tail"],
+                "full": a["full"] and b["full"] and contiguous,
+                "first_time": a["first_time"] if a["first_time"] is not None else b["first_time"],
+                "last_time": b["last_time"] if b["last_time"] is not None else a["last_time"]
+            }
+        return merged
+
+    def event_statistics(self, counts: Dict[str, Dict], interval_hours: float) -> Dict[str, Dict[str, float]]:
+        """Summarise sag and swell event counts as numbers of events, durations and extreme voltages."""
+        return {
+            event_type: {
+                "events": count["events"],
+                "total_duration_hours": count["intervals"] * interval_hours,
+                "longest_duration_hours": count["longest"] * interval_hours,
+                "extreme_voltage": count["extreme_voltage"]
+            }
+            for event_type, count in counts.items()
+        }
+
+    def run(self, blocks: Iterable[Tuple[np.ndarray, np.ndarray, np.ndarray]]) -> Dict:
+        """Run the engine over aligned (timestamps, grid, load) blocks and return totals, rollup and event statistics.
+
+        Blocks are buffered only until INTERVAL_SAMPLE_SIZE + 1 timestamps are available to infer the interval, so a
+        chunked run holds at most those leading blocks at once, and a whole-file run its single block.
+        """
+        blocks = iter(blocks)
+        pending = []
+        buffered = 0
+        for block in blocks:
+            pending.append(block)
+            buffered += len(block[0])
+            if buffered > INTERVAL_SAMPLE_SIZE:
+                break
+        leading = np.concatenate([block[0] for block in pending]) if pending else np.array([], dtype="datetime64[s]")
+        interval_hours = self.infer_interval_hours(leading)
+
+        partials = []
+        counts = self.event_counts(np.array([], dtype="datetime64[s]"), np.array([], dtype=np.float64), interval_hours)
+        for timestamps, grid_voltage, load_voltage in chain(pending, blocks):
+            intervals = self.compute_intervals(timestamps, grid_voltage, load_voltage, interval_hours)
+            partials.append(Rollup.from_intervals("Voltage_Stability", timestamps, self.interval_measures(intervals)))
+            counts = self.merge_event_counts(counts, self.event_counts(timestamps, grid_voltage, interval_hours), interval_hours)
+        rollup = self.tariff.with_demand_charges(Rollup.combine("Voltage_Stability", partials), "mitigated_deviation_energy", self.loss_per_unit_deviation)
+        totals = rollup.total()
+        return {
+            "interval_hours": interval_hours,
+            "samples": int(totals.get("intervals", 0)),
+            "out_of_tolerance_intervals": int(totals.get("out_of_tolerance_intervals", 0)),
+            "total_cost_savings": totals.get("cost_savings", 0.0),
+            "rollup": rollup,
+            "events": self.event_statistics(counts, interval_hours)
+        }
@@ -2,22 +2,38 @@ import json
 import logging
 import sys
 from pathlib import Path
-from typing import Dict, List, Tuple, Optional
-import csv
+from typing import Dict, Iterator, List, Tuple, Optional
+import numpy as np
 import xlsxwriter
+from archives import locate
+from chunked import BlockReader, chunk_rows
+from ingest import RejectReport, column_values, parse_numbers, read_table, reject_path
+from memo import ResultCache
+from profiling import profiled
+from qc import QualityScanner, qc_path
+from render import render, render_outputs, render_state_path, save_render_state, summary_formats
+from result_store import record_run
+from rollups import Rollup, rollup_path
+from voltage_engine import VoltageStabilityEngine
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
 class CalculateVoltageStabilitySavings:
+    RENDER_STATE = ("months_list", "rollup", "month_results")  # attributes write_workbook() reads, saved for the render pool
+
     def __init__(self, config_file: str):
         self.config_file = config_file
         self.config = self.load_config()
+        self.rejects = RejectReport()
+        self.quality = QualityScanner(self.config)
         self.months_list = [
             "January", "February", "March", "April", "May", "June",
             "July", "August", "September", "October", "November", "December"
         ]
         self.grid_voltage_data = self.load_voltage_data("Grid-Voltage-Month.csv", "Grid_Voltage_Month")
         self.load_voltage_data = self.load_voltage_data("Load-Voltage-Month.csv", "Load_Voltage_Month")
+        self.engine = VoltageStabilityEngine(self.config)
+        self.month_results: Dict[str, Dict] = {}
 
     def load_config(self) -> Dict:
         """Load configuration from a JSON file."""
@@ -32,29 +48,65 @@ class CalculateVoltageStabilitySavings:
         return config
 
     def load_voltage_data(self, filename: str, voltage_column: str) -> Dict[str, float]:
-        """Load voltage data from CSV file."""
+        """Load voltage data from CSV file, rejecting invalid readings."""
         year = self.config["year"]
-        voltage_file = Path(f"data/voltage_data/{year}/{filename}")
-        if not voltage_file.exists():
+        voltage_file = locate(Path(f"data/voltage_data/{year}/{filename}"))
+        if voltage_file is None:
             logging.warning(f"{filename} does not exist. Skipping.")
             return {}
-        with open(voltage_file, mode='r', newline='') as infile:
-            reader = csv.reader(infile)
-            headers = next(reader)
-            try:
-                voltage_idx = headers.index(voltage_column)
-            except ValueError:
-                logging.error(f"{voltage_column} not found in {filename}.")
-                return {}
-            voltage_data = {}
-            for row in reader:
-                month = row[0]
-                voltage = float(row[voltage_idx])
-                voltage_data[month] = voltage
-        return voltage_data
+        headers, rows = read_table(voltage_file)
+        if voltage_column not in headers:
+            logging.error(f"{voltage_column} not found in {filename}.")
+            return {}
+        values = column_values(rows, headers.index(voltage_column))
+        voltages, valid = parse_numbers(values)
+        self.rejects.record(voltage_file, voltage_column, values, valid, rows)
+        return {str(month): float(voltage) for month, voltage in zip(np.array(column_values(rows, 0))[valid], voltages[valid])}
+
+    def _result_cache(self) -> ResultCache:
+        """Return the result cache entry of this run, keyed on the input files and the config sections this calculator reads."""
+        year = self.config["year"]
+        site = self.config["site"]
+        outputs = [Path(f"results/{year}_{site}_Voltage_Stability_Savings.xlsx"), rollup_path(year, site, "Voltage_Stability"), reject_path(year, site, "Voltage_Stability"), qc_path(year, site, "Voltage_Stability")] + render_outputs(year, site, "Voltage_Stability")
+        return ResultCache(self.config, "Voltage_Stability", ["voltage_stability", "site_capacity", "cost_per_kWh", "tariff", "qc"], [Path(f"data/voltage_data/{year}")], outputs, type(self).__module__)
+
+    def restore_cached_results(self) -> bool:
+        """Restore the outputs of an identical earlier run from the result cache. Returns False on a miss."""
+        self.cache = self._result_cache()
+        if not self.cache.restore():
+            return False
+        self.rollup = Rollup.load(rollup_path(self.config["year"], self.config["site"], "Voltage_Stability"))
+        record_run(self.config, "Voltage_Stability", self.rollup, self.cache, restored=True)
+        return True
 
     def calculate_voltage_stability_savings(self) -> None:
         """Calculate voltage stability savings and write to an XLSX file."""
+        if self.restore_cached_results():
+            return
+        self.compute_month_rollups()
+        self.build_rollup()
+        render(render_state_path(self.config["year"], self.config["site"], "Voltage_Stability"), summary_formats(self.config), self)
+        self.cache.store()
+
+    def compute_month_rollups(self) -> None:
+        """Run the voltage engine over the grid and load voltages of each month."""
+        for month in self.months_list:
+            self._process_month_data(month)
+
+    def build_rollup(self) -> Rollup:
+        """Combine the month rollups, then save the rollup, the reject report, the data quality report and the render state."""
+        year = self.config["year"]
+        site = self.config["site"]
+        self.rollup = Rollup.combine("Voltage_Stability", [result["rollup"] for result in self.month_results.values()])
+        self.rollup.save(rollup_path(year, site, "Voltage_Stability"))
+        self.rejects.write(reject_path(year, site, "Voltage_Stability"))
+        self.quality.write(qc_path(year, site, "Voltage_Stability"))
+        save_render_state(self, "Voltage_Stability")
+        record_run(self.config, "Voltage_Stability", self.rollup, self.cache)
+        return self.rollup
+
+    def write_workbook(self) -> Path:
+        """Write the month sheets and the yearly summary to an XLSX file."""
         year = self.config["year"]
         site = self.config["site"]
         results_dir = Path('results')
@@ -67,55 +119,71 @@ class CalculateVoltageStabilitySavings:
         logging.info(f"Created summary worksheet: {site}_{year}_Savings_Summary.")
 
         for month in self.months_list:
-            self._process_month_data(workbook, month)
+            worksheet = workbook.add_worksheet(f"{site}_{month}_Savings")
+            if month in self.month_results:
+                self._write_calculations_to_worksheet(worksheet, self.month_results[month], month)
 
         self._calculate_year_voltage_savings(workbook)
         workbook.close()
         logging.info(f"Completed calculating voltage stability savings and writing: {file_name}")
+        return file_name
 
-    def _process_month_data(self, workbook: xlsxwriter.Workbook, month: str) -> None:
-        """Process data for a specific month and write to the workbook."""
+    def _process_month_data(self, month: str) -> None:
+        """Process data for a specific month."""
         year = self.config["year"]
-        site = self.config["site"]
-        worksheet = workbook.add_worksheet(f"{site}_{month}_Savings")
-        grid_file_path = Path(f"data/voltage_data/{year}/{month}-Grid-Voltage.csv")
-        load_file_path = Path(f"data/voltage_data/{year}/{month}-Load-Voltage.csv")
-        if not grid_file_path.exists() or not load_file_path.exists():
+        grid_file_path = locate(Path(f"data/voltage_data/{year}/{month}-Grid-Voltage.csv"))
+        load_file_path = locate(Path(f"data/voltage_data/{year}/{month}-Load-Voltage.csv"))
+        if grid_file_path is None or load_file_path is None:
             logging.warning(f"Voltage data files for {month} do not exist. Skipping.")
             return
 
-        with open(grid_file_path, mode='r', newline='') as grid_infile, open(load_file_path, mode='r', newline='') as load_infile:
-            grid_reader = csv.reader(grid_infile)
-            load_reader = csv.reader(load_infile)
-            grid_headers = next(grid_reader)
-            load_headers = next(load_reader)
-            grid_voltage_idx = grid_headers.index("Grid_Voltage")
-            load_voltage_idx = load_headers.index("Load_Voltage")
-
-            self._write_calculations_to_worksheet(worksheet, grid_reader, load_reader, grid_voltage_idx, load_voltage_idx, month)
+        block_rows = chunk_rows(self.config)
+        grid_masked_rows = self.quality.scan(grid_file_path, self.engine.timestamp_format, ["Grid_Voltage"])
+        load_masked_rows = self.quality.scan(load_file_path, self.engine.timestamp_format, ["Load_Voltage"])
+        with BlockReader(grid_file_path, block_rows, self.engine.timestamp_format, rejects=self.rejects, skip_rows=grid_masked_rows) as grid_blocks, BlockReader(load_file_path, block_rows, self.engine.timestamp_format, rejects=self.rejects, skip_rows=load_masked_rows) as load_blocks:
+            month_result = self.engine.run(self._aligned_blocks(grid_blocks, load_blocks))
+        if not month_result["samples"]:
+            logging.warning(f"No matching grid/load voltage samples for {month}. Skipping.")
+            return
 
-    def _write_calculations_to_worksheet(self, worksheet: xlsxwriter.Workbook.worksheet_class, grid_reader: List[List[str]], load_reader: List[List[str]], grid_voltage_idx: int, load_voltage_idx: int, month: str) -> None:
+        self.month_results[month] = month_result
+
+    def _aligned_blocks(self, grid_blocks: BlockReader, load_blocks: BlockReader) -> Iterator[Tuple[np.ndarray, np.ndarray, np.ndarray]]:
+        """Yield aligned (timestamps, grid voltage, load voltage) blocks, reading the load file in step with the grid file."""
+        grid_voltage_idx = grid_blocks.header.index("Grid_Voltage")
+        load_voltage_idx = load_blocks.header.index("Load_Voltage")
+        for grid_timestamps, grid_rows in grid_blocks:
+            load_timestamps, load_rows = load_blocks.read_through(grid_timestamps[-1].astype("datetime64[h]"))
+            grid_timestamps, grid_voltage = self._voltage_column(grid_blocks, grid_timestamps, grid_rows, grid_voltage_idx)
+            load_timestamps, load_voltage = self._voltage_column(load_blocks, load_timestamps, load_rows, load_voltage_idx)
+            yield self.engine.align_series(grid_timestamps, grid_voltage, load_timestamps, load_voltage)
+
+    def _voltage_column(self, blocks: BlockReader, timestamps: np.ndarray, rows: List[List[str]], voltage_idx: int) -> Tuple[np.ndarray, np.ndarray]:
+        """Parse the voltage column of a block and drop the rows with invalid readings."""
+        values = column_values(rows, voltage_idx)
+        voltages, valid = parse_numbers(values)
+        self.rejects.record(blocks.file_path, blocks.header[voltage_idx], values, valid, rows)
+        return timestamps[valid], voltages[valid]
+
+    def _write_calculations_to_worksheet(self, worksheet: xlsxwriter.Workbook.worksheet_class, month_result: Dict, month: str) -> None:
         """Write calculations to the worksheet."""
-        nominal_voltage = self.config["voltage_stability"]["nominal_voltage"]
-        voltage_tolerance = self.config["voltage_stability"]["voltage_tolerance"]
-        cost_per_kWh_mismatch = self.config["voltage_stability"]["cost_per_kWh_mismatch"]
-        efficiency_derate_per_percent_deviation = self.config["voltage_stability"]["efficiency_derate_per_percent_deviation"]
-
-        total_cost_savings = 0
-        for grid_row, load_row in zip(grid_reader, load_reader):
-            grid_voltage = float(grid_row[grid_voltage_idx])
-            load_voltage = float(load_row[load_voltage_idx])
-            delta_v_grid = abs(grid_voltage - nominal_voltage)
-            delta_v_load = abs(load_voltage - nominal_voltage)
-            if delta_v_grid > voltage_tolerance * nominal_voltage:
-                energy_mismatch = self.config["site_capacity"] * (1 / 12)  # Assuming 5-minute intervals
-                cost_savings = energy_mismatch * cost_per_kWh_mismatch * (delta_v_grid - delta_v_load) / nominal_voltage
-                total_cost_savings += cost_savings
-
         worksheet.write(0, 0, "Month")
         worksheet.write(0, 1, "Total Cost Savings")
         worksheet.write(1, 0, month)
-        worksheet.write(1, 1, total_cost_savings)
+        worksheet.write(1, 1, month_result["total_cost_savings"])
+        worksheet.write_column(3, 0, ["Interval (hours)", "Samples", "Out-of-Tolerance Intervals"])
+        worksheet.write_column(3, 1, [month_result["interval_hours"], month_result["samples"], month_result["out_of_tolerance_intervals"]])
+
+        worksheet.write_row(7, 0, ["Event", "Events", "Total Duration (hours)", "Longest Duration (hours)", "Extreme Voltage (V)"])
+        for row_idx, (event_type, stats) in enumerate(month_result["events"].items(), start=8):
+            worksheet.write_row(row_idx, 0, [event_type.capitalize(), stats["events"], stats["total_duration_hours"], stats["longest_duration_hours"], stats["extreme_voltage"]])
+
+        for first_col, level, label in ((0, "day", "Date"), (4, "hour", "Hour")):
+            aggregate = month_result["rollup"].table(level)
+            worksheet.write_row(11, first_col, [label, "Cost Savings", "Out-of-Tolerance Intervals"])
+            worksheet.write_column(12, first_col, aggregate["period"].astype(str).tolist())
+            worksheet.write_column(12, first_col + 1, aggregate["cost_savings"].tolist())
+            worksheet.write_column(12, first_col + 2, aggregate["out_of_tolerance_intervals"].tolist())
         logging.info(f"Calculated voltage stability savings for {month}.")
 
     def _calculate_year_voltage_savings(self, workbook: xlsxwriter.Workbook) -> None:
@@ -137,21 +205,18 @@ class CalculateVoltageStabilitySavings:
 
     def _aggregate_yearly_savings(self, summary_worksheet: xlsxwriter.Workbook.worksheet_class) -> None:
         """Aggregate yearly savings and write to the summary worksheet."""
-        total_yearly_savings = 0
         for row_idx, month in enumerate(self.months_list, start=1):
-            worksheet_name = f"{self.config['site']}_{month}_Savings"
-            worksheet = summary_worksheet.book.get_worksheet_by_name(worksheet_name)
-            if worksheet:
-                total_cost_savings = worksheet.cell(1, 1).value
+            month_row = self.rollup.month_row(row_idx)
+            if month_row:
                 summary_worksheet.write(row_idx, 0, month)
-                summary_worksheet.write(row_idx, 1, total_cost_savings)
-                total_yearly_savings += total_cost_savings
+                summary_worksheet.write(row_idx, 1, month_row["cost_savings"])
 
         summary_worksheet.write(len(self.months_list) + 1, 0, "Yearly Total")
-        summary_worksheet.write(len(self.months_list) + 1, 1, total_yearly_savings)
+        summary_worksheet.write(len(self.months_list) + 1, 1, self.rollup.total().get("cost_savings", 0.0))
         logging.info("Written yearly totals to summary worksheet.")
 
 if __name__ == "__main__":
-    config_file = "config/savings_config.json"
-    calculator = CalculateVoltageStabilitySavings(config_file)
-    calculator.calculate_voltage_stability_savings()
\ No newline at end of file
+    with profiled("voltage_savings"):
+        config_file = "config/savings_config.json"
+        calculator = CalculateVoltageStabilitySavings(config_file)
+        calculator.calculate_voltage_stability_savings()
\ No newline at end of file
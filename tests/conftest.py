@@ -0,0 +1,42 @@
+import csv
+import json
+import sys
+from pathlib import Path
+from typing import Callable, Dict, List, Sequence
+import pytest
+
+REPO_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(REPO_DIR / "scripts"))  # the scripts import their siblings directly, as when run from the repo root
+
+@pytest.fixture
+def config() -> Dict:
+  """Return the repo's example config with the result cache disabled."""
+  with open(REPO_DIR / "config/savings_config.json") as f:
+    config = json.load(f)
+  config["cache"]["enabled"] = False
+  return config
+
+@pytest.fixture
+def site(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> Path:
+  """Run the test in an empty site folder, as the calculators read data/ and write results/ relative to it."""
+  monkeypatch.chdir(tmp_path)
+  return tmp_path
+
+@pytest.fixture
+def write_config(site: Path) -> Callable[[Dict], str]:
+  """Return a function that writes a config to the site folder and returns its path."""
+  def write(config: Dict) -> str:
+    config_path = site / "config/savings_config.json"
+    config_path.parent.mkdir(parents=True, exist_ok=True)
+    config_path.write_text(json.dumps(config))
+    return str(config_path)
+  return write
+
+def write_csv(path: Path, header: Sequence[str], rows: List[Sequence]) -> Path:
+  """Write a CSV input file, creating its folder."""
+  path.parent.mkdir(parents=True, exist_ok=True)
+  with open(path, mode='w', newline='') as outfile:
+    writer = csv.writer(outfile)
+    writer.writerow(header)
+    writer.writerows(rows)
+  return path
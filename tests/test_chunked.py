@@ -0,0 +1,60 @@
+from pathlib import Path
+from typing import Dict, List
+import numpy as np
+import pytest
+from conftest import write_csv
+from power_factor_savings import CalculatePowerFactorSavings
+from rollups import Rollup
+from voltage_savings import CalculateVoltageStabilitySavings
+
+ROWS = 4 * 24 * 60  # four days of 1-minute readings, several blocks of 1000 rows
+
+def _timestamps(rng: np.random.Generator) -> List[str]:
+  """Return 1-minute timestamps in the default timestamp format, with a few stretches missing."""
+  minutes = np.arange(ROWS)
+  minutes = minutes[~((minutes % 1500) < rng.integers(0, 40))]
+  times = np.datetime64("2024-01-01T00:00") + minutes.astype("timedelta64[m]")
+  return [time.item().strftime("%d/%m/%Y %H:%M") for time in times]
+
+def _run(calculator_class, write_config, config: Dict, block_rows: int):
+  """Run a calculator's month rollups with the given chunk size."""
+  calculator = calculator_class(write_config({**config, "chunk_rows": block_rows}))
+  calculator.compute_month_rollups()
+  return calculator
+
+def _assert_same_rollup(whole: Rollup, chunked: Rollup) -> None:
+  """Assert that two rollups have the same totals and hour tables."""
+  assert chunked.total() == pytest.approx(whole.total())
+  whole_hours, chunked_hours = whole.table("hour"), chunked.table("hour")
+  assert sorted(chunked_hours) == sorted(whole_hours)
+  np.testing.assert_array_equal(chunked_hours["period"], whole_hours["period"])
+  for measure, values in whole_hours.items():
+    if measure != "period":
+      np.testing.assert_allclose(chunked_hours[measure], values)
+
+def test_power_factor_chunked_totals_match_whole_file(site: Path, config: Dict, write_config) -> None:
+  rng = np.random.default_rng(1)
+  timestamps = _timestamps(rng)
+  power_factors = np.round(rng.uniform(0.8, 1.0, len(timestamps)), 3).astype(str)
+  power_factors[rng.choice(len(timestamps), 5, replace=False)] = "n/a"
+  write_csv(site / "data/power_factor_data/2024/January-Power-Factor-Data.csv", ["Timestamp", "Power Factor"], list(zip(timestamps, power_factors)))
+
+  whole = _run(CalculatePowerFactorSavings, write_config, config, 0)
+  chunked = _run(CalculatePowerFactorSavings, write_config, config, 1000)
+  assert whole.month_sheets["January"][0] == chunked.month_sheets["January"][0]
+  _assert_same_rollup(whole.month_rollups["January"], chunked.month_rollups["January"])
+
+def test_voltage_chunked_totals_and_events_match_whole_file(site: Path, config: Dict, write_config) -> None:
+  rng = np.random.default_rng(2)
+  timestamps = _timestamps(rng)
+  levels = np.repeat(rng.normal(0, 25, len(timestamps) // 30 + 1), 30)[:len(timestamps)]  # stretches of sags and swells
+  grid = np.round(415 + levels + rng.normal(0, 2, len(timestamps)), 1)
+  load = np.round(415 + rng.normal(0, 5, len(timestamps)), 1)
+  write_csv(site / "data/voltage_data/2024/January-Grid-Voltage.csv", ["Timestamp", "Grid_Voltage"], list(zip(timestamps, grid)))
+  write_csv(site / "data/voltage_data/2024/January-Load-Voltage.csv", ["Timestamp", "Load_Voltage"], list(zip(timestamps, load)))
+
+  whole = _run(CalculateVoltageStabilitySavings, write_config, config, 0).month_results["January"]
+  chunked = _run(CalculateVoltageStabilitySavings, write_config, config, 1000).month_results["January"]
+  _assert_same_rollup(whole["rollup"], chunked["rollup"])
+  assert chunked["events"] == whole["events"]
+  assert whole["events"]["sag"]["events"] > 0
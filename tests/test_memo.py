@@ -0,0 +1,42 @@
+from pathlib import Path
+from typing import Dict
+from conftest import write_csv
+from frequency_savings import CalculateFrequencySavings
+from power_factor_savings import CalculatePowerFactorSavings
+
+CALCULATORS = (CalculatePowerFactorSavings, CalculateFrequencySavings)
+
+def _store_results(config_file: str) -> None:
+  """Store a stand-in workbook of each calculator in the result cache."""
+  for calculator_class in CALCULATORS:
+    cache = calculator_class(config_file)._result_cache()
+    cache.outputs[0].parent.mkdir(parents=True, exist_ok=True)
+    cache.outputs[0].write_text(calculator_class.__name__)
+    cache.store()
+
+def _restored(config_file: str) -> Dict[str, bool]:
+  """Return which calculators the result cache restores."""
+  return {calculator_class.__name__: calculator_class(config_file)._result_cache().restore() for calculator_class in CALCULATORS}
+
+def test_config_change_invalidates_only_its_calculator(site: Path, config: Dict, write_config) -> None:
+  write_csv(site / "data/power_factor_data/2024/January-Power-Factor-Data.csv", ["Timestamp", "Power Factor"], [["01/01/2024 00:00", 0.9]])
+  write_csv(site / "data/frequency_savings_data/2024/January-Frequency-Savings.csv", ["Timestamp", "Frequency Deviation (Hz)"], [["01/01/2024 00:00", 0.1]])
+  config["cache"]["enabled"] = True
+  _store_results(write_config(config))
+  assert _restored(write_config(config)) == {"CalculatePowerFactorSavings": True, "CalculateFrequencySavings": True}
+
+  config["power_factor"]["penalty_rate"] *= 2
+  assert _restored(write_config(config)) == {"CalculatePowerFactorSavings": False, "CalculateFrequencySavings": True}
+
+  config["qc"]["outlier_MADs"] += 1
+  assert _restored(write_config(config)) == {"CalculatePowerFactorSavings": False, "CalculateFrequencySavings": False}
+
+def test_input_change_invalidates_only_its_calculator(site: Path, config: Dict, write_config) -> None:
+  power_factor_file = write_csv(site / "data/power_factor_data/2024/January-Power-Factor-Data.csv", ["Timestamp", "Power Factor"], [["01/01/2024 00:00", 0.9]])
+  write_csv(site / "data/frequency_savings_data/2024/January-Frequency-Savings.csv", ["Timestamp", "Frequency Deviation (Hz)"], [["01/01/2024 00:00", 0.1]])
+  config["cache"]["enabled"] = True
+  config_file = write_config(config)
+  _store_results(config_file)
+
+  write_csv(power_factor_file, ["Timestamp", "Power Factor"], [["01/01/2024 00:00", 0.8]])
+  assert _restored(config_file) == {"CalculatePowerFactorSavings": False, "CalculateFrequencySavings": True}
@@ -0,0 +1,40 @@
+from typing import Dict
+import numpy as np
+import pytest
+from tariff import Tariff
+
+def _tariff(config: Dict) -> Tariff:
+  """Return the time-of-use tariff of the example config, applied to the harmonics calculator."""
+  config["tariff"]["enabled"] = True
+  return Tariff.from_config(config, "harmonics")
+
+def _period_names(tariff: Tariff, timestamps) -> list:
+  return [tariff.period_names[period] for period in tariff.periods(np.array(timestamps, dtype="datetime64[s]"))]
+
+def test_weekday_periods(config: Dict) -> None:
+  tariff = _tariff(config)
+  # 2024-01-02 is a Tuesday
+  assert _period_names(tariff, ["2024-01-02T05:59", "2024-01-02T06:00", "2024-01-02T16:59", "2024-01-02T17:00", "2024-01-02T21:59", "2024-01-02T22:00"]) == ["off_peak", "standard", "standard", "peak", "peak", "off_peak"]
+
+def test_saturday_and_sunday_periods(config: Dict) -> None:
+  tariff = _tariff(config)
+  # 2024-01-06 is a Saturday and 2024-01-07 a Sunday
+  assert _period_names(tariff, ["2024-01-06T05:00", "2024-01-06T06:00", "2024-01-06T18:00", "2024-01-06T22:00"]) == ["off_peak", "standard", "standard", "off_peak"]
+  assert _period_names(tariff, ["2024-01-07T06:00", "2024-01-07T18:00"]) == ["off_peak", "off_peak"]
+
+def test_holidays_follow_the_sunday_schedule(config: Dict) -> None:
+  tariff = _tariff(config)
+  # 2024-01-01 (Monday), 2024-03-29 (Friday) and 2024-06-01 (Saturday) are holidays
+  assert _period_names(tariff, ["2024-01-01T18:00", "2024-03-29T18:00", "2024-06-01T12:00"]) == ["off_peak", "off_peak", "off_peak"]
+  assert _period_names(tariff, ["2024-01-08T18:00", "2024-03-28T18:00", "2024-06-08T12:00"]) == ["peak", "peak", "standard"]
+
+def test_factors_are_rates_over_the_reference_rate(config: Dict) -> None:
+  tariff = _tariff(config)
+  factors = tariff.factors(np.array(["2024-01-02T03:00", "2024-01-02T12:00", "2024-01-02T18:00"], dtype="datetime64[s]"))
+  assert factors == pytest.approx([0.09 / 0.15, 1.0, 0.24 / 0.15])
+
+def test_sections_outside_apply_to_are_flat(config: Dict) -> None:
+  config["tariff"]["enabled"] = True
+  tariff = Tariff.from_config(config, "power_factor")
+  assert tariff.is_flat
+  assert tariff.factors(np.array(["2024-01-02T18:00"], dtype="datetime64[s]")).tolist() == [1.0]
@@ -0,0 +1,50 @@
+from typing import Dict, List
+import numpy as np
+import pytest
+from voltage_engine import VoltageStabilityEngine
+
+INTERVAL_HOURS = 1 / 60
+SAG, NORMAL, SWELL = 380.0, 415.0, 450.0
+
+@pytest.fixture
+def engine(config: Dict) -> VoltageStabilityEngine:
+  return VoltageStabilityEngine(config)
+
+def _block(start_minute: int, voltages: List[float]) -> tuple:
+  """Return the timestamps and grid voltages of a block of 1-minute readings."""
+  timestamps = np.datetime64("2024-01-01T00:00", "s") + (start_minute + np.arange(len(voltages))) * np.timedelta64(60, "s")
+  return timestamps, np.array(voltages)
+
+def _merged(engine: VoltageStabilityEngine, blocks: List[tuple]) -> Dict[str, Dict]:
+  """Count the events of consecutive blocks and merge them in order."""
+  counts = engine.event_counts(np.array([], dtype="datetime64[s]"), np.array([]), INTERVAL_HOURS)
+  for timestamps, voltages in blocks:
+    counts = engine.merge_event_counts(counts, engine.event_counts(timestamps, voltages, INTERVAL_HOURS), INTERVAL_HOURS)
+  return counts
+
+def test_run_crossing_a_block_boundary_is_one_event(engine: VoltageStabilityEngine) -> None:
+  voltages = [NORMAL, SAG, SAG, SAG, NORMAL, SWELL, SAG, SAG]
+  whole = _merged(engine, [_block(0, voltages)])
+  split = _merged(engine, [_block(0, voltages[:3]), _block(3, voltages[3:])])
+  assert split["sag"]["events"] == whole["sag"]["events"] == 2
+  assert split["sag"]["longest"] == whole["sag"]["longest"] == 3
+  assert split["sag"]["intervals"] == whole["sag"]["intervals"] == 5
+  assert split["swell"]["events"] == 1
+
+def test_run_spanning_a_whole_block_joins_its_neighbours(engine: VoltageStabilityEngine) -> None:
+  split = _merged(engine, [_block(0, [NORMAL, SWELL]), _block(2, [SWELL, SWELL]), _block(4, [SWELL, NORMAL])])
+  assert split["swell"]["events"] == 1
+  assert split["swell"]["longest"] == 4
+  assert split["swell"]["extreme_voltage"] == SWELL
+
+def test_gap_between_blocks_ends_a_run(engine: VoltageStabilityEngine) -> None:
+  split = _merged(engine, [_block(0, [NORMAL, SAG, SAG]), _block(10, [SAG, NORMAL])])
+  assert split["sag"]["events"] == 2
+  assert split["sag"]["longest"] == 2
+
+def test_gap_within_a_block_ends_a_run(engine: VoltageStabilityEngine) -> None:
+  timestamps, _ = _block(0, [NORMAL] * 6)
+  timestamps[3:] += np.timedelta64(600, "s")
+  counts = engine.event_counts(timestamps, np.array([NORMAL, SAG, SAG, SAG, SAG, NORMAL]), INTERVAL_HOURS)
+  assert counts["sag"]["events"] == 2
+  assert counts["sag"]["longest"] == 2